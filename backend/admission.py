@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency for one class of routes, with a bounded, time-limited queue.
+
+    Up to max_concurrent requests run at once; the next max_queue wait in
+    FIFO order for at most queue_timeout seconds. A request that finds the
+    queue full, or runs out of queue time, is turned away (Overloaded)
+    instead of piling up on worker threads and database connections.
+    Lives on the event loop, so no locking is needed.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.max_queue_depth = 0
+        self.queue_wait_seconds = 0.0
+        # Moving average of how long an admitted request holds its slot, for Retry-After
+        self.service_seconds = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Rough seconds until the current queue has drained"""
+        return max(1, math.ceil(self.service_seconds * (len(self._waiters) + 1) / self.max_concurrent))
+
+    async def acquire(self):
+        """Wait for a slot; returns seconds spent queued"""
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Overloaded("queue full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        started = time.monotonic()
+        try:
+            await asyncio.wait([waiter], timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client went away while queued; hand on the slot if we had just been given it
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        waited = time.monotonic() - started
+        if not waiter.done():
+            self._waiters.remove(waiter)
+            waiter.cancel()
+            self.rejected_timeout += 1
+            raise Overloaded("queue timeout", self.retry_after())
+        # release() handed its slot straight to us; in_flight already counts it
+        self.admitted += 1
+        self.queue_wait_seconds += waited
+        return waited
+
+    def release(self, service_seconds=None):
+        if service_seconds is not None:
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * service_seconds if self.service_seconds else service_seconds
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+        else:
+            self.in_flight -= 1
+
+    def metrics(self):
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_queue_wait_ms": round(self.queue_wait_seconds / self.admitted * 1000, 2) if self.admitted else None,
+            "avg_service_ms": round(self.service_seconds * 1000, 2),
+        }
+
+
+class AdmissionMiddleware:
+    """Routes requests through the AdmissionController of their route class.
+
+    route_classes is [(controller, path_prefixes)]; a path matches a prefix
+    exactly or below it ("/transfer" but not "/transfers"). Unmatched paths
+    are not limited. Rejections are a 503 with Retry-After.
+    """
+
+    def __init__(self, app, route_classes):
+        self.app = app
+        self.route_classes = route_classes
+
+    def _controller(self, path):
+        for controller, prefixes in self.route_classes:
+            for prefix in prefixes:
+                if path == prefix or path.startswith(prefix + "/"):
+                    return controller
+        return None
+
+    async def __call__(self, scope, receive, send):
+        controller = self._controller(scope["path"]) if scope["type"] == "http" and scope["method"] != "OPTIONS" else None
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await controller.acquire()
+        except Overloaded as e:
+            logger.warning(f"Admission rejected ({controller.name}, {e.reason}): path={scope['path']}, retry_after={e.retry_after}s")
+            body = json.dumps({"detail": "Service is busy, please retry later"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(e.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.monotonic() - started)
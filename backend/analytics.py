@@ -0,0 +1,173 @@
+import logging
+from itertools import islice
+
+import numpy as np
+
+from history import archived_rows
+from ledger import CREDIT_TYPES
+from money import format_cents
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_QUERY = '''
+    SELECT type, amount_cents, new_balance_cents, timestamp
+    FROM transactions WHERE username = %s ORDER BY id
+'''
+
+
+class AccountAnalytics:
+    """Vectorized account metrics computed chunk by chunk.
+
+    Each chunk of ledger rows is turned into NumPy columns once; totals,
+    daily net flow, daily closing balances and anomaly statistics are
+    then updated with array operations, carrying only small running
+    state between chunks so very long histories never need to be held
+    in memory as Python tuples.
+    """
+
+    def __init__(self, anomaly_threshold=4.0, min_history=20):
+        self.anomaly_threshold = anomaly_threshold
+        self.min_history = min_history
+        self.type_codes = {}
+        self.type_totals = np.zeros(0, dtype=np.int64)
+        self.type_counts = np.zeros(0, dtype=np.int64)
+        self.count = 0
+        # Running sums of amounts seen so far, for prior-history z-scores
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._day_parts = []
+        self.anomalies = []
+
+    def add_chunk(self, rows):
+        n = len(rows)
+        if n == 0:
+            return
+        codes = np.fromiter((self.type_codes.setdefault(r[0], len(self.type_codes)) for r in rows), dtype=np.int64, count=n)
+        amounts = np.fromiter((r[1] for r in rows), dtype=np.int64, count=n)
+        balances = np.fromiter((r[2] for r in rows), dtype=np.int64, count=n)
+        timestamps = np.array([r[3] for r in rows], dtype="datetime64[s]")
+
+        # Per-type totals and counts (exact integer sums)
+        k = len(self.type_codes)
+        if len(self.type_totals) < k:
+            self.type_totals = np.pad(self.type_totals, (0, k - len(self.type_totals)))
+            self.type_counts = np.pad(self.type_counts, (0, k - len(self.type_counts)))
+        np.add.at(self.type_totals, codes, amounts)
+        self.type_counts += np.bincount(codes, minlength=k)
+
+        # Daily net flow and closing balance; partial days at chunk edges are merged in finish()
+        credit_codes = [code for type_, code in self.type_codes.items() if type_ in CREDIT_TYPES]
+        signed = np.where(np.isin(codes, credit_codes), amounts, -amounts)
+        days = timestamps.astype("datetime64[D]")
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        net = np.zeros(len(unique_days), dtype=np.int64)
+        np.add.at(net, inverse, signed)
+        # Index of the last row of each day (rows are in id order)
+        last_index = n - 1 - np.unique(days[::-1], return_index=True)[1]
+        self._day_parts.append((unique_days, net, balances[last_index]))
+
+        # Anomalies: compare each amount with the mean/std of everything before it
+        values = amounts.astype(np.float64)
+        prior_n = self.count + np.arange(n)
+        prior_sum = self._sum + np.concatenate(([0.0], np.cumsum(values)[:-1]))
+        prior_sumsq = self._sumsq + np.concatenate(([0.0], np.cumsum(values * values)[:-1]))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = prior_sum / prior_n
+            std = np.sqrt(np.maximum(prior_sumsq / prior_n - mean * mean, 0.0))
+            z = (values - mean) / std
+        # Under half a cent of spread means one repeated amount (float error keeps std from being exactly 0);
+        # there, any larger amount is an outlier and has no meaningful z-score
+        constant = std < 0.5
+        outlier = np.where(constant, values > mean + 0.5, z > self.anomaly_threshold)
+        flagged = np.nonzero((prior_n >= self.min_history) & outlier)[0]
+        for i in flagged:
+            self.anomalies.append((rows[i], None if constant[i] else float(z[i])))
+
+        self.count += n
+        self._sum += float(values.sum())
+        self._sumsq += float((values * values).sum())
+
+    def finish(self, max_points=365, max_anomalies=50):
+        names = sorted(self.type_codes, key=self.type_codes.get)
+        totals = {
+            name: {"amount": format_cents(int(self.type_totals[code])), "count": int(self.type_counts[code])}
+            for code, name in enumerate(names)
+        }
+
+        daily = []
+        if self._day_parts:
+            days = np.concatenate([part[0] for part in self._day_parts])
+            nets = np.concatenate([part[1] for part in self._day_parts])
+            closings = np.concatenate([part[2] for part in self._day_parts])
+            unique_days, inverse = np.unique(days, return_inverse=True)
+            net = np.zeros(len(unique_days), dtype=np.int64)
+            np.add.at(net, inverse, nets)
+            # Later chunks come later in the ledger, so the last occurrence of a day holds its closing balance
+            last_index = len(days) - 1 - np.unique(days[::-1], return_index=True)[1]
+            closing = closings[last_index]
+            # Moving averages over calendar days: days without activity count as zero net flow
+            offsets = (unique_days - unique_days[0]).astype(np.int64)
+            calendar_net = np.zeros(offsets[-1] + 1, dtype=np.int64)
+            calendar_net[offsets] = net
+            ma7 = _moving_average(calendar_net, 7)[offsets]
+            ma30 = _moving_average(calendar_net, 30)[offsets]
+            # Keep the most recent max_points days for charting
+            start = max(len(unique_days) - max_points, 0)
+            for i in range(start, len(unique_days)):
+                daily.append({
+                    "date": str(unique_days[i]),
+                    "net_flow": format_cents(int(net[i])),
+                    "net_flow_ma7": round(float(ma7[i]) / 100, 2),
+                    "net_flow_ma30": round(float(ma30[i]) / 100, 2),
+                    "closing_balance": format_cents(int(closing[i])),
+                })
+
+        anomalies = [
+            {
+                "type": row[0],
+                "amount": format_cents(row[1]),
+                "timestamp": row[3].isoformat(),
+                "z_score": round(z, 2) if z is not None else None,
+            }
+            for row, z in self.anomalies[-max_anomalies:][::-1]
+        ]
+        return {
+            "transaction_count": self.count,
+            "totals_by_type": totals,
+            "daily": daily,
+            "anomalies": anomalies,
+        }
+
+
+def _moving_average(values, window):
+    """Trailing moving average; the first window-1 points average what is available"""
+    csum = np.cumsum(values, dtype=np.float64)
+    shifted = np.concatenate((np.zeros(window), csum[:-window])) if len(values) > window else np.zeros(len(values))
+    sizes = np.minimum(np.arange(1, len(values) + 1), window)
+    return (csum - shifted[:len(values)]) / sizes
+
+
+def compute_account_analytics(conn, username, chunk_size=50000, archive=None):
+    """Stream an account's ledger through a server-side cursor and compute its analytics.
+
+    Months moved to cold storage come first (they are older than every live
+    row) and are read from archive; without one, history.ArchiveUnavailable
+    is raised rather than analytics over part of the ledger.
+    """
+    analytics = AccountAnalytics()
+    archived = ((type_, amount, new_balance, timestamp) for type_, amount, _, new_balance, timestamp, _, _, _ in archived_rows(conn.cursor(), archive, username))
+    while True:
+        rows = list(islice(archived, chunk_size))
+        if not rows:
+            break
+        analytics.add_chunk(rows)
+    with conn.cursor(name="account_analytics") as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(ANALYTICS_QUERY, (username,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            analytics.add_chunk(rows)
+    logger.info(f"Analytics computed: username={username}, rows={analytics.count}")
+    return analytics.finish()
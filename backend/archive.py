@@ -0,0 +1,186 @@
+import logging
+import os
+import uuid
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from psycopg2.extras import execute_values
+from pyarrow import fs
+
+from partitions import add_months, is_partitioned, list_partitions, month_start, partition_name
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("username", pa.string()),
+    ("type", pa.string()),
+    ("amount_cents", pa.int64()),
+    ("old_balance_cents", pa.int64()),
+    ("new_balance_cents", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("description", pa.string()),
+    ("other_user", pa.string()),
+])
+
+# Order of history.HISTORY_COLUMNS_SQL, so archived rows render like live ones
+HISTORY_FIELDS = ("type", "amount_cents", "old_balance_cents", "new_balance_cents", "timestamp", "description", "other_user", "id")
+
+ARCHIVES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS transaction_archives (
+        month DATE PRIMARY KEY,
+        path TEXT NOT NULL,
+        row_count BIGINT NOT NULL,
+        min_id BIGINT,
+        max_id BIGINT,
+        size_bytes BIGINT NOT NULL,
+        archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Which archived months hold rows for a user, so reads open only those files
+ARCHIVE_USERS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS transaction_archive_users (
+        username VARCHAR(255) NOT NULL,
+        month DATE NOT NULL REFERENCES transaction_archives (month),
+        row_count INTEGER NOT NULL,
+        PRIMARY KEY (username, month)
+    )
+'''
+
+
+def create_tables(cursor):
+    cursor.execute(ARCHIVES_TABLE_SQL)
+    cursor.execute(ARCHIVE_USERS_TABLE_SQL)
+
+
+class TransactionArchive:
+    """Old months of the ledger kept as Parquet files outside the database.
+
+    uri is anything pyarrow.fs understands: a local directory, file://,
+    s3:// or gs://. Each archived month is one zstd-compressed file sorted
+    by username and id, so row-group statistics let a per-user read skip
+    almost everything. The transaction_archives manifest and its per-user
+    index live in Postgres and are swapped in atomically with dropping
+    the month's partition.
+    """
+
+    def __init__(self, uri, row_group_size=50000):
+        if "://" in uri:
+            self.filesystem, self.root = fs.FileSystem.from_uri(uri)
+        else:
+            self.filesystem, self.root = fs.LocalFileSystem(), os.path.abspath(uri)
+        self.row_group_size = row_group_size
+
+    def month_path(self, month: date) -> str:
+        return f"{self.root}/transactions/{month.year:04d}/{partition_name(month)}.parquet"
+
+    def _write_month(self, conn, month):
+        """Export one partition to Parquet; returns (path, rows, min_id, max_id, size_bytes, rows_per_user)"""
+        path = self.month_path(month)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+        user_counts = {}
+        count, min_id, max_id = 0, None, None
+        with conn.cursor(name=f"archive_{partition_name(month)}") as cursor:
+            cursor.itersize = self.row_group_size
+            cursor.execute(
+                f'''SELECT id, username, type, amount_cents, old_balance_cents, new_balance_cents,
+                           timestamp, description, other_user
+                    FROM {partition_name(month)} ORDER BY username, id'''
+            )
+            with pq.ParquetWriter(tmp_path, ARCHIVE_SCHEMA, compression="zstd", filesystem=self.filesystem) as writer:
+                while True:
+                    rows = cursor.fetchmany(self.row_group_size)
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array(values, type=field.type) for values, field in zip(columns, ARCHIVE_SCHEMA)],
+                        schema=ARCHIVE_SCHEMA
+                    ))
+                    count += len(rows)
+                    min_id = min(columns[0]) if min_id is None else min(min_id, min(columns[0]))
+                    max_id = max(columns[0]) if max_id is None else max(max_id, max(columns[0]))
+                    for username in columns[1]:
+                        user_counts[username] = user_counts.get(username, 0) + 1
+
+        written = pq.read_metadata(tmp_path, filesystem=self.filesystem).num_rows
+        if written != count:
+            self.filesystem.delete_file(tmp_path)
+            raise RuntimeError(f"Archive verification failed for {partition_name(month)}: wrote {written} of {count} rows")
+        self.filesystem.move(tmp_path, path)
+        size = self.filesystem.get_file_info(path).size
+        return path, count, min_id, max_id, size, user_counts
+
+    def archive_month(self, conn, month: date):
+        """Move one month partition into the archive and drop it from the database"""
+        table = partition_name(month)
+        cursor = conn.cursor()
+        # Creating/dropping partitions locks the parent; don't queue ledger writes behind us
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        # Freeze the partition for the export (reads continue)
+        cursor.execute(f"LOCK TABLE {table} IN SHARE MODE")
+        path, count, min_id, max_id, size, user_counts = self._write_month(conn, month)
+        cursor.execute(
+            '''INSERT INTO transaction_archives (month, path, row_count, min_id, max_id, size_bytes)
+               VALUES (%s, %s, %s, %s, %s, %s)''',
+            (month, path, count, min_id, max_id, size)
+        )
+        if user_counts:
+            execute_values(
+                cursor,
+                "INSERT INTO transaction_archive_users (username, month, row_count) VALUES %s",
+                [(username, month, n) for username, n in user_counts.items()]
+            )
+        cursor.execute(f"DROP TABLE {table}")
+        conn.commit()
+        logger.info(f"Archived transactions partition: {table}, rows={count}, bytes={size}, path={path}")
+        return count
+
+    def archive_old_partitions(self, connect, keep_months=18):
+        """Archive every month partition older than keep_months, oldest first"""
+        cutoff = add_months(month_start(date.today()), -keep_months)
+        with connect() as conn:
+            cursor = conn.cursor()
+            if not is_partitioned(cursor):
+                logger.warning("Transactions table is not partitioned; run `python partitions.py migrate` before archiving")
+                return 0
+            months = [month for month, _ in list_partitions(cursor) if month < cutoff]
+            conn.rollback()
+            archived = 0
+            for month in months:
+                archived += self.archive_month(conn, month)
+        return archived
+
+    def archived_months(self, cursor, username):
+        """[(month, path)] of archive files holding rows for username, newest first"""
+        cursor.execute(
+            '''SELECT u.month, a.path FROM transaction_archive_users u
+               JOIN transaction_archives a ON a.month = u.month
+               WHERE u.username = %s ORDER BY u.month DESC''',
+            (username,)
+        )
+        return cursor.fetchall()
+
+    def read_user_rows(self, path, username):
+        """A user's archived rows from one file, in history column order, newest first"""
+        table = pq.read_table(path, filesystem=self.filesystem, columns=list(HISTORY_FIELDS), filters=[("username", "=", username)])
+        columns = [table.column(name).to_pylist() for name in HISTORY_FIELDS]
+        rows = list(zip(*columns))
+        rows.sort(key=lambda row: (row[4], row[7]), reverse=True)
+        return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection, TRANSACTION_ARCHIVE_URI, TRANSACTION_ARCHIVE_AFTER_MONTHS
+
+    parser = argparse.ArgumentParser(description="Move old transactions partitions to Parquet cold storage")
+    parser.add_argument("--uri", default=TRANSACTION_ARCHIVE_URI, help="archive location (directory, file://, s3://, gs://)")
+    parser.add_argument("--keep-months", type=int, default=TRANSACTION_ARCHIVE_AFTER_MONTHS)
+    args = parser.parse_args()
+    if not args.uri:
+        parser.error("set TRANSACTION_ARCHIVE_URI or pass --uri")
+    TransactionArchive(args.uri).archive_old_partitions(get_db_connection, args.keep_months)
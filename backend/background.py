@@ -0,0 +1,45 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run a function every interval_seconds on a daemon thread"""
+
+    def __init__(self, name, interval_seconds, func):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self.runs = 0
+        self.last_run_at = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"Background task started: {self.name} (every {self.interval_seconds}s)")
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        logger.info(f"Background task stopped: {self.name}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.func()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Background task {self.name} failed: {e}")
+            self.runs += 1
+            self.last_run_at = time.time()
+            self._stop.wait(self.interval_seconds)
@@ -0,0 +1,134 @@
+# Sharded balance counters for hot receiving accounts.
+#
+# An account with balance_shard_count = N > 0 keeps its balance as
+# users.balance_cents plus N rows in balance_shards. Credits land on one shard
+# row picked by hash, so concurrent incoming transfers lock different rows
+# instead of queueing on users. Debits lock the main row and every shard,
+# check the total and fold the shards back into the main row.
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+BALANCE_SHARDS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS balance_shards (
+        username VARCHAR(255) NOT NULL,
+        shard INTEGER NOT NULL,
+        balance_cents BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, shard)
+    )
+'''
+
+# Total balance (main row plus shards) for one user
+TOTAL_BALANCE_SQL = '''
+    SELECT (u.balance_cents + COALESCE((SELECT SUM(s.balance_cents) FROM balance_shards s WHERE s.username = u.username), 0))::BIGINT
+    FROM users u WHERE u.{column} = %s
+'''
+
+
+def create_tables(cursor):
+    cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS balance_shard_count INTEGER NOT NULL DEFAULT 0")
+    cursor.execute(BALANCE_SHARDS_TABLE_SQL)
+
+
+def total_balance_sql(column="username"):
+    """SELECT returning main balance plus shards, filtered on users.<column>"""
+    return TOTAL_BALANCE_SQL.format(column=column)
+
+
+def shard_for(key: str, shard_count: int) -> int:
+    return zlib.crc32(key.encode()) % shard_count
+
+
+def credit(cursor, username, shard_count, amount, key):
+    """Add amount to one shard row; returns (old_total, new_total)"""
+    shard = shard_for(key, shard_count)
+    cursor.execute(
+        '''INSERT INTO balance_shards (username, shard, balance_cents) VALUES (%s, %s, %s)
+           ON CONFLICT (username, shard) DO UPDATE SET balance_cents = balance_shards.balance_cents + EXCLUDED.balance_cents''',
+        (username, shard, amount)
+    )
+    cursor.execute(total_balance_sql(), (username,))
+    new_total = cursor.fetchone()[0]
+    return new_total - amount, new_total
+
+
+def _lock_and_fold(cursor, username):
+    """Lock the main row and all shards, move shard balances into the main row; returns the total"""
+    cursor.execute("SELECT balance_cents FROM users WHERE username = %s FOR UPDATE", (username,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute(
+        "SELECT shard, balance_cents FROM balance_shards WHERE username = %s ORDER BY shard FOR UPDATE",
+        (username,)
+    )
+    shards = cursor.fetchall()
+    folded = [shard for shard, cents in shards if cents != 0]
+    total = row[0] + sum(cents for _, cents in shards)
+    if folded:
+        # Only zero the rows we hold locks on; shard rows created meanwhile keep their credits
+        cursor.execute(
+            "UPDATE balance_shards SET balance_cents = 0 WHERE username = %s AND shard = ANY(%s)",
+            (username, folded)
+        )
+        cursor.execute("UPDATE users SET balance_cents = %s WHERE username = %s", (total, username))
+    return total
+
+
+def debit(cursor, username, amount):
+    """Subtract amount under lock; returns (old_total, new_total) or None if funds are insufficient"""
+    total = _lock_and_fold(cursor, username)
+    if total is None or total < amount:
+        return None
+    cursor.execute("UPDATE users SET balance_cents = %s WHERE username = %s", (total - amount, username))
+    return total, total - amount
+
+
+def compact(connect, batch_size=100):
+    """Fold non-zero shards into their main rows, one short transaction per account"""
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT username FROM balance_shards WHERE balance_cents <> 0 LIMIT %s",
+            (batch_size,)
+        )
+        usernames = [r[0] for r in cursor.fetchall()]
+        conn.rollback()
+        for username in usernames:
+            _lock_and_fold(cursor, username)
+            conn.commit()
+    if usernames:
+        logger.info(f"Compacted balance shards for {len(usernames)} accounts")
+    return len(usernames)
+
+
+def set_shard_count(connect, email, shard_count):
+    """Enable (N > 0) or disable (0) sharded balances for an account"""
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT username FROM users WHERE email = %s", (email,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"User not found: {email}")
+        username = row[0]
+        _lock_and_fold(cursor, username)
+        cursor.execute("DELETE FROM balance_shards WHERE username = %s AND shard >= %s AND balance_cents = 0", (username, shard_count))
+        cursor.execute(
+            "INSERT INTO balance_shards (username, shard) SELECT %s, g FROM generate_series(0, %s - 1) g ON CONFLICT DO NOTHING",
+            (username, shard_count)
+        )
+        cursor.execute("UPDATE users SET balance_shard_count = %s WHERE username = %s", (shard_count, username))
+        conn.commit()
+    logger.info(f"Balance shard count set: email={email}, shards={shard_count}")
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Enable or disable sharded balances for a hot account")
+    parser.add_argument("email")
+    parser.add_argument("shards", type=int, help="number of shard rows (0 disables sharding)")
+    args = parser.parse_args()
+    set_shard_count(get_db_connection, args.email, args.shards)
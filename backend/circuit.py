@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fail fast while a dependency is down.
+
+    After failure_threshold consecutive failures the circuit opens and
+    before() raises CircuitOpenError immediately. Once reset_seconds have
+    passed it goes half-open: a single caller is let through as a probe
+    while everyone else keeps failing fast. The probe's success closes the
+    circuit; its failure opens it for another reset_seconds.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Call before each attempt; raises CircuitOpenError instead of letting it through"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.state == OPEN and waited >= self.reset_seconds:
+                self.state = HALF_OPEN
+                logger.info(f"Circuit {self.name} half-open, probing")
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self.name, max(1.0, self.reset_seconds - waited))
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed after a successful probe")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    self.times_opened += 1
+                    logger.error(f"Circuit {self.name} opened after {self.consecutive_failures} consecutive failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_for_seconds": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else None,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessChecker:
+    """Database readiness, checked on a background interval and served from memory.
+
+    check() runs `SELECT 1` and records the outcome and latency; probes
+    read the cached result, so however often the load balancer asks, the
+    database sees one query per interval. A result older than
+    max_age_seconds counts as not ready (the checker itself is stuck).
+    """
+
+    def __init__(self, connect, max_age_seconds=30.0):
+        self.connect = connect
+        self.max_age_seconds = max_age_seconds
+        self._result = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        started = time.monotonic()
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+            logger.warning(f"Readiness check failed: {e}")
+        with self._lock:
+            previous = self._result
+            self._result = {
+                "ok": ok,
+                "latency_ms": round((time.monotonic() - started) * 1000, 1),
+                "checked_at": time.time(),
+                "error": error,
+            }
+        if previous is not None and previous["ok"] != ok:
+            logger.info(f"Readiness changed: ready={ok}")
+
+    def status(self):
+        """(ready, details) from the last check"""
+        with self._lock:
+            result = dict(self._result) if self._result else None
+        if result is None:
+            return False, {"ok": False, "error": "not checked yet"}
+        result["age_seconds"] = round(time.time() - result["checked_at"], 1)
+        return result["ok"] and result["age_seconds"] <= self.max_age_seconds, result
+
+
+class BacklogMonitor:
+    """Work-queue backlogs (outbox events, pending sagas) queried on a background interval.
+
+    queries maps a name to query(cursor) -> dict; check() runs them all on
+    one connection and status() serves the cached figures, so a metrics
+    scrape never reaches the database.
+    """
+
+    def __init__(self, connect, queries):
+        self.connect = connect
+        self.queries = queries
+        self._result = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        try:
+            with self.connect() as conn:
+                cursor = conn.cursor()
+                figures = {name: query(cursor) for name, query in self.queries.items()}
+        except Exception as e:
+            logger.warning(f"Backlog check failed: {e}")
+            figures = {name: {"error": str(e)} for name in self.queries}
+        with self._lock:
+            self._result = (figures, time.time())
+
+    def status(self, name):
+        """The last figures for one query, with their age"""
+        with self._lock:
+            result = self._result
+        if result is None:
+            return {"error": "not checked yet"}
+        figures, checked_at = result
+        return {**figures[name], "age_seconds": round(time.time() - checked_at, 1)}
@@ -0,0 +1,317 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from partitions import add_months, hot_months
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS_SQL = "type, amount_cents, old_balance_cents, new_balance_cents, timestamp, description, other_user, id"
+
+
+def encode_cursor(row) -> str:
+    """Page cursor pointing just past row (timestamp and id are its last two sort keys)"""
+    return f"{row[4].isoformat()}|{row[7]}"
+
+
+def decode_cursor(value: str):
+    timestamp, id_ = value.rsplit("|", 1)
+    return datetime.fromisoformat(timestamp), int(id_)
+
+
+def filter_sql(filters):
+    """SQL conditions (each prefixed with AND) and their args for a history filter dict.
+
+    Keys, all optional: type, start and end (timestamps, end exclusive),
+    min_amount and max_amount (cents, inclusive), counterparty (other_user)
+    and q (case-insensitive substring of the description).
+    """
+    clauses, args = [], []
+    if filters.get("type"):
+        clauses.append("type = %s")
+        args.append(filters["type"])
+    if filters.get("start"):
+        clauses.append("timestamp >= %s")
+        args.append(filters["start"])
+    if filters.get("end"):
+        clauses.append("timestamp < %s")
+        args.append(filters["end"])
+    if filters.get("min_amount") is not None:
+        clauses.append("amount_cents >= %s")
+        args.append(filters["min_amount"])
+    if filters.get("max_amount") is not None:
+        clauses.append("amount_cents <= %s")
+        args.append(filters["max_amount"])
+    if filters.get("counterparty"):
+        clauses.append("other_user = %s")
+        args.append(filters["counterparty"])
+    if filters.get("q"):
+        escaped = filters["q"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("description ILIKE %s")
+        args.append(f"%{escaped}%")
+    return "".join(f" AND {clause}" for clause in clauses), tuple(args)
+
+
+def filter_matches(filters, row):
+    """filter_sql's conditions applied to a history row (for archived rows)"""
+    type_, amount, _, _, timestamp, description, other_user, _ = row
+    return (
+        (not filters.get("type") or type_ == filters["type"])
+        and (not filters.get("start") or timestamp >= filters["start"])
+        and (not filters.get("end") or timestamp < filters["end"])
+        and (filters.get("min_amount") is None or amount >= filters["min_amount"])
+        and (filters.get("max_amount") is None or amount <= filters["max_amount"])
+        and (not filters.get("counterparty") or other_user == filters["counterparty"])
+        and (not filters.get("q") or filters["q"].lower() in (description or "").lower())
+    )
+
+
+def month_in_range(month, filters):
+    """Whether a month can hold rows inside the filters' date range"""
+    start = datetime(month.year, month.month, 1)
+    end = datetime.combine(add_months(month, 1), datetime.min.time())
+    return (not filters.get("end") or start < filters["end"]) and (not filters.get("start") or end > filters["start"])
+
+
+def read_archived(cursor, archive, username, hot_months, before_key, limit, filters=None):
+    """Continue a newest-first read into archived months (those no longer in the database)"""
+    rows = []
+    for month, path in archive.archived_months(cursor, username):
+        if month in hot_months:
+            # Archived while we were reading; its rows were already read from the partition
+            continue
+        if before_key is not None and datetime(month.year, month.month, 1) > before_key[0]:
+            continue
+        if filters and not month_in_range(month, filters):
+            continue
+        month_rows = archive.read_user_rows(path, username)
+        if before_key is not None:
+            month_rows = [row for row in month_rows if (row[4], row[7]) < before_key]
+        if filters:
+            month_rows = [row for row in month_rows if filter_matches(filters, row)]
+        rows.extend(month_rows if limit is None else month_rows[:limit - len(rows)])
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+
+class ArchiveUnavailable(Exception):
+    """Rows a read needs are in archived months, but no archive is configured to read them from"""
+
+
+def archived_rows(cursor, archive, username, start=None, end=None):
+    """A user's archived rows with start <= timestamp <= end, oldest first, one month file at a time"""
+    cursor.execute("SELECT month FROM transaction_archive_users WHERE username = %s ORDER BY month", (username,))
+    months = [
+        month for month, in cursor.fetchall()
+        if (end is None or datetime(month.year, month.month, 1) <= end)
+        and (start is None or datetime.combine(add_months(month, 1), datetime.min.time()) > start)
+    ]
+    if not months:
+        return
+    # Archived while we were reading: those rows are still in a partition
+    months = [month for month in months if month not in set(hot_months(cursor))]
+    if months and archive is None:
+        raise ArchiveUnavailable(f"Transactions from {months[0]:%Y-%m} have been archived and cannot be read here")
+    paths = dict(archive.archived_months(cursor, username)) if months else {}
+    for month in months:
+        for row in reversed(archive.read_user_rows(paths[month], username)):
+            if (start is None or row[4] >= start) and (end is None or row[4] <= end):
+                yield row
+
+
+def fetch_history(cursor, username, limit=None, before=None, archive=None, filters=None):
+    """Newest-first ledger rows for username as (rows, next_cursor).
+
+    Without a limit this is the full history, as before. With a limit the
+    rows are read one month window at a time, newest first, with the
+    window bounds as literals so the planner only touches that month's
+    partition, stopping as soon as the page is full. Past the oldest
+    partition the read falls through to the cold-storage archive.
+    filters (see filter_sql) are pushed down into each query, and a date
+    range also skips the months outside it.
+    """
+    where, where_args = filter_sql(filters) if filters else ("", ())
+    if limit is None:
+        cursor.execute(f"SELECT {HISTORY_COLUMNS_SQL} FROM transactions WHERE username = %s{where} ORDER BY id DESC", (username, *where_args))
+        rows = cursor.fetchall()
+        if archive is not None:
+            rows.extend(read_archived(cursor, archive, username, set(hot_months(cursor)), None, None, filters))
+        return rows, None
+
+    before_ts, before_id = decode_cursor(before) if before else (None, None)
+    keyset = where + (" AND (timestamp, id) < (%s, %s)" if before else "")
+    keyset_args = where_args + ((before_ts, before_id) if before else ())
+
+    # Includes months stranded in the default partition, so their rows are paged like any other month
+    months = hot_months(cursor)
+    if not months:
+        # Not partitioned (yet): one keyset query over the whole table
+        cursor.execute(
+            f'''SELECT {HISTORY_COLUMNS_SQL} FROM transactions
+                WHERE username = %s{keyset}
+                ORDER BY timestamp DESC, id DESC LIMIT %s''',
+            (username, *keyset_args, limit)
+        )
+        rows = cursor.fetchall()
+    else:
+        rows = []
+        scanned = 0
+        for month in reversed(months):
+            start = datetime(month.year, month.month, 1)
+            if before_ts is not None and start > before_ts:
+                continue
+            if filters and not month_in_range(month, filters):
+                continue
+            end = datetime.combine(add_months(month, 1), datetime.min.time())
+            cursor.execute(
+                f'''SELECT {HISTORY_COLUMNS_SQL} FROM transactions
+                    WHERE username = %s AND timestamp >= %s AND timestamp < %s{keyset}
+                    ORDER BY timestamp DESC, id DESC LIMIT %s''',
+                (username, start, end, *keyset_args, limit - len(rows))
+            )
+            rows.extend(cursor.fetchall())
+            scanned += 1
+            if len(rows) >= limit:
+                break
+        logger.debug(f"History page read: username={username}, partitions_scanned={scanned}, rows={len(rows)}")
+
+    if archive is not None and len(rows) < limit:
+        if rows:
+            before_key = (rows[-1][4], rows[-1][7])
+        else:
+            before_key = (before_ts, before_id) if before else None
+        rows.extend(read_archived(cursor, archive, username, set(months), before_key, limit - len(rows), filters))
+
+    next_cursor = encode_cursor(rows[-1]) if len(rows) == limit else None
+    return rows, next_cursor
+
+
+class HistoryCache:
+    """Per-user cache of full newest-first histories, refreshed incrementally.
+
+    The ledger is append-only, so a cached history only needs the rows with
+    an id above what was already seen. Ids are handed out before commit,
+    though, so a row can become visible after a higher id was read. Rows
+    are therefore only treated as final ("settled") once they were seen
+    more than settle_seconds ago; each refresh re-reads everything above
+    the settled id and replaces that unsettled head of the list.
+
+    Bounded by max_rows_per_user (larger histories are not cached; use
+    paged reads for them) and max_total_rows, evicting least recently used.
+    """
+
+    def __init__(self, max_total_rows=1000000, max_rows_per_user=10000, settle_seconds=5.0):
+        self.max_total_rows = max_total_rows
+        self.max_rows_per_user = max_rows_per_user
+        self.settle_seconds = settle_seconds
+        # username -> (rows newest first, settled_id, [(seen_at, max_id)])
+        self._entries = OrderedDict()
+        self._total_rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, username, entry):
+        old = self._entries.pop(username, None)
+        if old is not None:
+            self._total_rows -= len(old[0])
+        if len(entry[0]) > self.max_rows_per_user:
+            return
+        self._entries[username] = entry
+        self._total_rows += len(entry[0])
+        while self._total_rows > self.max_total_rows and self._entries:
+            _, (evicted_rows, _, _) = self._entries.popitem(last=False)
+            self._total_rows -= len(evicted_rows)
+
+    def invalidate(self, username=None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                self._total_rows = 0
+                return
+            old = self._entries.pop(username, None)
+            if old is not None:
+                self._total_rows -= len(old[0])
+
+    def fetch(self, cursor, username, archive=None):
+        """Full history for username: cached rows plus one `id > settled_id` query"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                self._entries.move_to_end(username)
+
+        now = time.monotonic()
+        if entry is None:
+            self.misses += 1
+            rows, _ = fetch_history(cursor, username, archive=archive)
+            max_id = max((row[7] for row in rows), default=0)
+            # Rows written well before now can't have lower-id rows still in flight
+            cutoff = datetime.now() - timedelta(seconds=self.settle_seconds)
+            settled_id = max((row[7] for row in rows if row[4] is not None and row[4] < cutoff), default=0)
+            new_entry = (rows, settled_id, [(now, max_id)])
+        else:
+            self.hits += 1
+            cached_rows, settled_id, checkpoints = entry
+            cursor.execute(
+                f"SELECT {HISTORY_COLUMNS_SQL} FROM transactions WHERE username = %s AND id > %s ORDER BY id DESC",
+                (username, settled_id)
+            )
+            head = cursor.fetchall()
+            # Cached rows are id-descending, so the unsettled ones are a prefix
+            keep_from = 0
+            while keep_from < len(cached_rows) and cached_rows[keep_from][7] > settled_id:
+                keep_from += 1
+            rows = head + list(cached_rows[keep_from:])
+            max_id = head[0][7] if head else settled_id
+            checkpoints = checkpoints + [(now, max(max_id, checkpoints[-1][1] if checkpoints else 0))]
+            new_entry = (rows, settled_id, checkpoints)
+
+        # Advance the settled id to the newest checkpoint older than the settle window
+        rows, settled_id, checkpoints = new_entry
+        while checkpoints and now - checkpoints[0][0] >= self.settle_seconds:
+            settled_id = max(settled_id, checkpoints.pop(0)[1])
+
+        with self._lock:
+            # Only store if nobody replaced the entry while we were querying
+            if self._entries.get(username) is entry:
+                self._store(username, (rows, settled_id, checkpoints))
+        return rows
+
+
+def backfill_counterparties(connect, batch_size=50000):
+    """Fill other_user on transfer rows written before it was recorded, from their "to X"/"from X" descriptions.
+
+    Walks the id range in batches, one short transaction each; safe to
+    rerun. Returns the number of rows updated.
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MIN(id), 1) - 1, COALESCE(MAX(id), 0) FROM transactions")
+        low, high = cursor.fetchone()
+        conn.rollback()
+        updated = 0
+        for start in range(low, high, batch_size):
+            cursor.execute(
+                '''UPDATE transactions SET other_user = substring(description FROM '^(?:to|from) (.+)$')
+                   WHERE id > %s AND id <= %s AND other_user IS NULL
+                     AND ((type = 'Transfer Out' AND description LIKE 'to %%') OR (type = 'Transfer In' AND description LIKE 'from %%'))''',
+                (start, min(start + batch_size, high))
+            )
+            updated += cursor.rowcount
+            conn.commit()
+    logger.info(f"Backfilled transaction counterparties: rows={updated}")
+    return updated
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Transaction history maintenance")
+    parser.add_argument("command", choices=["backfill-counterparties"])
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+    backfill_counterparties(get_db_connection, args.batch_size)
@@ -0,0 +1,174 @@
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of claiming an Idempotency-Key
+CLAIMED = "claimed"
+REPLAY = "replay"
+MISMATCH = "mismatch"
+IN_PROGRESS = "in_progress"
+# An earlier attempt failed or died part-way; money may have moved, so it's never run again automatically
+UNKNOWN = "unknown"
+
+IDEMPOTENCY_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        id BIGSERIAL PRIMARY KEY,
+        email VARCHAR(255) NOT NULL,
+        idempotency_key VARCHAR(255) NOT NULL,
+        route VARCHAR(50) NOT NULL,
+        fingerprint CHAR(64) NOT NULL,
+        response TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP,
+        UNIQUE (email, idempotency_key)
+    )
+'''
+
+
+def request_fingerprint(route: str, email: str, fields: dict) -> str:
+    """Hash the parts of a request that must match when a key is reused"""
+    canonical = json.dumps({"route": route, "email": email, "fields": fields}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Idempotency-Key bookkeeping backed by the idempotency_keys table.
+
+    A bounded in-memory LRU keeps the responses of recently completed keys
+    so a duplicate retry can be answered without touching the database.
+    Cache hits must present the same credentials as the original request;
+    they are compared through an HMAC with a per-process secret so no
+    password material is kept in memory.
+
+    A claim whose request failed part-way, or whose holder died before
+    storing the response, becomes unknown rather than being retried: the
+    money may already have moved, so only a manual check can settle it.
+    """
+
+    def __init__(self, cache_size=10000, ttl_hours=24, claim_timeout_seconds=60):
+        self.cache_size = cache_size
+        self.ttl_seconds = ttl_hours * 3600
+        self.claim_timeout_seconds = claim_timeout_seconds
+        self._secret = secrets.token_bytes(32)
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create_tables(self, cursor):
+        cursor.execute(IDEMPOTENCY_TABLE_SQL)
+        # pending -> completed (response stored), or unknown when an attempt failed after it may have moved money
+        cursor.execute("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'pending'")
+        cursor.execute("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS error TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at)")
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < NOW() - make_interval(secs => %s)",
+            (self.ttl_seconds,)
+        )
+
+    def _credential_tag(self, email, password):
+        return hmac.new(self._secret, f"{email}\0{password}".encode(), hashlib.sha256).digest()
+
+    def get_recent(self, email, key, fingerprint, password):
+        """Return the cached response for a completed key, or None"""
+        cache_key = (email, key)
+        with self._lock:
+            entry = self._recent.get(cache_key)
+            if entry is None:
+                return None
+            stored_fingerprint, tag, response, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._recent[cache_key]
+                return None
+            self._recent.move_to_end(cache_key)
+        if stored_fingerprint != fingerprint or not hmac.compare_digest(tag, self._credential_tag(email, password)):
+            return None
+        return response
+
+    def remember(self, email, key, fingerprint, password, response):
+        entry = (fingerprint, self._credential_tag(email, password), response, time.monotonic())
+        with self._lock:
+            self._recent[(email, key)] = entry
+            self._recent.move_to_end((email, key))
+            while len(self._recent) > self.cache_size:
+                self._recent.popitem(last=False)
+
+    def claim(self, conn, email, key, route, fingerprint):
+        """Claim a key for this request; returns (outcome, stored_response)"""
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT INTO idempotency_keys (email, idempotency_key, route, fingerprint)
+               VALUES (%s, %s, %s, %s)
+               ON CONFLICT (email, idempotency_key) DO NOTHING
+               RETURNING id''',
+            (email, key, route, fingerprint)
+        )
+        if cursor.fetchone():
+            conn.commit()
+            return CLAIMED, None
+
+        cursor.execute(
+            '''SELECT fingerprint, response, status, created_at < NOW() - make_interval(secs => %s)
+               FROM idempotency_keys WHERE email = %s AND idempotency_key = %s''',
+            (self.claim_timeout_seconds, email, key)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            # The claim was released between our INSERT and SELECT; let the client retry
+            conn.rollback()
+            return IN_PROGRESS, None
+        stored_fingerprint, response, status, abandoned = row
+        if stored_fingerprint != fingerprint:
+            conn.rollback()
+            return MISMATCH, None
+        if response is not None:
+            conn.rollback()
+            return REPLAY, json.loads(response)
+        if status == UNKNOWN:
+            conn.rollback()
+            return UNKNOWN, None
+        if abandoned:
+            # The previous holder died without storing a response, possibly after moving money:
+            # running the request again could pay twice, so the key needs a manual check instead
+            cursor.execute(
+                '''UPDATE idempotency_keys SET status = %s, error = 'Abandoned before completing'
+                   WHERE email = %s AND idempotency_key = %s AND response IS NULL''',
+                (UNKNOWN, email, key)
+            )
+            conn.commit()
+            logger.error(f"Abandoned idempotency key marked unknown, needs a manual check: email={email}, key={key}")
+            return UNKNOWN, None
+        conn.rollback()
+        return IN_PROGRESS, None
+
+    def complete(self, conn, email, key, response):
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE idempotency_keys SET response = %s, status = 'completed', completed_at = NOW() WHERE email = %s AND idempotency_key = %s",
+            (json.dumps(response), email, key)
+        )
+        conn.commit()
+
+    def mark_unknown(self, conn, email, key, error):
+        """Keep a claim whose request failed part-way; the key is refused until someone checks the ledger"""
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE idempotency_keys SET status = %s, error = %s WHERE email = %s AND idempotency_key = %s AND response IS NULL",
+            (UNKNOWN, str(error)[:1000], email, key)
+        )
+        conn.commit()
+        logger.error(f"Idempotency key marked unknown, needs a manual check: email={email}, key={key}, error={error}")
+
+    def release(self, conn, email, key):
+        """Drop an unfinished claim so the client can retry with the same key (only when nothing was moved)"""
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE email = %s AND idempotency_key = %s AND response IS NULL",
+            (email, key)
+        )
+        conn.commit()
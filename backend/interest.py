@@ -0,0 +1,158 @@
+import logging
+import time
+from datetime import date, datetime
+
+import psycopg2
+
+import balance_shards
+from partitions import add_months
+
+logger = logging.getLogger(__name__)
+
+INTEREST_RUNS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS interest_runs (
+        period CHAR(7) PRIMARY KEY,
+        rate_bps INTEGER NOT NULL,
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        accounts_paid BIGINT NOT NULL DEFAULT 0,
+        total_cents BIGINT NOT NULL DEFAULT 0,
+        started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP
+    )
+'''
+
+# Monthly interest on the (already folded) balance of users in an id range:
+# (balance * annual basis points) / (12 * 10000), truncated to whole cents.
+# The UPDATE's RETURNING rows feed the ledger insert in the same statement.
+PAY_INTEREST_SQL = '''
+    WITH paid AS (
+        UPDATE users u SET balance_cents = u.balance_cents + c.interest_cents
+        FROM (
+            SELECT id, (balance_cents * %(rate_bps)s) / 120000 AS interest_cents
+            FROM users WHERE id > %(low)s AND id <= %(high)s AND balance_cents > 0
+        ) c
+        WHERE u.id = c.id AND c.interest_cents > 0
+        RETURNING u.username, c.interest_cents, u.balance_cents - c.interest_cents AS old_balance_cents, u.balance_cents
+    )
+    INSERT INTO transactions (username, type, amount_cents, old_balance_cents, new_balance_cents, timestamp, description)
+    SELECT username, 'Interest', interest_cents, old_balance_cents, balance_cents, %(timestamp)s, %(description)s
+    FROM paid
+    RETURNING id, amount_cents
+'''
+
+
+def create_tables(cursor):
+    cursor.execute(INTEREST_RUNS_TABLE_SQL)
+
+
+def _pay_chunk(conn, period, rate_bps, chunk_size, after_insert):
+    """Pay one chunk of users after the checkpoint; returns False once the run is complete"""
+    cursor = conn.cursor()
+    # Keep row locks short and give way to live traffic instead of stalling it
+    cursor.execute("SET LOCAL lock_timeout = '2s'")
+    # Serializes concurrent runners of the same period on the checkpoint row
+    cursor.execute("SELECT last_user_id, completed_at FROM interest_runs WHERE period = %s FOR UPDATE", (period,))
+    low, completed_at = cursor.fetchone()
+    if completed_at is not None:
+        conn.rollback()
+        return False
+
+    cursor.execute(
+        "SELECT id, username, balance_shard_count FROM users WHERE id > %s ORDER BY id LIMIT %s FOR UPDATE",
+        (low, chunk_size)
+    )
+    chunk = cursor.fetchall()
+    if not chunk:
+        cursor.execute("UPDATE interest_runs SET completed_at = CURRENT_TIMESTAMP WHERE period = %s", (period,))
+        conn.commit()
+        return False
+    high = chunk[-1][0]
+
+    # Interest is paid on the whole balance, so fold hot accounts' shards first
+    for _, username, shard_count in chunk:
+        if shard_count > 0:
+            balance_shards._lock_and_fold(cursor, username)
+
+    cursor.execute(PAY_INTEREST_SQL, {
+        "rate_bps": rate_bps,
+        "low": low,
+        "high": high,
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "description": f"Interest for {period}",
+    })
+    paid = cursor.fetchall()
+    if paid and after_insert:
+        after_insert(cursor, [row[0] for row in paid])
+    cursor.execute(
+        '''UPDATE interest_runs SET last_user_id = %s, accounts_paid = accounts_paid + %s, total_cents = total_cents + %s
+           WHERE period = %s''',
+        (high, len(paid), sum(row[1] for row in paid), period)
+    )
+    conn.commit()
+    return True
+
+
+def run_interest(connect, period, rate_bps, chunk_size=1000, after_insert=None, max_retries=5):
+    """Pay a month's interest to every account, resuming from the last checkpoint.
+
+    Each chunk of users is locked, paid and checkpointed in one short
+    transaction, so an interrupted run picks up after the last committed
+    chunk and no account is paid twice for the same period. after_insert
+    receives the new ledger ids inside each chunk's transaction.
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO interest_runs (period, rate_bps) VALUES (%s, %s) ON CONFLICT (period) DO NOTHING",
+            (period, rate_bps)
+        )
+        cursor.execute("SELECT rate_bps FROM interest_runs WHERE period = %s", (period,))
+        rate_bps = cursor.fetchone()[0]  # a resumed run keeps its original rate
+        conn.commit()
+
+        started = time.monotonic()
+        retries = 0
+        while True:
+            try:
+                if not _pay_chunk(conn, period, rate_bps, chunk_size, after_insert):
+                    break
+                retries = 0
+            except (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected) as e:
+                conn.rollback()
+                retries += 1
+                if retries > max_retries:
+                    raise
+                logger.warning(f"Interest chunk for {period} hit lock contention, retrying ({retries}/{max_retries}): {e}")
+                time.sleep(0.1 * retries)
+
+        cursor.execute("SELECT accounts_paid, total_cents FROM interest_runs WHERE period = %s", (period,))
+        accounts, total = cursor.fetchone()
+        conn.rollback()
+    logger.info(f"Interest run complete: period={period}, accounts={accounts}, total_cents={total}, seconds={time.monotonic() - started:.1f}")
+    return accounts, total
+
+
+def pay_due_interest(connect, rate_bps, chunk_size=1000, after_insert=None):
+    """Scheduler entry point: pay last month's interest if it has not been completed"""
+    period = add_months(date.today().replace(day=1), -1).strftime("%Y-%m")
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT completed_at FROM interest_runs WHERE period = %s", (period,))
+        row = cursor.fetchone()
+    if row and row[0] is not None:
+        return None
+    return run_interest(connect, period, rate_bps, chunk_size, after_insert)
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection, after_ledger_insert, INTEREST_ANNUAL_RATE_BPS
+
+    parser = argparse.ArgumentParser(description="Pay monthly interest to all accounts")
+    parser.add_argument("period", help="YYYY-MM the interest is for")
+    parser.add_argument("--rate-bps", type=int, default=INTEREST_ANNUAL_RATE_BPS, help="annual rate in basis points")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    if args.rate_bps <= 0:
+        parser.error("set INTEREST_ANNUAL_RATE_BPS or pass --rate-bps")
+    run_interest(get_db_connection, args.period, args.rate_bps, args.chunk_size, after_ledger_insert)
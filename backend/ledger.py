@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+LEDGER_INSERT_SQL = '''
+    INSERT INTO transactions (username, type, amount_cents, old_balance_cents, new_balance_cents, timestamp, description, other_user)
+    VALUES %s
+    RETURNING id
+'''
+
+# Ledger types that add to / subtract from the account balance
+CREDIT_TYPES = ("Deposit", "Transfer In", "Interest")
+DEBIT_TYPES = ("Withdraw", "Transfer Out")
+
+
+def signed_amount_sql(column="amount_cents"):
+    """SQL expression for a ledger (or rollup) row's effect on the balance"""
+    credit_types = ", ".join(f"'{t}'" for t in CREDIT_TYPES)
+    return f"CASE WHEN type IN ({credit_types}) THEN {column} ELSE -{column} END"
+
+
+SIGNED_AMOUNT_SQL = signed_amount_sql()
+
+
+def build_ledger_row(username, type_, amount, old_balance, new_balance, other_user=None, description=None):
+    """Build a ledger row tuple in LEDGER_INSERT_SQL column order (amounts in integer cents)"""
+    # Add other_user info to the transaction description
+    if description is None:
+        description = f"to {other_user}" if other_user and type_ == "Transfer Out" else f"from {other_user}" if other_user and type_ == "Transfer In" else ""
+    return (username, type_, amount, old_balance, new_balance, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), description, other_user)
+
+
+def insert_ledger_rows(cursor, rows):
+    """Insert ledger rows with a single multi-row INSERT; returns the new ids"""
+    result = execute_values(cursor, LEDGER_INSERT_SQL, rows, page_size=max(len(rows), 1), fetch=True)
+    return [r[0] for r in result]
+
+
+class _PendingWrite:
+    """A ledger row waiting for its batch to be committed"""
+    __slots__ = ("row", "done", "error")
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.error = None
+
+
+class LedgerWriter:
+    """Group-commit writer for ledger rows.
+
+    Callers block in write() while a background thread collects rows from
+    concurrent requests until either max_batch_size rows are queued or
+    max_wait_ms has elapsed since the first one arrived. Each batch is
+    written with one multi-row INSERT and one commit, and every waiter is
+    then released with the outcome of that commit. after_insert(cursor, ids)
+    runs inside the batch transaction for derived writes such as rollups.
+    """
+
+    def __init__(self, connect, max_batch_size=100, max_wait_ms=5.0, after_insert=None):
+        self._connect = connect
+        self._after_insert = after_insert
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.batches_flushed = 0
+        self.rows_flushed = 0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Ledger group-commit writer started: max_batch_size={self.max_batch_size}, max_wait={self.max_wait * 1000:.1f}ms")
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        logger.info("Ledger group-commit writer stopped")
+
+    def write(self, row, timeout=30.0):
+        """Queue a ledger row and block until its batch is durable"""
+        pending = _PendingWrite(row)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Ledger writer is not running")
+            self._pending.append(pending)
+            self._cond.notify_all()
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for ledger batch commit")
+        if pending.error is not None:
+            raise pending.error
+
+    def _take_batch(self):
+        """Wait for a full batch or the batching window, then take it"""
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            deadline = time.monotonic() + self.max_wait
+            while self._running and len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        error = None
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                ids = insert_ledger_rows(cursor, [p.row for p in batch])
+                if self._after_insert:
+                    self._after_insert(cursor, ids)
+                conn.commit()
+            self.batches_flushed += 1
+            self.rows_flushed += len(batch)
+            logger.info(f"Ledger batch committed: rows={len(batch)}")
+        except Exception as e:
+            logger.error(f"Ledger batch commit failed: rows={len(batch)}, error={e}")
+            error = e
+        for pending in batch:
+            pending.error = error
+            pending.done.set()
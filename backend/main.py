@@ -1,7 +1,7 @@
-from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi import FastAPI, HTTPException, Body, Request, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Optional
-from decimal import Decimal, getcontext
+from typing import Optional, List
 from datetime import datetime, timedelta
 import os
 import secrets
@@ -14,9 +14,36 @@ from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 import os
 import psycopg2
-from contextlib import contextmanager
+from psycopg2.extras import execute_values
+from contextlib import contextmanager, closing, nullcontext
+import functools
+import inspect
 import logging
 import sys
+from ledger import LedgerWriter, build_ledger_row, insert_ledger_rows, CREDIT_TYPES, DEBIT_TYPES
+from money import MoneyAmount, format_cents, parse_cents
+from responses import RowsJSONResponse, RowsStreamingResponse
+from idempotency import IdempotencyStore, request_fingerprint, CLAIMED, REPLAY, MISMATCH, UNKNOWN
+from background import PeriodicTask
+from circuit import CircuitBreaker, CircuitOpenError
+from health import BacklogMonitor, ReadinessChecker
+from replicas import ReplicaRouter, make_pin_store, redact
+import sharding
+import sagas
+import balance_shards
+import statements
+from analytics import compute_account_analytics
+import snapshots
+import partitions
+from history import ArchiveUnavailable, fetch_history, HistoryCache
+import archive
+import reconciliation
+import interest
+import scheduled_transfers
+import outbox
+import velocity
+import ratelimit
+import admission
 
 # Configure comprehensive logging
 logging.basicConfig(
@@ -56,12 +83,168 @@ def generate_access_token(subject: str) -> str:
     to_encode = {"sub": subject, "exp": expires_at}
     return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
-getcontext().prec = 100
+# Ledger group commit settings (disabled by default: one commit per ledger row)
+LEDGER_GROUP_COMMIT = os.getenv("LEDGER_GROUP_COMMIT", "false").lower() == "true"
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", "100"))
+LEDGER_BATCH_WAIT_MS = float(os.getenv("LEDGER_BATCH_WAIT_MS", "5"))
+
+# Idempotency-Key settings for deposit, withdraw and transfer
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+# How often sharded balances are folded back into users.balance_cents (0 disables)
+BALANCE_SHARD_COMPACT_INTERVAL_SECONDS = float(os.getenv("BALANCE_SHARD_COMPACT_INTERVAL_SECONDS", "30"))
+
+# How often to check for completed days that need a balance snapshot (0 disables; use snapshots.py from cron instead)
+BALANCE_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("BALANCE_SNAPSHOT_INTERVAL_SECONDS", "3600"))
+
+# Monthly transactions partitions: how many future months to keep created, and how often to check (0 disables)
+TRANSACTION_PARTITION_MONTHS_AHEAD = int(os.getenv("TRANSACTION_PARTITION_MONTHS_AHEAD", "3"))
+TRANSACTION_PARTITION_INTERVAL_SECONDS = float(os.getenv("TRANSACTION_PARTITION_INTERVAL_SECONDS", "86400"))
+
+# Cold storage for old transactions partitions (directory, file://, s3:// or gs://; empty disables archiving)
+TRANSACTION_ARCHIVE_URI = os.getenv("TRANSACTION_ARCHIVE_URI", "")
+TRANSACTION_ARCHIVE_AFTER_MONTHS = int(os.getenv("TRANSACTION_ARCHIVE_AFTER_MONTHS", "18"))
+TRANSACTION_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("TRANSACTION_ARCHIVE_INTERVAL_SECONDS", "86400"))
+
+# In-memory full-history cache refreshed with `id > last seen id` queries (0 total rows disables)
+HISTORY_CACHE_MAX_ROWS = int(os.getenv("HISTORY_CACHE_MAX_ROWS", "1000000"))
+HISTORY_CACHE_MAX_ROWS_PER_USER = int(os.getenv("HISTORY_CACHE_MAX_ROWS_PER_USER", "10000"))
+HISTORY_CACHE_SETTLE_SECONDS = float(os.getenv("HISTORY_CACHE_SETTLE_SECONDS", "5"))
+
+# Balance vs ledger reconciliation (0 disables the in-app schedule; `python reconciliation.py` runs it by hand)
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "86400"))
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "4"))
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "10000"))
+RECONCILE_REPAIR = os.getenv("RECONCILE_REPAIR", "false").lower() == "true"
+
+# Monthly interest, paid at the start of each month on current balances (0 bps disables)
+INTEREST_ANNUAL_RATE_BPS = int(os.getenv("INTEREST_ANNUAL_RATE_BPS", "0"))
+INTEREST_CHUNK_SIZE = int(os.getenv("INTEREST_CHUNK_SIZE", "1000"))
+INTEREST_CHECK_INTERVAL_SECONDS = float(os.getenv("INTEREST_CHECK_INTERVAL_SECONDS", "3600"))
+
+# Scheduled/recurring transfers executor (0 disables polling)
+SCHEDULED_TRANSFER_INTERVAL_SECONDS = float(os.getenv("SCHEDULED_TRANSFER_INTERVAL_SECONDS", "30"))
+SCHEDULED_TRANSFER_BATCH_SIZE = int(os.getenv("SCHEDULED_TRANSFER_BATCH_SIZE", "200"))
+SCHEDULED_TRANSFER_WORKERS = int(os.getenv("SCHEDULED_TRANSFER_WORKERS", "4"))
+SCHEDULED_TRANSFER_MAX_ATTEMPTS = int(os.getenv("SCHEDULED_TRANSFER_MAX_ATTEMPTS", "3"))
+SCHEDULED_TRANSFER_RETRY_DELAY_SECONDS = float(os.getenv("SCHEDULED_TRANSFER_RETRY_DELAY_SECONDS", "3600"))
+
+# Largest number of credits accepted by one /batch-transfer request
+BATCH_TRANSFER_MAX_ITEMS = int(os.getenv("BATCH_TRANSFER_MAX_ITEMS", "500"))
+
+# Largest number of accounts one /admin/balances request may look up
+ADMIN_BALANCES_MAX_ACCOUNTS = int(os.getenv("ADMIN_BALANCES_MAX_ACCOUNTS", "5000"))
+
+# Transactional outbox: where events for new ledger rows are published (file:<path>, queue or webhook:<url>; empty disables)
+OUTBOX_SINK = os.getenv("OUTBOX_SINK", "")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_RELAY_INTERVAL_SECONDS = float(os.getenv("OUTBOX_RELAY_INTERVAL_SECONDS", "1"))
+
+# Velocity limits on withdrawals and transfers (including batch items and scheduled runs) as a JSON list of rules (see velocity.parse_rules; empty disables)
+VELOCITY_RULES = os.getenv("VELOCITY_RULES", "")
+# Counter store for the velocity rules: memory (per process) or a redis:// URL shared by all instances
+VELOCITY_BACKEND = os.getenv("VELOCITY_BACKEND", "memory")
+
+# Token-bucket rate limits in front of every password-checking route (per client IP and per account)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Bucket store: memory (per process) or a redis:// URL shared by all instances
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "30"))
+RATE_LIMIT_IP_PER_SECOND = float(os.getenv("RATE_LIMIT_IP_PER_SECOND", "5"))
+RATE_LIMIT_ACCOUNT_BURST = int(os.getenv("RATE_LIMIT_ACCOUNT_BURST", "10"))
+RATE_LIMIT_ACCOUNT_PER_SECOND = float(os.getenv("RATE_LIMIT_ACCOUNT_PER_SECOND", "1"))
+# Header carrying the real client IP, trusted only from these proxy addresses (nginx sets X-Real-IP)
+RATE_LIMIT_IP_HEADER = os.getenv("RATE_LIMIT_IP_HEADER", "X-Real-IP")
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1,::1")
+
+# Admission control: concurrent requests per route class, plus how many may queue and for how long
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+ADMISSION_WRITE_MAX_CONCURRENT = int(os.getenv("ADMISSION_WRITE_MAX_CONCURRENT", "16"))
+ADMISSION_WRITE_MAX_QUEUE = int(os.getenv("ADMISSION_WRITE_MAX_QUEUE", "100"))
+ADMISSION_WRITE_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_WRITE_QUEUE_TIMEOUT_MS", "1000"))
+ADMISSION_READ_MAX_CONCURRENT = int(os.getenv("ADMISSION_READ_MAX_CONCURRENT", "16"))
+ADMISSION_READ_MAX_QUEUE = int(os.getenv("ADMISSION_READ_MAX_QUEUE", "200"))
+ADMISSION_READ_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_READ_QUEUE_TIMEOUT_MS", "1000"))
+
+# Seconds psycopg2.connect may wait for the database
+DATABASE_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DATABASE_CONNECT_TIMEOUT_SECONDS", "30"))
+# Database circuit breaker: consecutive connection failures before failing fast, and seconds until a probe
+DB_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("DB_CIRCUIT_FAILURE_THRESHOLD", "5"))
+DB_CIRCUIT_RESET_SECONDS = float(os.getenv("DB_CIRCUIT_RESET_SECONDS", "10"))
+
+# How often the background readiness check queries the database for /readyz
+READINESS_CHECK_INTERVAL_SECONDS = float(os.getenv("READINESS_CHECK_INTERVAL_SECONDS", "5"))
+# Bearer token /metrics requires (empty disables /metrics)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# How often the outbox and saga backlogs shown by /metrics are queried
+METRICS_BACKLOG_INTERVAL_SECONDS = float(os.getenv("METRICS_BACKLOG_INTERVAL_SECONDS", "15"))
+
+# Read replicas for read-only routes (comma-separated URLs; empty sends every read to the primary)
+DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "")
+# Replicas further behind than this are skipped; keep it below HISTORY_CACHE_SETTLE_SECONDS
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+# After a write, the account's reads go to the primary for this long (read-your-writes)
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+# Where those pins live: memory (per process) or a redis:// URL shared by all instances
+REPLICA_PIN_BACKEND = os.getenv("REPLICA_PIN_BACKEND", "memory")
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL_SECONDS", "1"))
+# Short, so an unreachable replica falls back to the primary quickly
+REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.getenv("REPLICA_CONNECT_TIMEOUT_SECONDS", "3"))
+
+# sslmode for every database connection (require for RDS; disable for local docker-compose databases)
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+
+# Database shards holding the accounts, as name=url pairs (comma-separated; empty keeps everything
+# in DATABASE_URL). When set, DATABASE_URL is the directory that maps account buckets to shards
+DATABASE_SHARD_URLS = os.getenv("DATABASE_SHARD_URLS", "")
+# Number of account buckets; fixed once the directory has been created
+SHARD_BUCKETS = int(os.getenv("SHARD_BUCKETS", "1024"))
+# How often the bucket map is re-read; the resharding tool's grace period must exceed it
+SHARD_MAP_RELOAD_SECONDS = float(os.getenv("SHARD_MAP_RELOAD_SECONDS", "5"))
+# Cross-shard transfers whose credit step failed are retried after this many seconds
+SAGA_RETRY_SECONDS = int(os.getenv("SAGA_RETRY_SECONDS", "30"))
+SAGA_RECOVERY_INTERVAL_SECONDS = float(os.getenv("SAGA_RECOVERY_INTERVAL_SECONDS", "10"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 app = FastAPI()
 
+# Route classes under admission control; together they stay below the 40 worker threads
+# so logins and health checks always find a thread
+ADMISSION_WRITE_ROUTES = ("/deposit", "/withdraw", "/transfer", "/batch-transfer", "/scheduled-transfers")
+ADMISSION_READ_ROUTES = ("/balance", "/balance-at", "/transactions", "/statements", "/analytics", "/admin/balances", "/profile")
+
+admission_controllers = {
+    "write": admission.AdmissionController("write", ADMISSION_WRITE_MAX_CONCURRENT, ADMISSION_WRITE_MAX_QUEUE, ADMISSION_WRITE_QUEUE_TIMEOUT_MS / 1000),
+    "read": admission.AdmissionController("read", ADMISSION_READ_MAX_CONCURRENT, ADMISSION_READ_MAX_QUEUE, ADMISSION_READ_QUEUE_TIMEOUT_MS / 1000),
+} if ADMISSION_CONTROL_ENABLED else {}
+if admission_controllers:
+    # Innermost of our middlewares: rate-limited requests never take a queue slot
+    logger.info("Adding admission control middleware...")
+    app.add_middleware(
+        admission.AdmissionMiddleware,
+        route_classes=[(admission_controllers["write"], ADMISSION_WRITE_ROUTES), (admission_controllers["read"], ADMISSION_READ_ROUTES)],
+    )
+
+# Cheap routes that never check a password
+RATE_LIMIT_EXEMPT_PATHS = ("/", "/livez", "/readyz", "/metrics", "/user-count", "/api/auth/google/config", "/api/auth/facebook/config")
+
+rate_limiter = ratelimit.RateLimiter(
+    ratelimit.make_store(RATE_LIMIT_BACKEND), RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_SECOND,
+    RATE_LIMIT_ACCOUNT_BURST, RATE_LIMIT_ACCOUNT_PER_SECOND
+) if RATE_LIMIT_ENABLED else None
+if rate_limiter:
+    # Added before CORS so 429 responses still carry the CORS headers
+    logger.info("Adding rate limit middleware...")
+    app.add_middleware(
+        ratelimit.RateLimitMiddleware,
+        limiter=rate_limiter,
+        exempt_paths=RATE_LIMIT_EXEMPT_PATHS,
+        ip_header=RATE_LIMIT_IP_HEADER,
+        trusted_proxies=[ip.strip() for ip in RATE_LIMIT_TRUSTED_PROXIES.split(",") if ip.strip()],
+    )
+
 logger.info("Adding CORS middleware...")
 app.add_middleware(
     CORSMiddleware,
@@ -92,7 +275,11 @@ async def startup_event():
     # Log database connection attempt
     logger.info("Attempting to create/verify database tables...")
     try:
-        create_db()
+        if shard_map:
+            shard_map.load(get_db_connection)
+            logger.info(f"[OK] Shard map loaded: {shard_map.status()['shards']}")
+        for shard in database_shards():
+            create_db(shard)
         logger.info("[OK] Database initialization successful!")
     except Exception as e:
         logger.error(f"[ERROR] Database initialization failed: {e}")
@@ -102,16 +289,66 @@ async def startup_event():
     logger.info(f"Server will run on port 8000")
     logger.info(f"CORS origins: {app.user_middleware[0].kwargs['allow_origins']}")
     
+    for ledger_writer in ledger_writers.values():
+        ledger_writer.start()
+    for task in background_tasks:
+        task.start()
+    
     logger.info("=== BLUEBANK BACKEND STARTUP COMPLETE ===")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Flush and stop background writers"""
+    for task in background_tasks:
+        task.stop()
+    for ledger_writer in ledger_writers.values():
+        ledger_writer.stop()
+
+# Trips when the database can't be reached so requests fail in milliseconds instead of waiting on connect
+db_breaker = CircuitBreaker("database", DB_CIRCUIT_FAILURE_THRESHOLD, DB_CIRCUIT_RESET_SECONDS)
+
+@app.exception_handler(CircuitOpenError)
+def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    logger.warning(f"Request failed fast, database circuit open: path={request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database temporarily unavailable, please retry later"},
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))},
+    )
+
+@app.exception_handler(psycopg2.OperationalError)
+def database_unavailable_handler(request: Request, exc: psycopg2.OperationalError):
+    logger.error(f"Request failed, database unavailable: path={request.url.path}, error={exc}")
+    return JSONResponse(status_code=503, content={"detail": "Database temporarily unavailable, please retry later"})
+
+@app.exception_handler(sharding.ShardMoving)
+def shard_moving_handler(request: Request, exc: sharding.ShardMoving):
+    logger.warning(f"Request deferred, account's shard bucket is moving: path={request.url.path}, bucket={exc.bucket}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Account temporarily unavailable, please retry shortly"},
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))},
+    )
+
+# Maps accounts to database shards (None when everything lives in DATABASE_URL)
+shard_map = sharding.ShardMap(
+    sharding.parse_shard_urls(DATABASE_SHARD_URLS), SHARD_BUCKETS, SHARD_MAP_RELOAD_SECONDS
+) if DATABASE_SHARD_URLS.strip() else None
+# One breaker per shard, so a dead shard doesn't fail requests for accounts elsewhere
+shard_breakers = {
+    name: CircuitBreaker(f"database:{name}", DB_CIRCUIT_FAILURE_THRESHOLD, DB_CIRCUIT_RESET_SECONDS) for name in shard_map.urls
+} if shard_map else {}
+
 # Database connection function
 @contextmanager
-def get_db_connection():
-    """Get database connection (PostgreSQL only)"""
+def get_db_connection(shard=None):
+    """Get database connection (PostgreSQL only): the given shard, else the current account's shard, else DATABASE_URL"""
     logger.info("Attempting database connection...")
+    shard = shard or sharding.current_shard()
     
     # Get database URL from environment variable
-    database_url = os.getenv("DATABASE_URL")
+    database_url = shard_map.urls[shard] if shard else os.getenv("DATABASE_URL")
+    breaker = shard_breakers[shard] if shard else db_breaker
     logger.info(f"DATABASE_URL from env: {'SET' if database_url else 'NOT SET'}")
     
     if not database_url:
@@ -121,15 +358,22 @@ def get_db_connection():
     
     logger.info(f"Attempting to connect to database with URL: {database_url[:20]}...")
     
+    # Raises CircuitOpenError right away while the database is known to be down
+    breaker.before()
     try:
-        # Use PostgreSQL with proper SSL and connection settings for AWS RDS
-        conn = psycopg2.connect(
-            database_url,
-            sslmode='require',  # Force SSL for AWS RDS
-            connect_timeout=30,  # 30 second timeout
-            options='-c statement_timeout=60000'  # 60 second statement timeout
-        )
-        logger.info("Database connection successful!")
+        try:
+            # Use PostgreSQL with proper SSL and connection settings for AWS RDS
+            conn = psycopg2.connect(
+                database_url,
+                sslmode=DATABASE_SSLMODE,  # require for AWS RDS
+                connect_timeout=DATABASE_CONNECT_TIMEOUT_SECONDS,
+                options='-c statement_timeout=60000'  # 60 second statement timeout
+            )
+        except Exception:
+            breaker.failure()
+            raise
+        breaker.success()
+        logger.info(f"Database connection successful! shard={shard or 'default'}")
         try:
             yield conn
         finally:
@@ -145,10 +389,198 @@ def get_db_connection():
         logger.error(f"Database connection failed (Unexpected error): {e}")
         raise
 
+# Routes read-only queries to healthy replicas (None when no replicas are configured)
+if DATABASE_REPLICA_URLS.strip() and shard_map:
+    # Replica URLs name replicas of one database; with shards, each shard would need its own set
+    logger.warning("DATABASE_REPLICA_URLS is ignored while DATABASE_SHARD_URLS is set; reads go to the shards")
+replica_router = ReplicaRouter(
+    [url.strip() for url in DATABASE_REPLICA_URLS.split(",") if url.strip()], REPLICA_MAX_LAG_SECONDS, REPLICA_PIN_SECONDS,
+    make_pin_store(REPLICA_PIN_BACKEND)
+) if DATABASE_REPLICA_URLS.strip() and not shard_map else None
+
+def connect_replica(replica_url):
+    """Open a read-only connection to a replica (outside the primary's circuit breaker)"""
+    return psycopg2.connect(
+        replica_url,
+        sslmode=DATABASE_SSLMODE,
+        connect_timeout=REPLICA_CONNECT_TIMEOUT_SECONDS,
+        options='-c statement_timeout=60000 -c default_transaction_read_only=on'
+    )
+
+@contextmanager
+def get_read_connection(account=None):
+    """Connection for read-only queries: a replica unless account wrote recently or none is healthy"""
+    replica_url = replica_router.choose(account) if replica_router else None
+    if replica_url is None:
+        with get_db_connection() as conn:
+            yield conn
+        return
+    try:
+        conn = connect_replica(replica_url)
+    except psycopg2.Error as e:
+        logger.warning(f"Replica connection failed, reading from the primary: replica={redact(replica_url)}, error={e}")
+        replica_router.mark_failed(replica_url, e)
+        with get_db_connection() as conn:
+            yield conn
+        return
+    logger.info(f"Read connection to replica: {redact(replica_url)}")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def pin_reads_to_primary(account):
+    """Read-your-writes: account's reads skip the replicas until they have caught up with its write"""
+    if replica_router:
+        replica_router.pin(account)
+
+def account_scope(email):
+    """Route this block's database connections to email's shard (no-op when unsharded or email is None)"""
+    if shard_map is None or not email:
+        return nullcontext()
+    return sharding.use_shard(shard_map.shard_for(email))
+
+def account_route(account_of):
+    """Decorator: run a route on the shard of the account account_of(arguments) names"""
+    def decorate(route):
+        if shard_map is None:
+            return route
+        signature = inspect.signature(route)
+        @functools.wraps(route)
+        def scoped(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            with account_scope(account_of(arguments)):
+                return route(*args, **kwargs)
+        return scoped
+    return decorate
+
+def database_shards():
+    """Shard names to visit for work spanning every account ([None]: just DATABASE_URL)"""
+    return list(shard_map.urls) if shard_map else [None]
+
+def each_database(func):
+    """Run func(connect) once per shard, with connect bound to that shard; a failing shard doesn't stop the others"""
+    def run():
+        failure = None
+        for shard in database_shards():
+            try:
+                with sharding.use_shard(shard):
+                    func(functools.partial(get_db_connection, shard))
+            except Exception as e:
+                if shard is None:
+                    raise
+                logger.error(f"Background job failed on shard {shard}: {e}")
+                failure = e
+        if failure:
+            raise failure
+    return run
+
+def find_remote_accounts(emails):
+    """{email: username} for the accounts among emails that live on other shards than the current one"""
+    by_shard = {}
+    for email in set(emails) if shard_map else ():
+        shard = shard_map.shard_for(email)
+        if shard != sharding.current_shard():
+            by_shard.setdefault(shard, []).append(email)
+    found = {}
+    for shard, shard_emails in by_shard.items():
+        with get_db_connection(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT email, username FROM users WHERE email = ANY(%s)", (shard_emails,))
+            found.update(cursor.fetchall())
+    return found
+
+@contextmanager
+def directory_connection():
+    """Connection to the shard directory (DATABASE_URL), from inside any account's scope"""
+    with sharding.use_shard(None), get_db_connection() as conn:
+        yield conn
+
+def username_available(cursor, username, email):
+    """Whether email may take username: free on this shard and, when sharded, claimed in the directory"""
+    cursor.execute("SELECT 1 FROM users WHERE username = %s", (username,))
+    if cursor.fetchone():
+        return False
+    return shard_map is None or sharding.claim_username(directory_connection, username, email)
+
+def release_username(username, email):
+    """Give back email's directory claim on username after its account insert failed"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM users WHERE username = %s", (username,))
+        if cursor.fetchone():
+            return
+    sharding.release_username(directory_connection, username, email)
+
 def get_placeholder():
     """Get the correct placeholder for PostgreSQL"""
     return "%s"  # PostgreSQL
 
+# Recently completed Idempotency-Keys and their stored responses
+idempotency_store = IdempotencyStore(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_KEY_TTL_HOURS)
+
+# Relays each shard's outbox events to OUTBOX_SINK (empty when the outbox is disabled)
+outbox_sink = outbox.make_sink(OUTBOX_SINK) if OUTBOX_SINK else None
+outbox_relays = {
+    shard: outbox.OutboxRelay(functools.partial(get_db_connection, shard), outbox_sink, OUTBOX_BATCH_SIZE) for shard in database_shards()
+} if outbox_sink else {}
+
+# Group-commit writers for ledger rows, one per shard (empty when group commit is disabled)
+def after_ledger_insert(cursor, ids):
+    """Derived writes that must commit together with new ledger rows"""
+    statements.apply_rollups(cursor, ids)
+    if outbox_relays:
+        outbox.record_events(cursor, ids)
+
+ledger_writers = {
+    shard: LedgerWriter(functools.partial(get_db_connection, shard), LEDGER_BATCH_SIZE, LEDGER_BATCH_WAIT_MS, after_ledger_insert) for shard in database_shards()
+} if LEDGER_GROUP_COMMIT else {}
+
+# Periodic background jobs started with the app
+background_tasks = []
+if BALANCE_SHARD_COMPACT_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask("balance-shard-compactor", BALANCE_SHARD_COMPACT_INTERVAL_SECONDS, each_database(balance_shards.compact)))
+if BALANCE_SNAPSHOT_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask("balance-snapshots", BALANCE_SNAPSHOT_INTERVAL_SECONDS, each_database(snapshots.run_snapshots)))
+if TRANSACTION_PARTITION_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask("transaction-partitions", TRANSACTION_PARTITION_INTERVAL_SECONDS, each_database(lambda connect: partitions.maintain_partitions(connect, TRANSACTION_PARTITION_MONTHS_AHEAD))))
+
+if RECONCILE_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask("reconciliation", RECONCILE_INTERVAL_SECONDS, each_database(lambda connect: reconciliation.reconcile(connect, RECONCILE_WORKERS, RECONCILE_CHUNK_SIZE, RECONCILE_REPAIR))))
+
+if INTEREST_ANNUAL_RATE_BPS > 0 and INTEREST_CHECK_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask("interest", INTEREST_CHECK_INTERVAL_SECONDS, each_database(lambda connect: interest.pay_due_interest(connect, INTEREST_ANNUAL_RATE_BPS, INTEREST_CHUNK_SIZE, after_ledger_insert))))
+
+if outbox_relays and OUTBOX_RELAY_INTERVAL_SECONDS > 0:
+    for shard, relay in outbox_relays.items():
+        background_tasks.append(PeriodicTask(f"outbox-relay:{shard}" if shard else "outbox-relay", OUTBOX_RELAY_INTERVAL_SECONDS, relay.drain))
+
+if replica_router and REPLICA_LAG_CHECK_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask("replica-lag-check", REPLICA_LAG_CHECK_INTERVAL_SECONDS, lambda: replica_router.check_lag(lambda url: closing(connect_replica(url)), get_db_connection)))
+
+# Cached database checks behind /readyz, one per shard; stale after a few missed intervals
+readiness_checkers = {
+    shard: ReadinessChecker(functools.partial(get_db_connection, shard), max(3 * READINESS_CHECK_INTERVAL_SECONDS, 15)) for shard in database_shards()
+}
+for shard, checker in readiness_checkers.items():
+    background_tasks.append(PeriodicTask(f"readiness-check:{shard}" if shard else "readiness-check", READINESS_CHECK_INTERVAL_SECONDS, checker.check))
+
+if shard_map and SHARD_MAP_RELOAD_SECONDS > 0:
+    background_tasks.append(PeriodicTask("shard-map-reload", SHARD_MAP_RELOAD_SECONDS, lambda: shard_map.load(get_db_connection)))
+
+history_cache = HistoryCache(HISTORY_CACHE_MAX_ROWS, HISTORY_CACHE_MAX_ROWS_PER_USER, HISTORY_CACHE_SETTLE_SECONDS) if HISTORY_CACHE_MAX_ROWS > 0 else None
+
+# Each shard archives under its own prefix, since every shard has a partition per month
+transaction_archives = {
+    shard: archive.TransactionArchive(f"{TRANSACTION_ARCHIVE_URI.rstrip('/')}/{shard}" if shard else TRANSACTION_ARCHIVE_URI) for shard in database_shards()
+} if TRANSACTION_ARCHIVE_URI else {}
+if transaction_archives and TRANSACTION_ARCHIVE_INTERVAL_SECONDS > 0:
+    for shard, transaction_archive in transaction_archives.items():
+        background_tasks.append(PeriodicTask(
+            f"transaction-archiver:{shard}" if shard else "transaction-archiver", TRANSACTION_ARCHIVE_INTERVAL_SECONDS,
+            functools.partial(transaction_archive.archive_old_partitions, functools.partial(get_db_connection, shard), TRANSACTION_ARCHIVE_AFTER_MONTHS)
+        ))
+
 # Models
 class User(BaseModel):
     email: str
@@ -169,25 +601,88 @@ class LoginRequest(BaseModel):
 class TransactionRequest(BaseModel):
     email: str
     password: str
-    amount: Decimal
+    amount: MoneyAmount  # integer cents
 
 class BalanceRequest(BaseModel):
     email: str
     password: str
 
+class AdminBalancesRequest(BaseModel):
+    email: str
+    password: str
+    emails: List[str] = []
+    usernames: List[str] = []
+
 class TransactionsRequest(BaseModel):
     email: str
     password: str
+    limit: Optional[int] = None
+    before: Optional[str] = None
+    type: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    min_amount: Optional[MoneyAmount] = None
+    max_amount: Optional[MoneyAmount] = None
+    counterparty: Optional[str] = None
+    q: Optional[str] = None
 
 class ProfileRequest(BaseModel):
     email: str
     password: str
 
+class StatementRequest(BaseModel):
+    email: str
+    password: str
+
+class AnalyticsRequest(BaseModel):
+    email: str
+    password: str
+
+class BalanceAtRequest(BaseModel):
+    email: str
+    password: str
+    at: datetime
+
+class ScheduledTransferRequest(BaseModel):
+    from_email: str
+    password: str
+    to_email: str
+    amount: MoneyAmount  # integer cents
+    frequency: str = "once"  # once, daily, weekly or monthly
+    start_at: Optional[datetime] = None  # defaults to now
+
+class ScheduledTransfersRequest(BaseModel):
+    email: str
+    password: str
+
+class ScheduledTransferUpdateRequest(BaseModel):
+    email: str
+    password: str
+    amount: Optional[MoneyAmount] = None
+    frequency: Optional[str] = None
+    start_at: Optional[datetime] = None
+    status: Optional[str] = None  # active or paused
+
+class ScheduledTransferResolveRequest(BaseModel):
+    email: str  # admin
+    password: str
+    from_email: str  # the schedule's owner
+    paid: bool  # whether the ledger shows the interrupted occurrence went through
+
 class TransferRequest(BaseModel):
     from_email: str
     password: str
     to_email: str
-    amount: Decimal
+    amount: MoneyAmount  # integer cents
+
+class BatchTransferItem(BaseModel):
+    to_email: str
+    amount: MoneyAmount  # integer cents
+
+class BatchTransferRequest(BaseModel):
+    from_email: str
+    password: str
+    items: List[BatchTransferItem]
 
 class RecoveryPasswordRequest(BaseModel):
     email: str
@@ -215,11 +710,11 @@ class FacebookLoginResponse(BaseModel):
     access_token: str = None
 
 # DB setup - PostgreSQL only
-def create_db():
-    """Create database tables for PostgreSQL"""
-    logger.info("Creating database tables...")
+def create_db(shard=None):
+    """Create database tables for PostgreSQL (on one shard when sharded)"""
+    logger.info(f"Creating database tables... shard={shard or 'default'}")
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(shard) as conn:
             cursor = conn.cursor()
             logger.info("Creating users table...")
             
@@ -231,32 +726,63 @@ def create_db():
                     email VARCHAR(255) UNIQUE NOT NULL,
                     display_name VARCHAR(255),
                     password VARCHAR(255) NOT NULL,
-                    balance DECIMAL(10,2) NOT NULL DEFAULT 0.00,
+                    balance_cents BIGINT NOT NULL DEFAULT 0,
                     dob_month VARCHAR(10),
                     dob_day VARCHAR(10),
                     dob_year VARCHAR(10),
                     phone VARCHAR(20)
                 )
             ''')
+            # Back-office accounts; granted by hand (UPDATE users SET is_admin = TRUE WHERE email = ...)
+            cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN NOT NULL DEFAULT FALSE")
             logger.info("Users table created/verified successfully")
             
-            # Create transactions table
+            # Create transactions table (range-partitioned by month; older plain tables are
+            # converted with `python partitions.py migrate`)
             logger.info("Creating transactions table...")
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) NOT NULL,
-                    type VARCHAR(50) NOT NULL,
-                    amount DECIMAL(10,2) NOT NULL,
-                    old_balance DECIMAL(10,2) NOT NULL,
-                    new_balance DECIMAL(10,2) NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    description TEXT,
-                    other_user VARCHAR(255)
-                )
-            ''')
+            partitions.create_transactions_table(cursor)
+            # Convert tables created before money moved to integer cents (before indexing amount_cents)
+            migrate_money_columns(cursor)
+            partitions.ensure_partitions(cursor, TRANSACTION_PARTITION_MONTHS_AHEAD)
+            partitions.create_indexes(cursor)
+            archive.create_tables(cursor)
             logger.info("Transactions table created/verified successfully")
             
+            # Create balance_shards table for hot receiving accounts
+            logger.info("Creating balance_shards table...")
+            balance_shards.create_tables(cursor)
+            logger.info("Balance_shards table created/verified successfully")
+            
+            # Create daily_account_rollups table for statements
+            logger.info("Creating daily_account_rollups table...")
+            statements.create_tables(cursor)
+            logger.info("Daily_account_rollups table created/verified successfully")
+            
+            # Create balance_snapshots table for point-in-time balances
+            logger.info("Creating balance_snapshots table...")
+            snapshots.create_tables(cursor)
+            logger.info("Balance_snapshots table created/verified successfully")
+            
+            # Create reconciliation_runs table for balance vs ledger checks
+            logger.info("Creating reconciliation tables...")
+            reconciliation.create_tables(cursor)
+            logger.info("Reconciliation tables created/verified successfully")
+            
+            # Create interest_runs table for monthly interest checkpoints
+            logger.info("Creating interest_runs table...")
+            interest.create_tables(cursor)
+            logger.info("Interest_runs table created/verified successfully")
+            
+            # Create scheduled_transfers tables for standing orders
+            logger.info("Creating scheduled_transfers tables...")
+            scheduled_transfers.create_tables(cursor)
+            logger.info("Scheduled_transfers tables created/verified successfully")
+            
+            # Create outbox_events table for downstream event publishing
+            logger.info("Creating outbox_events table...")
+            outbox.create_tables(cursor)
+            logger.info("Outbox_events table created/verified successfully")
+            
             # Create recovery_codes table
             logger.info("Creating recovery_codes table...")
             cursor.execute('''
@@ -270,12 +796,53 @@ def create_db():
             ''')
             logger.info("Recovery_codes table created/verified successfully")
             
+            # Create idempotency_keys table
+            logger.info("Creating idempotency_keys table...")
+            idempotency_store.create_tables(cursor)
+            logger.info("Idempotency_keys table created/verified successfully")
+            
+            # Cross-shard transfer sagas (unused when unsharded)
+            logger.info("Creating transfer_sagas tables...")
+            sagas.create_tables(cursor)
+            logger.info("Transfer_sagas tables created/verified successfully")
+            
+            if shard:
+                # Ledger ids stay unique across shards, so rows keep them when accounts move
+                sharding.align_sequences(cursor, shard_map.indexes[shard])
+            
             conn.commit()
             logger.info("All database tables created/verified successfully")
+        if shard:
+            # Accounts from before username claims (first start with this shard)
+            sharding.claim_existing_usernames(get_db_connection, shard)
     except Exception as e:
         logger.error(f"Failed to create database tables: {e}")
         raise
 
+# Money columns that used to be DECIMAL(10,2) and are now BIGINT cents (<name>_cents)
+LEGACY_MONEY_COLUMNS = {
+    "users": ["balance"],
+    "transactions": ["amount", "old_balance", "new_balance"],
+}
+
+def migrate_money_columns(cursor):
+    """Convert legacy DECIMAL(10,2) money columns to BIGINT cents columns"""
+    for table, columns in LEGACY_MONEY_COLUMNS.items():
+        for column in columns:
+            cursor.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s",
+                (table, column)
+            )
+            if not cursor.fetchone():
+                continue
+            logger.info(f"Migrating {table}.{column} from DECIMAL to BIGINT cents...")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column} * 100)::BIGINT")
+            cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {column} TO {column}_cents")
+            if table == "users":
+                cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {column}_cents SET DEFAULT 0")
+            logger.info(f"Migrated {table}.{column} to {table}.{column}_cents")
+
 # Helpers
 def hash_password(password: str) -> str:
     logger.info("Hashing password...")
@@ -353,79 +920,157 @@ def authenticate(email: str, password: str):
         else:
             logger.warning(f"User not found: email={email}")
             return False
+    except (CircuitOpenError, psycopg2.OperationalError):
+        # An unreachable database is not a wrong password
+        raise
     except Exception as e:
         logger.error(f"Authentication error for email={email}: {e}")
         return False
 
-def get_balance(username: str) -> Decimal:
-    logger.info(f"Getting balance for username: {username}")
+def authenticate_admin(email: str, password: str):
+    """Verify an admin account's own password (OAuth sentinel sessions never count as admin)"""
+    logger.info(f"Authenticating admin: email={email}")
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"SELECT balance FROM users WHERE username = {placeholder}", (username,))
+            cursor.execute(f"SELECT password, is_admin FROM users WHERE email = {placeholder}", (email,))
+            row = cursor.fetchone()
+        if not row or not row[1]:
+            logger.warning(f"Admin authentication failed - not an admin: email={email}")
+            return False
+        return verify_password(password, row[0])
+    except (CircuitOpenError, psycopg2.OperationalError):
+        # An unreachable database is not a wrong password
+        raise
+    except Exception as e:
+        logger.error(f"Admin authentication error for email={email}: {e}")
+        return False
+
+def get_balance(username: str) -> int:
+    """Get a user's balance in integer cents"""
+    logger.info(f"Getting balance for username: {username}")
+    try:
+        with get_read_connection(username) as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(balance_shards.total_balance_sql("username"), (username,))
             balance = cursor.fetchone()
         
         if balance and balance[0] is not None:
-            logger.info(f"Balance retrieved successfully: username={username}, balance={balance[0]}")
-            return Decimal(balance[0])
+            logger.info(f"Balance retrieved successfully: username={username}, balance_cents={balance[0]}")
+            return balance[0]
         else:
             logger.warning(f"No balance found for username: {username}, returning default")
-            return Decimal('0.00')  # Default balance for new users
+            return 0  # Default balance for new users
     except Exception as e:
+        # Never report an unreadable balance as 0.00
         logger.error(f"Error getting balance for username={username}: {e}")
-        return Decimal('0.00')
+        raise
 
-def update_balance(username: str, new_balance: Decimal):
-    logger.info(f"Updating balance for username: {username}, new_balance: {new_balance}")
+def update_balance(username: str, new_balance: int):
+    logger.info(f"Updating balance for username: {username}, new_balance_cents: {new_balance}")
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"UPDATE users SET balance = {placeholder} WHERE username = {placeholder}", (str(new_balance), username))
+            cursor.execute(f"UPDATE users SET balance_cents = {placeholder} WHERE username = {placeholder}", (new_balance, username))
             conn.commit()
-        logger.info(f"Balance updated successfully: username={username}, new_balance={new_balance}")
+        logger.info(f"Balance updated successfully: username={username}, new_balance_cents={new_balance}")
     except Exception as e:
         logger.error(f"Error updating balance for username={username}: {e}")
         raise
 
+class InsufficientFundsError(HTTPException):
+    """400 for a debit the balance can't cover, typed so internal callers can tell it from other 400s"""
+    def __init__(self):
+        super().__init__(status_code=400, detail="Insufficient funds")
+
+def apply_credit(cursor, username: str, shard_count: int, amount: int, shard_key: str):
+    """Credit an account inside the caller's transaction; returns (old_balance, new_balance) in cents"""
+    if shard_count:
+        # Hot account: land the credit on one shard row instead of the users row
+        return balance_shards.credit(cursor, username, shard_count, amount, shard_key)
+    # One atomic UPDATE, so concurrent credits and debits can't overwrite each other
+    placeholder = get_placeholder()
+    cursor.execute(
+        f"UPDATE users SET balance_cents = balance_cents + {placeholder} WHERE username = {placeholder} RETURNING balance_cents",
+        (amount, username)
+    )
+    new_balance = cursor.fetchone()[0]
+    return new_balance - amount, new_balance
+
+def apply_debit(cursor, username: str, shard_count: int, amount: int):
+    """Debit an account inside the caller's transaction; returns (old_balance, new_balance) in cents, or None if funds are insufficient"""
+    if shard_count:
+        # Sharded account: lock the main row and all shards, then check the total
+        return balance_shards.debit(cursor, username, amount)
+    # Check and subtract in one statement so two debits can't both spend the same funds
+    placeholder = get_placeholder()
+    cursor.execute(
+        f'''UPDATE users SET balance_cents = balance_cents - {placeholder}
+            WHERE username = {placeholder} AND balance_cents >= {placeholder} RETURNING balance_cents''',
+        (amount, username, amount)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0] + amount, row[0]
+
+def credit_account(username: str, shard_count: int, amount: int, shard_key: str):
+    """Credit an account; returns (old_balance, new_balance) in cents"""
+    with get_db_connection() as conn:
+        result = apply_credit(conn.cursor(), username, shard_count, amount, shard_key)
+        conn.commit()
+    return result
+
+def debit_account(username: str, shard_count: int, amount: int):
+    """Debit an account; returns (old_balance, new_balance) in cents, or None if funds are insufficient"""
+    with get_db_connection() as conn:
+        result = apply_debit(conn.cursor(), username, shard_count, amount)
+        conn.commit()
+    return result
+
 def record_transaction(username, type_, amount, old_balance, new_balance, other_user=None):
     logger.info(f"Recording transaction: username={username}, type={type_}, amount={amount}, old_balance={old_balance}, new_balance={new_balance}, other_user={other_user}")
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            # Add other_user info to the transaction description
-            description = f"to {other_user}" if other_user and type_ == "Transfer Out" else f"from {other_user}" if other_user and type_ == "Transfer In" else ""
-            placeholder = get_placeholder()
-            cursor.execute(f'''
-                INSERT INTO transactions (username, type, amount, old_balance, new_balance, timestamp, description)
-                VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
-            ''', (username, type_, str(amount), str(old_balance), str(new_balance), datetime.now().strftime('%Y-%m-%d %H:%M:%S'), description))
-            conn.commit()
+        row = build_ledger_row(username, type_, amount, old_balance, new_balance, other_user)
+        ledger_writer = ledger_writers.get(sharding.current_shard())
+        if ledger_writer:
+            # Blocks until the batch holding this row has been committed
+            ledger_writer.write(row)
+        else:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                ids = insert_ledger_rows(cursor, [row])
+                after_ledger_insert(cursor, ids)
+                conn.commit()
         logger.info(f"Transaction recorded successfully: username={username}, type={type_}, amount={amount}")
     except Exception as e:
         logger.error(f"Error recording transaction for username={username}: {e}")
         raise
 
 
-def get_balance_by_email(email: str) -> Decimal:
+def get_balance_by_email(email: str) -> int:
+    """Get a user's balance in integer cents by email"""
     logger.info(f"Getting balance by email: {email}")
     try:
-        with get_db_connection() as conn:
+        with get_read_connection(email) as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"SELECT balance FROM users WHERE email = {placeholder}", (email,))
+            cursor.execute(balance_shards.total_balance_sql("email"), (email,))
             balance = cursor.fetchone()
         
         if balance and balance[0] is not None:
-            logger.info(f"Balance retrieved by email successfully: email={email}, balance={balance[0]}")
-            return Decimal(balance[0])
+            logger.info(f"Balance retrieved by email successfully: email={email}, balance_cents={balance[0]}")
+            return balance[0]
         else:
             logger.warning(f"No balance found for email: {email}, returning default")
-            return Decimal('0.00')  # Default balance for new users
+            return 0  # Default balance for new users
     except Exception as e:
+        # Never report an unreadable balance as 0.00
         logger.error(f"Error getting balance by email={email}: {e}")
-        return Decimal('0.00')
+        raise
 
 def generate_recovery_code() -> str:
     """Generate a random 16-character recovery code"""
@@ -580,6 +1225,7 @@ def verify_google_token(token: str) -> dict:
         logger.error(f"Google token verification error: {e}")
         raise HTTPException(status_code=500, detail="Token verification failed")
 
+@account_route(lambda arguments: arguments['google_info'].get('email'))
 def create_or_get_google_user(google_info: dict) -> dict:
     """Create or get user from Google OAuth info with account linking"""
     email = google_info.get('email')
@@ -628,10 +1274,7 @@ def create_or_get_google_user(google_info: dict) -> dict:
                 # Make sure username is unique by adding numbers if needed
                 username = username_base
                 counter = 1
-                while True:
-                    cursor.execute(f"SELECT id FROM users WHERE username = {placeholder}", (username,))
-                    if not cursor.fetchone():
-                        break
+                while not username_available(cursor, username, email):
                     username = f"{username_base}_{counter:04d}"  # e.g., john_doe_0001
                     counter += 1
                 
@@ -695,6 +1338,7 @@ def verify_facebook_token(access_token: str) -> dict:
         logger.error(f"Facebook token verification error: {e}")
         raise HTTPException(status_code=400, detail=f"Invalid token: {str(e)}")
 
+@account_route(lambda arguments: arguments['facebook_info'].get('email'))
 def create_or_get_facebook_user(facebook_info: dict) -> dict:
     """Create or retrieve user from Facebook info with account linking"""
     logger.info("Creating or retrieving Facebook user...")
@@ -749,10 +1393,7 @@ def create_or_get_facebook_user(facebook_info: dict) -> dict:
                 # Make sure username is unique by adding numbers if needed
                 username = username_base
                 counter = 1
-                while True:
-                    cursor.execute(f"SELECT id FROM users WHERE username = {placeholder}", (username,))
-                    if not cursor.fetchone():
-                        break
+                while not username_available(cursor, username, email):
                     username = f"{username_base}_{counter:04d}"  # e.g., john_doe_0001
                     counter += 1
                 
@@ -784,6 +1425,7 @@ def create_or_get_facebook_user(facebook_info: dict) -> dict:
 
 # Routes
 @app.post("/register")
+@account_route(lambda arguments: arguments['user'].email)
 def register(user: User):
     logger.info(f"Register attempt: email={user.email}, username={user.username}")
     try:
@@ -795,15 +1437,29 @@ def register(user: User):
         with get_db_connection() as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"INSERT INTO users (username, email, display_name, password, dob_month, dob_day, dob_year, phone) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})", (user.username, user.email, user.display_name, hashed_pw, user.dob_month, user.dob_day, user.dob_year, user.phone))
-            conn.commit()
+            if shard_map and not username_available(cursor, user.username, user.email):
+                # The unique constraint only covers this shard
+                raise psycopg2.errors.UniqueViolation("duplicate key value: username already exists on another shard")
+            try:
+                cursor.execute(f"INSERT INTO users (username, email, display_name, password, dob_month, dob_day, dob_year, phone) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})", (user.username, user.email, user.display_name, hashed_pw, user.dob_month, user.dob_day, user.dob_year, user.phone))
+                conn.commit()
+            except psycopg2.IntegrityError:
+                if shard_map:
+                    # e.g. the email is already registered: don't keep the username from everyone else
+                    conn.rollback()
+                    release_username(user.username, user.email)
+                raise
         logger.info(f"User inserted into database successfully: email={user.email}")
+        pin_reads_to_primary(user.email)
         
         # Welcome email functionality removed - using Gmail SMTP only
         logger.info("User registration completed successfully")
         
         logger.info(f"Registration successful: email={user.email}")
         return {"message": "User registered successfully"}
+    except (CircuitOpenError, psycopg2.OperationalError):
+        # An unreachable database is a 503 (see the exception handlers), not a failed registration
+        raise
     except Exception as e:
         logger.error(f"Registration failed: {e}")
         if "duplicate key" in str(e).lower() or "unique constraint" in str(e).lower():
@@ -812,6 +1468,7 @@ def register(user: User):
         raise HTTPException(status_code=500, detail="Registration failed")
 
 @app.post("/login")
+@account_route(lambda arguments: arguments['user'].email)
 def login(user: LoginRequest):
     logger.info(f"Login attempt: email={user.email}")
     try:
@@ -1038,6 +1695,7 @@ def facebook_config(request: Request):
     }
 
 @app.post("/api/setup-password")
+@account_route(lambda arguments: arguments['request'].get('email'))
 def setup_password(request: dict):
     """Set up password for OAuth users"""
     email = request.get("email")
@@ -1072,11 +1730,15 @@ def setup_password(request: dict):
             logger.info(f"Password set up successfully for OAuth user: {email}")
             return {"message": "Password set up successfully"}
             
+    except (CircuitOpenError, psycopg2.OperationalError):
+        # Database unreachable: let the exception handlers answer 503
+        raise
     except Exception as e:
         logger.error(f"Setup password error: {e}")
         raise HTTPException(status_code=500, detail="Failed to set up password")
 
 @app.post("/api/change-password")
+@account_route(lambda arguments: arguments['request'].get('email'))
 def change_password(request: dict):
     """Change password for email users"""
     email = request.get("email")
@@ -1116,18 +1778,113 @@ def change_password(request: dict):
             logger.info(f"Password changed successfully for user: {email}")
             return {"message": "Password changed successfully"}
             
+    except (CircuitOpenError, psycopg2.OperationalError):
+        # Same as setup_password: a 503 from the handlers, not a 500
+        raise
     except Exception as e:
         logger.error(f"Change password error: {e}")
         raise HTTPException(status_code=500, detail="Failed to change password")
 
+def run_idempotent(idempotency_key, route, email, password, fields, operation):
+    """Authenticate and run a money-moving operation at most once per Idempotency-Key"""
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+
+    if idempotency_key:
+        fingerprint = request_fingerprint(route, email, fields)
+        cached = idempotency_store.get_recent(email, idempotency_key, fingerprint, password)
+        if cached is not None:
+            logger.info(f"Idempotent replay from memory: route={route}, email={email}")
+            return JSONResponse(content=cached, headers={"Idempotent-Replayed": "true"})
+
+    if not authenticate(email, password):
+        logger.warning(f"{route} failed - invalid credentials: email={email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    if not idempotency_key:
+        try:
+            return operation()
+        finally:
+            pin_reads_to_primary(email)
+
+    with get_db_connection() as conn:
+        outcome, stored = idempotency_store.claim(conn, email, idempotency_key, route, fingerprint)
+    if outcome == REPLAY:
+        logger.info(f"Idempotent replay from database: route={route}, email={email}")
+        idempotency_store.remember(email, idempotency_key, fingerprint, password, stored)
+        return JSONResponse(content=stored, headers={"Idempotent-Replayed": "true"})
+    if outcome == MISMATCH:
+        logger.warning(f"Idempotency-Key reused with a different request: route={route}, email={email}")
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if outcome == UNKNOWN:
+        logger.warning(f"Idempotency-Key outcome unknown: route={route}, email={email}")
+        raise HTTPException(status_code=409, detail="An earlier request with this Idempotency-Key did not finish; check your transactions before retrying with a new key")
+    if outcome != CLAIMED:
+        logger.warning(f"Idempotency-Key still in progress: route={route}, email={email}")
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is already in progress")
+
+    try:
+        result = operation()
+    except (HTTPException, sharding.ShardMoving) as e:
+        with get_db_connection() as conn:
+            if isinstance(e, HTTPException) and e.status_code >= 500:
+                idempotency_store.mark_unknown(conn, email, idempotency_key, e.detail)
+            else:
+                # Rejections (bad amount, insufficient funds, unknown recipient, ...) happen before money moves
+                idempotency_store.release(conn, email, idempotency_key)
+        raise
+    except Exception as e:
+        # Failed part-way: the debit may already be committed, so a retry with this key must not run again
+        with get_db_connection() as conn:
+            idempotency_store.mark_unknown(conn, email, idempotency_key, e)
+        raise
+    finally:
+        pin_reads_to_primary(email)
+    with get_db_connection() as conn:
+        idempotency_store.complete(conn, email, idempotency_key, result)
+    idempotency_store.remember(email, idempotency_key, fingerprint, password, result)
+    return result
+
+# Per-account velocity limits on withdrawals and transfers (None when no rules are configured)
+velocity_checker = velocity.VelocityChecker(velocity.make_store(VELOCITY_BACKEND), velocity.parse_rules(VELOCITY_RULES)) if VELOCITY_RULES else None
+
+class VelocityLimitError(HTTPException):
+    """429 for a money movement over a velocity rule"""
+    def __init__(self, error: velocity.VelocityLimitExceeded):
+        super().__init__(status_code=429, detail=str(error))
+
+def reserve_velocity(action, email, amount, recipient):
+    """Count a money movement against the velocity rules; returns a reservation for release_velocity()"""
+    if not velocity_checker:
+        return None
+    try:
+        return velocity_checker.reserve(action, email, amount, recipient)
+    except velocity.VelocityLimitExceeded as e:
+        logger.warning(f"{action} blocked by velocity rule {e.rule['name']}: email={email}, amount={amount}")
+        raise VelocityLimitError(e)
+
+def release_velocity(reservation):
+    """Take back a reservation whose money movement didn't happen"""
+    if reservation is not None:
+        velocity_checker.release(reservation)
+
+def run_velocity_checked(action, email, amount, recipient, operation):
+    """Run an authenticated money movement under the velocity rules; it only counts if it succeeds"""
+    reservation = reserve_velocity(action, email, amount, recipient)
+    try:
+        return operation()
+    except Exception:
+        release_velocity(reservation)
+        raise
+
 @app.post("/deposit")
-def deposit(data: TransactionRequest):
+@account_route(lambda arguments: arguments['data'].email)
+def deposit(data: TransactionRequest, idempotency_key: Optional[str] = Header(None)):
     logger.info(f"Deposit request: email={data.email}, amount={data.amount}")
-    
-    if not authenticate(data.email, data.password):
-        logger.warning(f"Deposit failed - invalid credentials: email={data.email}")
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return run_idempotent(idempotency_key, "deposit", data.email, data.password, {"amount": data.amount}, lambda: process_deposit(data))
 
+def process_deposit(data: TransactionRequest):
+    """Apply a deposit for an authenticated request"""
     if data.amount <= 0:
         logger.warning(f"Deposit failed - invalid amount: email={data.email}, amount={data.amount}")
         raise HTTPException(status_code=400, detail="Amount must be positive")
@@ -1138,35 +1895,33 @@ def deposit(data: TransactionRequest):
         with get_db_connection() as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.email,))
+            cursor.execute(f"SELECT username, balance_shard_count FROM users WHERE email = {placeholder}", (data.email,))
             row = cursor.fetchone()
             if not row:
                 logger.warning(f"User not found for deposit: email={data.email}")
                 raise HTTPException(status_code=404, detail="User not found")
-            username = row[0]
+            username, shard_count = row
             logger.info(f"Username found: {username}")
 
-        old_balance = get_balance(username)
-        new_balance = old_balance + data.amount
+        old_balance, new_balance = credit_account(username, shard_count, data.amount, secrets.token_hex(8))
         logger.info(f"Balance calculation: old={old_balance}, amount={data.amount}, new={new_balance}")
         
-        update_balance(username, new_balance)
         record_transaction(username, "Deposit", data.amount, old_balance, new_balance)
 
         logger.info(f"Deposit successful: email={data.email}, amount={data.amount}, new_balance={new_balance}")
-        return {"message": "Deposit successful", "new_balance": str(new_balance)}
+        return {"message": "Deposit successful", "new_balance": format_cents(new_balance)}
     except Exception as e:
         logger.error(f"Deposit error: email={data.email}, error={e}")
         raise
 
 @app.post("/withdraw")
-def withdraw(data: TransactionRequest):
+@account_route(lambda arguments: arguments['data'].email)
+def withdraw(data: TransactionRequest, idempotency_key: Optional[str] = Header(None)):
     logger.info(f"Withdraw request: email={data.email}, amount={data.amount}")
-    
-    if not authenticate(data.email, data.password):
-        logger.warning(f"Withdraw failed - invalid credentials: email={data.email}")
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return run_idempotent(idempotency_key, "withdraw", data.email, data.password, {"amount": data.amount}, lambda: run_velocity_checked("withdraw", data.email, data.amount, None, lambda: process_withdraw(data)))
 
+def process_withdraw(data: TransactionRequest):
+    """Apply a withdrawal for an authenticated request"""
     if data.amount <= 0:
         logger.warning(f"Withdraw failed - invalid amount: email={data.email}, amount={data.amount}")
         raise HTTPException(status_code=400, detail="Amount must be positive")
@@ -1177,41 +1932,39 @@ def withdraw(data: TransactionRequest):
         with get_db_connection() as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.email,))
+            cursor.execute(f"SELECT username, balance_shard_count FROM users WHERE email = {placeholder}", (data.email,))
             row = cursor.fetchone()
             if not row:
                 logger.warning(f"User not found for withdraw: email={data.email}")
                 raise HTTPException(status_code=404, detail="User not found")
-            username = row[0]
+            username, shard_count = row
             logger.info(f"Username found: {username}")
 
-        old_balance = get_balance(username)
-        logger.info(f"Current balance: {old_balance}, withdrawal amount: {data.amount}")
-        
-        if old_balance < data.amount:
-            logger.warning(f"Insufficient funds: email={data.email}, balance={old_balance}, amount={data.amount}")
-            raise HTTPException(status_code=400, detail="Insufficient funds")
+        result = debit_account(username, shard_count, data.amount)
+        if result is None:
+            logger.warning(f"Insufficient funds: email={data.email}, amount={data.amount}")
+            raise InsufficientFundsError()
 
-        new_balance = old_balance - data.amount
+        old_balance, new_balance = result
         logger.info(f"Balance calculation: old={old_balance}, amount={data.amount}, new={new_balance}")
         
-        update_balance(username, new_balance)
         record_transaction(username, "Withdraw", data.amount, old_balance, new_balance)
 
         logger.info(f"Withdrawal successful: email={data.email}, amount={data.amount}, new_balance={new_balance}")
-        return {"message": "Withdrawal successful", "new_balance": str(new_balance)}
+        return {"message": "Withdrawal successful", "new_balance": format_cents(new_balance)}
     except Exception as e:
         logger.error(f"Withdrawal error: email={data.email}, error={e}")
         raise
 
 @app.post("/transfer")
-def transfer(data: TransferRequest):
+@account_route(lambda arguments: arguments['data'].from_email)
+def transfer(data: TransferRequest, idempotency_key: Optional[str] = Header(None)):
     logger.info(f"Transfer request: from={data.from_email}, to={data.to_email}, amount={data.amount}")
-    
-    if not authenticate(data.from_email, data.password):
-        logger.warning(f"Transfer failed - invalid credentials: from_email={data.from_email}")
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    fields = {"to_email": data.to_email, "amount": data.amount}
+    return run_idempotent(idempotency_key, "transfer", data.from_email, data.password, fields, lambda: run_velocity_checked("transfer", data.from_email, data.amount, data.to_email, lambda: process_transfer(data)))
 
+def process_transfer(data: TransferRequest):
+    """Apply a transfer for an authenticated request"""
     if data.amount <= 0:
         logger.warning(f"Transfer failed - invalid amount: amount={data.amount}")
         raise HTTPException(status_code=400, detail="Amount must be positive")
@@ -1220,53 +1973,47 @@ def transfer(data: TransferRequest):
         logger.warning(f"Transfer failed - cannot transfer to self: email={data.from_email}")
         raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
 
+    recipient_shard = shard_map.shard_for(data.to_email) if shard_map else None
+    if recipient_shard != sharding.current_shard():
+        return process_cross_shard_transfer(data, recipient_shard)
+
     try:
         # Check if recipient exists
         logger.info(f"Checking if recipient exists: {data.to_email}")
         with get_db_connection() as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
-            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.to_email,))
+            cursor.execute(f"SELECT username, balance_shard_count FROM users WHERE email = {placeholder}", (data.to_email,))
             recipient_row = cursor.fetchone()
             if not recipient_row:
                 logger.warning(f"Recipient not found: {data.to_email}")
                 raise HTTPException(status_code=404, detail="Recipient not found")
-            recipient_username = recipient_row[0]
+            recipient_username, recipient_shards = recipient_row
             logger.info(f"Recipient found: {recipient_username}")
 
             # Get sender username
             logger.info(f"Getting sender username: {data.from_email}")
-            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.from_email,))
+            cursor.execute(f"SELECT username, balance_shard_count FROM users WHERE email = {placeholder}", (data.from_email,))
             sender_row = cursor.fetchone()
             if not sender_row:
                 logger.warning(f"Sender not found: {data.from_email}")
                 raise HTTPException(status_code=404, detail="Sender not found")
-            sender_username = sender_row[0]
+            sender_username, sender_shards = sender_row
             logger.info(f"Sender found: {sender_username}")
 
-        # Check sender has sufficient funds
-        logger.info(f"Checking sender balance: {sender_username}")
-        sender_old_balance = get_balance(sender_username)
-        logger.info(f"Sender current balance: {sender_old_balance}")
-        
-        if sender_old_balance < data.amount:
-            logger.warning(f"Insufficient funds for transfer: sender={sender_username}, balance={sender_old_balance}, amount={data.amount}")
-            raise HTTPException(status_code=400, detail="Insufficient funds")
-
-        # Get recipient's current balance
-        logger.info(f"Getting recipient balance: {recipient_username}")
-        recipient_old_balance = get_balance(recipient_username)
-        logger.info(f"Recipient current balance: {recipient_old_balance}")
-
-        # Perform the transfer
-        sender_new_balance = sender_old_balance - data.amount
-        recipient_new_balance = recipient_old_balance + data.amount
+        # Debit the sender if funds are sufficient
+        logger.info(f"Debiting sender: {sender_username}")
+        sender_result = debit_account(sender_username, sender_shards, data.amount)
+        if sender_result is None:
+            logger.warning(f"Insufficient funds for transfer: sender={sender_username}, amount={data.amount}")
+            raise InsufficientFundsError()
+        sender_old_balance, sender_new_balance = sender_result
+
+        # Credit the recipient (hot accounts spread credits across shards keyed by sender)
+        logger.info(f"Crediting recipient: {recipient_username}")
+        recipient_old_balance, recipient_new_balance = credit_account(recipient_username, recipient_shards, data.amount, sender_username)
         logger.info(f"Transfer calculation: sender {sender_old_balance} -> {sender_new_balance}, recipient {recipient_old_balance} -> {recipient_new_balance}")
 
-        # Update both balances
-        update_balance(sender_username, sender_new_balance)
-        update_balance(recipient_username, recipient_new_balance)
-
         # Record transactions for both users
         record_transaction(sender_username, "Transfer Out", data.amount, sender_old_balance, sender_new_balance, other_user=recipient_username)
         record_transaction(recipient_username, "Transfer In", data.amount, recipient_old_balance, recipient_new_balance, other_user=sender_username)
@@ -1274,15 +2021,467 @@ def transfer(data: TransferRequest):
         logger.info(f"Transfer successful: {sender_username} -> {recipient_username}, amount={data.amount}")
         return {
             "message": f"Transfer successful to {data.to_email}", 
-            "new_balance": str(sender_new_balance),
+            "new_balance": format_cents(sender_new_balance),
             "recipient_email": data.to_email,
-            "amount": str(data.amount)
+            "amount": format_cents(data.amount)
         }
     except Exception as e:
         logger.error(f"Transfer error: from={data.from_email}, to={data.to_email}, error={e}")
         raise
 
+def process_cross_shard_transfer(data: TransferRequest, recipient_shard: str):
+    """Transfer to an account on another database shard: debit here, then credit there through a saga"""
+    try:
+        logger.info(f"Checking if recipient exists: {data.to_email}, shard={recipient_shard}")
+        with get_db_connection(recipient_shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT username FROM users WHERE email = %s", (data.to_email,))
+            recipient_row = cursor.fetchone()
+        if not recipient_row:
+            logger.warning(f"Recipient not found: {data.to_email}")
+            raise HTTPException(status_code=404, detail="Recipient not found")
+        recipient_username = recipient_row[0]
+
+        # Debit, ledger row and saga commit together, so the credit can always be finished or refunded
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT username, balance_shard_count FROM users WHERE email = %s", (data.from_email,))
+            sender_row = cursor.fetchone()
+            if not sender_row:
+                logger.warning(f"Sender not found: {data.from_email}")
+                raise HTTPException(status_code=404, detail="Sender not found")
+            sender_username, sender_shards = sender_row
+            sender_result = apply_debit(cursor, sender_username, sender_shards, data.amount)
+            if sender_result is None:
+                logger.warning(f"Insufficient funds for transfer: sender={sender_username}, amount={data.amount}")
+                raise InsufficientFundsError()
+            sender_old_balance, sender_new_balance = sender_result
+            ids = insert_ledger_rows(cursor, [build_ledger_row(sender_username, "Transfer Out", data.amount, sender_old_balance, sender_new_balance, other_user=recipient_username)])
+            after_ledger_insert(cursor, ids)
+            saga_id = sagas.begin(cursor, data.from_email, sender_username, data.to_email, recipient_username, data.amount)
+            conn.commit()
+
+        status = transfer_sagas.settle(sharding.current_shard(), saga_id)
+        if status == sagas.COMPENSATED:
+            # The recipient was deleted in between; the sender has been refunded
+            raise HTTPException(status_code=404, detail="Recipient not found")
+        logger.info(f"Cross-shard transfer {status}: {sender_username} -> {recipient_username}, amount={data.amount}, saga={saga_id}")
+        return {
+            "message": f"Transfer successful to {data.to_email}" if status == sagas.COMPLETED else f"Transfer to {data.to_email} accepted, credit pending",
+            "new_balance": format_cents(sender_new_balance),
+            "recipient_email": data.to_email,
+            "amount": format_cents(data.amount),
+            "settled": status == sagas.COMPLETED,
+        }
+    except Exception as e:
+        logger.error(f"Cross-shard transfer error: from={data.from_email}, to={data.to_email}, error={e}")
+        raise
+
+def apply_saga_credit(cursor, saga):
+    """Credit step of a cross-shard transfer, on the recipient's shard"""
+    cursor.execute("SELECT username, balance_shard_count FROM users WHERE email = %s", (saga["to_email"],))
+    row = cursor.fetchone()
+    if row is None:
+        raise sagas.RecipientMissing(saga["to_email"])
+    username, shard_count = row
+    old_balance, new_balance = apply_credit(cursor, username, shard_count, saga["amount_cents"], saga["from_username"])
+    ids = insert_ledger_rows(cursor, [build_ledger_row(username, "Transfer In", saga["amount_cents"], old_balance, new_balance, other_user=saga["from_username"])])
+    after_ledger_insert(cursor, ids)
+
+def refund_saga(cursor, saga):
+    """Compensation for a cross-shard transfer whose recipient is gone, on the sender's shard"""
+    cursor.execute("SELECT balance_shard_count FROM users WHERE email = %s", (saga["from_email"],))
+    shard_count = cursor.fetchone()[0]
+    old_balance, new_balance = apply_credit(cursor, saga["from_username"], shard_count, saga["amount_cents"], saga["id"])
+    ids = insert_ledger_rows(cursor, [build_ledger_row(
+        saga["from_username"], "Transfer In", saga["amount_cents"], old_balance, new_balance,
+        other_user=saga["to_username"], description=f"refund of transfer to {saga['to_username']}"
+    )])
+    after_ledger_insert(cursor, ids)
+
+# Finishes cross-shard transfers (credit on the recipient's shard, or refund); None when unsharded
+transfer_sagas = sagas.TransferSagas(
+    get_db_connection, shard_map.shard_for, apply_saga_credit, refund_saga, SAGA_RETRY_SECONDS
+) if shard_map else None
+if transfer_sagas and SAGA_RECOVERY_INTERVAL_SECONDS > 0:
+    background_tasks.append(PeriodicTask(
+        "transfer-saga-recovery", SAGA_RECOVERY_INTERVAL_SECONDS, each_database(lambda connect: transfer_sagas.recover(sharding.current_shard()))
+    ))
+
+@app.post("/batch-transfer")
+@account_route(lambda arguments: arguments['data'].from_email)
+def batch_transfer(data: BatchTransferRequest, idempotency_key: Optional[str] = Header(None)):
+    """Pay many recipients from one account (payroll) in a single transaction"""
+    logger.info(f"Batch transfer request: from={data.from_email}, items={len(data.items)}")
+    if not 0 < len(data.items) <= BATCH_TRANSFER_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch must have between 1 and {BATCH_TRANSFER_MAX_ITEMS} items")
+    fields = {"items": [[item.to_email, item.amount] for item in data.items]}
+    return run_idempotent(idempotency_key, "batch-transfer", data.from_email, data.password, fields, lambda: process_batch_transfer(data))
+
+def process_batch_transfer(data: BatchTransferRequest):
+    """Apply a batch transfer for an authenticated request.
+
+    Items that can't be paid (bad amount, unknown recipient, paying
+    yourself) are reported and skipped. The rest are applied all or
+    nothing: every affected users row is locked in username order, then
+    the debit, the credits and all ledger rows are written in one
+    transaction. Recipients on other database shards are debited in that
+    transaction too and credited afterwards by transfer sagas; an item
+    whose credit hasn't gone through yet is reported as pending. Each
+    item counts against the sender's transfer velocity limits like a
+    single /transfer; items over a limit are reported and skipped.
+    """
+    results = [{"index": i, "to_email": item.to_email, "amount": format_cents(item.amount), "status": "paid"} for i, item in enumerate(data.items)]
+    # Velocity reservations by item index, given back if the batch doesn't commit
+    reservations = {}
+    committed = False
+    try:
+        remote_accounts = find_remote_accounts(item.to_email for item in data.items)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT email, username, balance_shard_count FROM users WHERE email = ANY(%s)",
+                (list({data.from_email} | {item.to_email for item in data.items}),)
+            )
+            accounts = {email: (username, shards) for email, username, shards in cursor.fetchall()}
+            if data.from_email not in accounts:
+                logger.warning(f"Batch transfer sender not found: {data.from_email}")
+                raise HTTPException(status_code=404, detail="Sender not found")
+            sender_username, sender_shards = accounts[data.from_email]
+            
+            payable = []
+            remote_payable = []
+            for result, item in zip(results, data.items):
+                if item.amount <= 0:
+                    result.update(status="failed", error="Amount must be positive")
+                elif item.to_email == data.from_email:
+                    result.update(status="failed", error="Cannot transfer to yourself")
+                elif item.to_email not in remote_accounts and item.to_email not in accounts:
+                    result.update(status="failed", error="Recipient not found")
+                else:
+                    try:
+                        reservations[result["index"]] = reserve_velocity("transfer", data.from_email, item.amount, item.to_email)
+                    except VelocityLimitError as e:
+                        result.update(status="failed", error=e.detail)
+                        continue
+                    if item.to_email in remote_accounts:
+                        remote_payable.append((result, item.to_email, remote_accounts[item.to_email], item.amount))
+                    else:
+                        payable.append((accounts[item.to_email][0], item.amount))
+            total = sum(amount for _, amount in payable) + sum(amount for _, _, _, amount in remote_payable)
+            if not payable and not remote_payable:
+                logger.warning(f"Batch transfer has nothing payable: from={data.from_email}")
+                return {"message": "No payable items", "paid": 0, "failed": len(results), "total": format_cents(0), "results": results}
+            
+            # Lock every affected account in a fixed order so concurrent batches can't deadlock
+            usernames = sorted({sender_username} | {username for username, _ in payable})
+            cursor.execute("SELECT username, balance_cents FROM users WHERE username = ANY(%s) ORDER BY username FOR UPDATE", (usernames,))
+            balances = dict(cursor.fetchall())
+            if sender_shards:
+                balances[sender_username] = balance_shards._lock_and_fold(cursor, sender_username)
+            # Sharded recipients are credited on their main row; their reported balance includes the shards
+            shard_totals = {}
+            sharded = [accounts[email][0] for email in accounts if accounts[email][1] and accounts[email][0] != sender_username]
+            if sharded:
+                cursor.execute("SELECT username, SUM(balance_cents)::BIGINT FROM balance_shards WHERE username = ANY(%s) GROUP BY username", (sharded,))
+                shard_totals = dict(cursor.fetchall())
+            
+            sender_balance = balances[sender_username]
+            if sender_balance < total:
+                logger.warning(f"Insufficient funds for batch transfer: sender={sender_username}, total={total}, balance={sender_balance}")
+                raise InsufficientFundsError()
+            
+            ledger_rows = []
+            running = {username: balances[username] + shard_totals.get(username, 0) for username in usernames}
+            for username, amount in payable:
+                old_sender = running[sender_username]
+                running[sender_username] -= amount
+                ledger_rows.append(build_ledger_row(sender_username, "Transfer Out", amount, old_sender, running[sender_username], other_user=username))
+                old_recipient = running[username]
+                running[username] += amount
+                ledger_rows.append(build_ledger_row(username, "Transfer In", amount, old_recipient, running[username], other_user=sender_username))
+            for _, _, username, amount in remote_payable:
+                old_sender = running[sender_username]
+                running[sender_username] -= amount
+                ledger_rows.append(build_ledger_row(sender_username, "Transfer Out", amount, old_sender, running[sender_username], other_user=username))
+            
+            credits = {}
+            for username, amount in payable:
+                credits[username] = credits.get(username, 0) + amount
+            credits[sender_username] = -total
+            execute_values(
+                cursor,
+                "UPDATE users SET balance_cents = users.balance_cents + v.delta FROM (VALUES %s) AS v (username, delta) WHERE users.username = v.username",
+                list(credits.items())
+            )
+            ids = insert_ledger_rows(cursor, ledger_rows)
+            after_ledger_insert(cursor, ids)
+            saga_ids = [sagas.begin(cursor, data.from_email, sender_username, email, username, amount) for _, email, username, amount in remote_payable]
+            conn.commit()
+            committed = True
+        
+        for (result, _, _, amount), saga_id in zip(remote_payable, saga_ids):
+            status = transfer_sagas.settle(sharding.current_shard(), saga_id)
+            if status == sagas.PENDING:
+                result.update(status="pending")
+            elif status == sagas.COMPENSATED:
+                # Recipient deleted in between; the sender has been refunded
+                result.update(status="failed", error="Recipient not found")
+                release_velocity(reservations[result["index"]])
+                running[sender_username] += amount
+                total -= amount
+        
+        paid = sum(1 for result in results if result["status"] != "failed")
+        logger.info(f"Batch transfer successful: from={sender_username}, paid={paid}, failed={len(results) - paid}, total={total}")
+        return {
+            "message": f"Batch transfer paid {paid} of {len(results)} items",
+            "new_balance": format_cents(running[sender_username]),
+            "paid": paid,
+            "failed": len(results) - paid,
+            "total": format_cents(total),
+            "results": results,
+        }
+    except Exception as e:
+        logger.error(f"Batch transfer error: from={data.from_email}, error={e}")
+        if not committed:
+            for reservation in reservations.values():
+                release_velocity(reservation)
+        raise
+
+def execute_scheduled_transfer(from_email: str, to_email: str, amount: int):
+    """Run a due scheduled transfer through the normal transfer path"""
+    try:
+        # Runs on a scheduler worker thread, so the sender's shard scope has to be set here
+        with account_scope(from_email):
+            # amount is already integer cents; skip MoneyAmount parsing, which reads numbers as dollars
+            request = TransferRequest.model_construct(from_email=from_email, password="", to_email=to_email, amount=amount)
+            # Standing orders count against the sender's velocity limits like any other transfer
+            run_velocity_checked("transfer", from_email, amount, to_email, lambda: process_transfer(request))
+    except sharding.ShardMoving as e:
+        # Raised before any money moves
+        raise scheduled_transfers.RetryLater(str(e))
+    except VelocityLimitError as e:
+        raise scheduled_transfers.RetryLater(e.detail)
+    except InsufficientFundsError:
+        raise scheduled_transfers.InsufficientFunds()
+    except HTTPException as e:
+        # process_transfer only raises HTTPException before any money has moved
+        raise scheduled_transfers.TransferRejected(e.detail)
+
+# One runner per shard; each claims the schedules of the senders stored there
+scheduled_transfer_runners = {
+    shard: scheduled_transfers.ScheduledTransferRunner(
+        functools.partial(get_db_connection, shard), execute_scheduled_transfer, SCHEDULED_TRANSFER_BATCH_SIZE, SCHEDULED_TRANSFER_WORKERS,
+        SCHEDULED_TRANSFER_MAX_ATTEMPTS, SCHEDULED_TRANSFER_RETRY_DELAY_SECONDS
+    ) for shard in database_shards()
+}
+if SCHEDULED_TRANSFER_INTERVAL_SECONDS > 0:
+    for shard, runner in scheduled_transfer_runners.items():
+        background_tasks.append(PeriodicTask(f"scheduled-transfers:{shard}" if shard else "scheduled-transfers", SCHEDULED_TRANSFER_INTERVAL_SECONDS, runner.run_due))
+
+def local_naive(value: datetime) -> datetime:
+    """Timestamps are stored as naive local time"""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+@app.post("/scheduled-transfers")
+@account_route(lambda arguments: arguments['data'].from_email)
+def create_scheduled_transfer(data: ScheduledTransferRequest):
+    logger.info(f"Scheduled transfer create request: from={data.from_email}, to={data.to_email}, amount={data.amount}, frequency={data.frequency}")
+    
+    if not authenticate(data.from_email, data.password):
+        logger.warning(f"Scheduled transfer create failed - invalid credentials: email={data.from_email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if data.frequency not in scheduled_transfers.FREQUENCIES:
+        raise HTTPException(status_code=400, detail=f"Frequency must be one of: {', '.join(scheduled_transfers.FREQUENCIES)}")
+    if data.from_email == data.to_email:
+        raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
+    
+    try:
+        start_at = local_naive(data.start_at) if data.start_at else datetime.now()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(f"SELECT 1 FROM users WHERE email = {placeholder}", (data.to_email,))
+            if not cursor.fetchone() and data.to_email not in find_remote_accounts([data.to_email]):
+                logger.warning(f"Scheduled transfer recipient not found: {data.to_email}")
+                raise HTTPException(status_code=404, detail="Recipient not found")
+            cursor.execute(
+                f'''INSERT INTO scheduled_transfers (from_email, to_email, amount_cents, frequency, start_at, next_run_at)
+                    VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})
+                    RETURNING {scheduled_transfers.SCHEDULED_TRANSFER_COLUMNS}''',
+                (data.from_email, data.to_email, data.amount, data.frequency, start_at, start_at)
+            )
+            row = cursor.fetchone()
+            conn.commit()
+        
+        logger.info(f"Scheduled transfer created: id={row[0]}, from={data.from_email}, next_run_at={start_at}")
+        return scheduled_transfers.serialize(row)
+    except Exception as e:
+        logger.error(f"Scheduled transfer create error: from={data.from_email}, error={e}")
+        raise
+
+@app.post("/scheduled-transfers/list")
+@account_route(lambda arguments: arguments['data'].email)
+def list_scheduled_transfers(data: ScheduledTransfersRequest):
+    logger.info(f"Scheduled transfers list request: email={data.email}")
+    
+    if not authenticate(data.email, data.password):
+        logger.warning(f"Scheduled transfers list failed - invalid credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(
+                f'''SELECT {scheduled_transfers.SCHEDULED_TRANSFER_COLUMNS} FROM scheduled_transfers
+                    WHERE from_email = {placeholder} AND status <> 'cancelled' ORDER BY next_run_at''',
+                (data.email,)
+            )
+            rows = cursor.fetchall()
+        
+        logger.info(f"Scheduled transfers listed: email={data.email}, count={len(rows)}")
+        return [scheduled_transfers.serialize(row) for row in rows]
+    except Exception as e:
+        logger.error(f"Scheduled transfers list error: email={data.email}, error={e}")
+        raise
+
+@app.post("/scheduled-transfers/{scheduled_id}/update")
+@account_route(lambda arguments: arguments['data'].email)
+def update_scheduled_transfer(scheduled_id: int, data: ScheduledTransferUpdateRequest):
+    logger.info(f"Scheduled transfer update request: id={scheduled_id}, email={data.email}")
+    
+    if not authenticate(data.email, data.password):
+        logger.warning(f"Scheduled transfer update failed - invalid credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if data.amount is not None and data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if data.frequency is not None and data.frequency not in scheduled_transfers.FREQUENCIES:
+        raise HTTPException(status_code=400, detail=f"Frequency must be one of: {', '.join(scheduled_transfers.FREQUENCIES)}")
+    if data.status is not None and data.status not in ("active", "paused"):
+        raise HTTPException(status_code=400, detail="Status must be active or paused")
+    
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            # Lock the row so we never edit a transfer while the scheduler is executing it
+            cursor.execute(
+                f'''SELECT status, claimed_until FROM scheduled_transfers
+                    WHERE id = {placeholder} AND from_email = {placeholder} FOR UPDATE''',
+                (scheduled_id, data.email)
+            )
+            row = cursor.fetchone()
+            if not row or row[0] == "cancelled":
+                raise HTTPException(status_code=404, detail="Scheduled transfer not found")
+            status, claimed_until = row
+            if claimed_until and claimed_until > datetime.now():
+                raise HTTPException(status_code=409, detail="Scheduled transfer is executing, try again shortly")
+            if status == "review":
+                # Money may have moved for the interrupted occurrence; only an admin who checked the ledger can resolve it
+                raise HTTPException(status_code=409, detail="Scheduled transfer is under review")
+            if status == "completed" or (status == "failed" and data.status is None):
+                raise HTTPException(status_code=409, detail=f"Scheduled transfer is {status}")
+            
+            updates, params = [], []
+            if data.amount is not None:
+                updates.append(f"amount_cents = {placeholder}")
+                params.append(data.amount)
+            if data.frequency is not None:
+                updates.append(f"frequency = {placeholder}")
+                params.append(data.frequency)
+            rescheduled = data.start_at is not None or data.frequency is not None
+            if rescheduled:
+                start_at = local_naive(data.start_at) if data.start_at else datetime.now()
+                updates.extend([f"start_at = {placeholder}", f"next_run_at = {placeholder}"])
+                params.extend([start_at, start_at])
+            if data.status is not None:
+                updates.extend([f"status = {placeholder}", "last_error = NULL"])
+                params.append(data.status)
+            if updates:
+                cursor.execute(
+                    f"UPDATE scheduled_transfers SET {', '.join(updates)} WHERE id = {placeholder}",
+                    (*params, scheduled_id)
+                )
+            if rescheduled:
+                # A new schedule starts counting occurrences again
+                scheduled_transfers.restart_schedule(cursor, scheduled_id)
+            elif status == "failed":
+                scheduled_transfers.reopen_occurrence(cursor, scheduled_id)
+            cursor.execute(
+                f"SELECT {scheduled_transfers.SCHEDULED_TRANSFER_COLUMNS} FROM scheduled_transfers WHERE id = {placeholder}",
+                (scheduled_id,)
+            )
+            row = cursor.fetchone()
+            conn.commit()
+        
+        logger.info(f"Scheduled transfer updated: id={scheduled_id}, fields={[u.split(' ')[0] for u in updates]}")
+        return scheduled_transfers.serialize(row)
+    except Exception as e:
+        logger.error(f"Scheduled transfer update error: id={scheduled_id}, error={e}")
+        raise
+
+@app.post("/scheduled-transfers/{scheduled_id}/cancel")
+@account_route(lambda arguments: arguments['data'].email)
+def cancel_scheduled_transfer(scheduled_id: int, data: ScheduledTransfersRequest):
+    logger.info(f"Scheduled transfer cancel request: id={scheduled_id}, email={data.email}")
+    
+    if not authenticate(data.email, data.password):
+        logger.warning(f"Scheduled transfer cancel failed - invalid credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(
+                f'''UPDATE scheduled_transfers SET status = 'cancelled'
+                    WHERE id = {placeholder} AND from_email = {placeholder} AND status <> 'cancelled'
+                      AND (claimed_until IS NULL OR claimed_until < {placeholder})
+                    RETURNING id''',
+                (scheduled_id, data.email, datetime.now())
+            )
+            cancelled = cursor.fetchone()
+            conn.commit()
+        if not cancelled:
+            raise HTTPException(status_code=404, detail="Scheduled transfer not found or currently executing")
+        
+        logger.info(f"Scheduled transfer cancelled: id={scheduled_id}")
+        return {"message": "Scheduled transfer cancelled", "id": scheduled_id}
+    except Exception as e:
+        logger.error(f"Scheduled transfer cancel error: id={scheduled_id}, error={e}")
+        raise
+
+@app.post("/admin/scheduled-transfers/{scheduled_id}/resolve")
+@account_route(lambda arguments: arguments['data'].email)
+def resolve_scheduled_transfer(scheduled_id: int, data: ScheduledTransferResolveRequest):
+    """Take a schedule out of review after checking the ledger for its interrupted occurrence"""
+    logger.info(f"Scheduled transfer resolve request: id={scheduled_id}, admin={data.email}, paid={data.paid}")
+    
+    if not authenticate_admin(data.email, data.password):
+        logger.warning(f"Scheduled transfer resolve failed - invalid admin credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        with account_scope(data.from_email), get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM scheduled_transfers WHERE id = %s AND from_email = %s", (scheduled_id, data.from_email))
+            if not cursor.fetchone() or not scheduled_transfers.resolve_review(cursor, scheduled_id, data.paid):
+                raise HTTPException(status_code=404, detail="Scheduled transfer not found or not under review")
+            cursor.execute(f"SELECT {scheduled_transfers.SCHEDULED_TRANSFER_COLUMNS} FROM scheduled_transfers WHERE id = %s", (scheduled_id,))
+            row = cursor.fetchone()
+            conn.commit()
+        
+        logger.info(f"Scheduled transfer resolved: id={scheduled_id}, paid={data.paid}, status={row[8]}")
+        return scheduled_transfers.serialize(row)
+    except Exception as e:
+        logger.error(f"Scheduled transfer resolve error: id={scheduled_id}, error={e}")
+        raise
+
 @app.get("/balance/{username}")
+@account_route(lambda arguments: arguments['username'])
 def balance(username: str, password: str):
     logger.info(f"Balance request for username: {username}")
     
@@ -1293,42 +2492,84 @@ def balance(username: str, password: str):
     try:
         current = get_balance(username)
         logger.info(f"Balance retrieved successfully: username={username}, balance={current}")
-        return {"balance": str(current)}
+        return {"balance": format_cents(current)}
     except Exception as e:
         logger.error(f"Balance request error: username={username}, error={e}")
         raise
 
-@app.get("/transactions/{username}")
-def transactions(username: str, password: str):
-    logger.info(f"Transactions request for username: {username}")
+# Transaction list columns in SELECT order, rendered straight from cursor tuples
+TRANSACTION_COLUMNS = (
+    ("type", "text"),
+    ("amount", "cents"),
+    ("old_balance", "cents"),
+    ("new_balance", "cents"),
+    ("timestamp", "timestamp"),
+    ("description", "text"),
+    ("other_user", "text"),
+)
+
+def history_filters(type=None, start=None, end=None, min_amount=None, max_amount=None, counterparty=None, q=None):
+    """Validated filter dict for fetch_history, or None when no filter is set"""
+    if type is not None and type not in CREDIT_TYPES + DEBIT_TYPES:
+        raise HTTPException(status_code=400, detail=f"type must be one of: {', '.join(CREDIT_TYPES + DEBIT_TYPES)}")
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise HTTPException(status_code=400, detail="min_amount cannot be greater than max_amount")
+    filters = {
+        "type": type,
+        "start": local_naive(start) if start else None,
+        "end": local_naive(end) if end else None,
+        "min_amount": min_amount,
+        "max_amount": max_amount,
+        "counterparty": counterparty,
+        "q": q,
+    }
+    return filters if any(value not in (None, "") for value in filters.values()) else None
+
+def read_history_page(cursor, username, limit, before, filters=None):
+    """Fetch a history page and the headers pointing at the next one"""
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    if limit is None and history_cache and not filters:
+        return history_cache.fetch(cursor, username, transaction_archives.get(sharding.current_shard())), None
+    try:
+        rows, next_cursor = fetch_history(cursor, username, limit, before, transaction_archives.get(sharding.current_shard()), filters)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return rows, headers
+
+@app.get("/transactions/{username}", response_class=RowsJSONResponse)
+@account_route(lambda arguments: arguments['username'])
+def transactions(username: str, password: str, limit: Optional[int] = None, before: Optional[str] = None,
+                 type: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 min_amount: Optional[str] = None, max_amount: Optional[str] = None,
+                 counterparty: Optional[str] = None, q: Optional[str] = None):
+    logger.info(f"Transactions request for username: {username}, limit={limit}")
     
     if not authenticate(username, password):
         logger.warning(f"Transactions request failed - invalid credentials: username={username}")
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     try:
-        with get_db_connection() as conn:
+        min_cents = parse_cents(min_amount) if min_amount is not None else None
+        max_cents = parse_cents(max_amount) if max_amount is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = history_filters(type, start, end, min_cents, max_cents, counterparty, q)
+
+    try:
+        with get_read_connection(username) as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT type, amount, old_balance, new_balance, timestamp, description, other_user FROM transactions WHERE username = %s ORDER BY id DESC", (username,))
-            rows = cursor.fetchall()
+            rows, headers = read_history_page(cursor, username, limit, before, filters)
         
         logger.info(f"Transactions retrieved successfully: username={username}, count={len(rows)}")
-        return [
-            {
-                "type": r[0],
-                "amount": r[1],
-                "old_balance": r[2],
-                "new_balance": r[3],
-                "timestamp": r[4],
-                "description": r[5],
-                "other_user": r[6]
-            } for r in rows
-        ]
+        return RowsJSONResponse(rows, TRANSACTION_COLUMNS, headers=headers)
     except Exception as e:
         logger.error(f"Transactions request error: username={username}, error={e}")
         raise
 
 @app.post("/balance")
+@account_route(lambda arguments: arguments['data'].email)
 def balance_post(data: BalanceRequest):
     logger.info(f"Balance POST request for email: {data.email}")
     
@@ -1339,12 +2580,101 @@ def balance_post(data: BalanceRequest):
     try:
         current = get_balance_by_email(data.email)
         logger.info(f"Balance POST request successful: email={data.email}, balance={current}")
-        return {"balance": str(current)}
+        return {"balance": format_cents(current)}
     except Exception as e:
         logger.error(f"Balance POST request error: email={data.email}, error={e}")
         raise
 
-@app.post("/transactions")
+@app.post("/balance-at")
+@account_route(lambda arguments: arguments['data'].email)
+def balance_at(data: BalanceAtRequest):
+    """Balance at a point in time, from the nearest snapshot plus later deltas"""
+    logger.info(f"Balance-at request: email={data.email}, at={data.at}")
+    
+    if not authenticate(data.email, data.password):
+        logger.warning(f"Balance-at request failed - invalid credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        at = local_naive(data.at)
+        with get_read_connection(data.email) as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.email,))
+            row = cursor.fetchone()
+            if not row:
+                logger.warning(f"User not found for balance-at: email={data.email}")
+                raise HTTPException(status_code=404, detail="User not found")
+            try:
+                result = snapshots.balance_at(cursor, row[0], at, transaction_archives.get(sharding.current_shard()))
+            except ArchiveUnavailable as e:
+                raise HTTPException(status_code=409, detail=str(e))
+        
+        logger.info(f"Balance-at request successful: email={data.email}, at={at}, applied={result['applied_transactions']}")
+        return {
+            "balance": format_cents(result["balance_cents"]),
+            "at": at.isoformat(),
+            "snapshot_day": result["snapshot_day"],
+            "applied_transactions": result["applied_transactions"],
+        }
+    except Exception as e:
+        logger.error(f"Balance-at request error: email={data.email}, error={e}")
+        raise
+
+ADMIN_BALANCE_COLUMNS = (("email", "text"), ("username", "text"), ("balance", "cents"))
+
+@app.post("/admin/balances", response_class=RowsStreamingResponse)
+@account_route(lambda arguments: arguments['data'].email)
+def admin_balances(data: AdminBalancesRequest):
+    """Balances for many accounts (by email and/or username) in one indexed query, streamed.
+
+    Identifiers that match no account are listed at the end with a null balance.
+    """
+    logger.info(f"Admin balances request: admin={data.email}, emails={len(data.emails)}, usernames={len(data.usernames)}")
+    
+    if not authenticate_admin(data.email, data.password):
+        logger.warning(f"Admin balances request failed - invalid admin credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    emails, usernames = list(dict.fromkeys(data.emails)), list(dict.fromkeys(data.usernames))
+    if not 0 < len(emails) + len(usernames) <= ADMIN_BALANCES_MAX_ACCOUNTS:
+        raise HTTPException(status_code=400, detail=f"Give between 1 and {ADMIN_BALANCES_MAX_ACCOUNTS} emails or usernames")
+    
+    def batches():
+        found_emails, found_usernames = set(), set()
+        try:
+            # Accounts may be on any shard (usernames don't say which), so ask each in turn
+            for shard in database_shards():
+                with get_db_connection(shard) if shard else get_read_connection() as conn:
+                    with conn.cursor(name="admin_balances") as cursor:
+                        cursor.itersize = 1000
+                        cursor.execute(
+                            '''SELECT u.email, u.username,
+                                      (u.balance_cents + COALESCE((SELECT SUM(s.balance_cents) FROM balance_shards s WHERE s.username = u.username), 0))::BIGINT
+                               FROM users u
+                               WHERE u.email = ANY(%s) OR u.username = ANY(%s)''',
+                            (emails, usernames)
+                        )
+                        while True:
+                            rows = cursor.fetchmany(1000)
+                            if not rows:
+                                break
+                            for email, username, _ in rows:
+                                found_emails.add(email)
+                                found_usernames.add(username)
+                            yield rows
+                    conn.rollback()
+        except Exception as e:
+            logger.error(f"Admin balances stream error: admin={data.email}, error={e}")
+            raise
+        yield [(email, None, None) for email in emails if email not in found_emails] + \
+              [(None, username, None) for username in usernames if username not in found_usernames]
+        logger.info(f"Admin balances request successful: admin={data.email}, found={len(found_emails)}")
+    
+    return RowsStreamingResponse(batches(), ADMIN_BALANCE_COLUMNS)
+
+@app.post("/transactions", response_class=RowsJSONResponse)
+@account_route(lambda arguments: arguments['data'].email)
 def transactions_post(data: TransactionsRequest):
     logger.info(f"Transactions POST request for email: {data.email}")
     
@@ -1355,7 +2685,7 @@ def transactions_post(data: TransactionsRequest):
     try:
         # Get username from email for transaction lookup
         logger.info(f"Getting username for email: {data.email}")
-        with get_db_connection() as conn:
+        with get_read_connection(data.email) as conn:
             cursor = conn.cursor()
             placeholder = get_placeholder()
             cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.email,))
@@ -1366,25 +2696,80 @@ def transactions_post(data: TransactionsRequest):
             username = row[0]
             logger.info(f"Username found: {username}")
             
-            cursor.execute("SELECT type, amount, old_balance, new_balance, timestamp, description FROM transactions WHERE username = %s ORDER BY id DESC", (username,))
-            rows = cursor.fetchall()
+            filters = history_filters(data.type, data.start, data.end, data.min_amount, data.max_amount, data.counterparty, data.q)
+            rows, headers = read_history_page(cursor, username, data.limit, data.before, filters)
 
         logger.info(f"Transactions POST request successful: email={data.email}, username={username}, count={len(rows)}")
-        return [
-            {
-                "type": r[0],
-                "amount": r[1],
-                "old_balance": r[2],
-                "new_balance": r[3],
-                "timestamp": r[4],
-                "description": r[5]
-            } for r in rows
-        ]
+        return RowsJSONResponse(rows, TRANSACTION_COLUMNS[:6], headers=headers)
     except Exception as e:
         logger.error(f"Transactions POST request error: email={data.email}, error={e}")
         raise
 
+@app.post("/statements/{period}")
+@account_route(lambda arguments: arguments['data'].email)
+def statement(period: str, data: StatementRequest):
+    """Monthly statement (period is YYYY-MM) answered from daily rollups"""
+    logger.info(f"Statement request: email={data.email}, period={period}")
+    
+    try:
+        start, end = statements.parse_period(period)
+    except ValueError:
+        logger.warning(f"Statement request failed - invalid period: {period}")
+        raise HTTPException(status_code=400, detail="Period must be in YYYY-MM format")
+    
+    if not authenticate(data.email, data.password):
+        logger.warning(f"Statement request failed - invalid credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        with get_read_connection(data.email) as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.email,))
+            row = cursor.fetchone()
+            if not row:
+                logger.warning(f"User not found for statement: email={data.email}")
+                raise HTTPException(status_code=404, detail="User not found")
+            result = statements.build_statement(cursor, row[0], start, end)
+        
+        logger.info(f"Statement generated: email={data.email}, period={period}, count={result['transaction_count']}")
+        return result
+    except Exception as e:
+        logger.error(f"Statement request error: email={data.email}, period={period}, error={e}")
+        raise
+
+@app.post("/analytics")
+@account_route(lambda arguments: arguments['data'].email)
+def account_analytics(data: AnalyticsRequest):
+    """Account insights computed with vectorized NumPy operations over the ledger"""
+    logger.info(f"Analytics request: email={data.email}")
+    
+    if not authenticate(data.email, data.password):
+        logger.warning(f"Analytics request failed - invalid credentials: email={data.email}")
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    try:
+        with get_read_connection(data.email) as conn:
+            cursor = conn.cursor()
+            placeholder = get_placeholder()
+            cursor.execute(f"SELECT username FROM users WHERE email = {placeholder}", (data.email,))
+            row = cursor.fetchone()
+            if not row:
+                logger.warning(f"User not found for analytics: email={data.email}")
+                raise HTTPException(status_code=404, detail="User not found")
+            try:
+                result = compute_account_analytics(conn, row[0], archive=transaction_archives.get(sharding.current_shard()))
+            except ArchiveUnavailable as e:
+                raise HTTPException(status_code=409, detail=str(e))
+        
+        logger.info(f"Analytics request successful: email={data.email}, count={result['transaction_count']}")
+        return result
+    except Exception as e:
+        logger.error(f"Analytics request error: email={data.email}, error={e}")
+        raise
+
 @app.post("/profile")
+@account_route(lambda arguments: arguments['data'].email)
 def get_profile(data: ProfileRequest):
     logger.info(f"Profile request for email: {data.email}")
     
@@ -1410,6 +2795,7 @@ def get_profile(data: ProfileRequest):
         raise
 
 @app.post("/forgot-password")
+@account_route(lambda arguments: arguments['data'].email)
 def forgot_password(data: RecoveryPasswordRequest):
     """Forgot password endpoint - generates recovery code"""
     logger.info(f"Forgot password request for email: {data.email}")
@@ -1422,6 +2808,7 @@ def forgot_password(data: RecoveryPasswordRequest):
         raise
 
 @app.post("/generate-recovery-code")
+@account_route(lambda arguments: arguments['data'].email)
 def generate_recovery_code_endpoint(data: RecoveryPasswordRequest):
     """Generate a new recovery code for password reset"""
     # Check if user exists
@@ -1485,6 +2872,7 @@ def generate_recovery_code_endpoint(data: RecoveryPasswordRequest):
         return {"message": "Recovery code generated (email failed)", "recovery_code": recovery_code}
 
 @app.post("/reset-password")
+@account_route(lambda arguments: arguments['data'].email)
 def reset_password(data: ResetPasswordRequest):
     """Reset password using recovery code"""
     logger.info(f"Reset password request for email: {data.email}")
@@ -1529,43 +2917,120 @@ def reset_password(data: ResetPasswordRequest):
 def user_count():
     logger.info("User count requested")
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users")
-            count = cursor.fetchone()[0]
+        count = 0
+        for shard in database_shards():
+            with get_db_connection(shard) if shard else get_read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM users")
+                count += cursor.fetchone()[0]
         logger.info(f"User count retrieved successfully: {count} users")
         return {"count": count}
     except Exception as e:
         logger.error(f"Error getting user count: {e}")
         raise HTTPException(status_code=500, detail="Failed to get user count")
 
+@app.get("/livez")
+def livez():
+    """Liveness: the process is up and serving; no I/O"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness from the cached background check; never touches the database itself"""
+    if shard_map:
+        # A dead shard only fails its own accounts; the instance stays useful while any shard is up
+        shards = {}
+        for shard, checker in readiness_checkers.items():
+            shard_ready, database = checker.status()
+            circuit = shard_breakers[shard].status()
+            shards[shard] = {"ready": shard_ready and circuit["state"] != "open", "database": database, "database_circuit": circuit}
+        ready = shard_map.loaded_at is not None and any(shard["ready"] for shard in shards.values())
+        database, circuit = {"shards": shards, "shard_map_loaded_at": shard_map.loaded_at}, db_breaker.status()
+    else:
+        ready, database = readiness_checkers[None].status()
+        circuit = db_breaker.status()
+        ready = ready and circuit["state"] != "open"
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "database": database,
+        "database_circuit": circuit,
+        # No connection pool: connections are per request, bounded by admission control
+        "admission": {name: {"in_flight": controller.in_flight, "queue_depth": controller.queue_depth} for name, controller in admission_controllers.items()},
+        # Informational: lagging or unreachable replicas only send reads back to the primary
+        "replicas": replica_router.status() if replica_router else None,
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+# Outbox and saga backlogs for /metrics, one monitor per shard that has any
+backlog_monitors = {}
+for shard in database_shards():
+    backlog_queries = {}
+    if shard in outbox_relays:
+        backlog_queries["outbox"] = outbox_relays[shard].backlog
+    if transfer_sagas:
+        backlog_queries["transfer_sagas"] = transfer_sagas.metrics
+    if backlog_queries:
+        backlog_monitors[shard] = BacklogMonitor(functools.partial(get_db_connection, shard), backlog_queries)
+        background_tasks.append(PeriodicTask(f"backlog-check:{shard}" if shard else "backlog-check", METRICS_BACKLOG_INTERVAL_SECONDS, backlog_monitors[shard].check))
+
+@app.get("/metrics")
+def metrics(authorization: Optional[str] = Header(None)):
+    """Operational counters for the background writers, caches, limits and the outbox relay.
+
+    Needs `Authorization: Bearer <METRICS_TOKEN>`; served from memory, never querying the database.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics are disabled")
+    if not secrets.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        logger.warning("Metrics request rejected - bad or missing token")
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    result = {
+        "ledger_writer": {
+            "batches_flushed": sum(writer.batches_flushed for writer in ledger_writers.values()),
+            "rows_flushed": sum(writer.rows_flushed for writer in ledger_writers.values()),
+        } if ledger_writers else None,
+        "history_cache": {"hits": history_cache.hits, "misses": history_cache.misses} if history_cache else None,
+        "background_tasks": {
+            task.name: {"runs": task.runs, "last_run_at": task.last_run_at, "last_error": task.last_error}
+            for task in background_tasks
+        },
+        "velocity_rules": velocity_checker.stats() if velocity_checker else None,
+        "rate_limit_rejections": dict(rate_limiter.rejected) if rate_limiter else None,
+        "admission": {name: controller.metrics() for name, controller in admission_controllers.items()},
+        "database_circuit": db_breaker.status(),
+        "replicas": replica_router.status() if replica_router else None,
+        "shards": shard_map.status() if shard_map else None,
+        "outbox": None,
+        "transfer_sagas": None,
+    }
+    for shard, relay in outbox_relays.items():
+        relay_metrics = {**relay.metrics(), **backlog_monitors[shard].status("outbox")}
+        if shard:
+            result["outbox"] = {**(result["outbox"] or {}), shard: relay_metrics}
+        else:
+            result["outbox"] = relay_metrics
+    if shard_map:
+        result["database_circuit"] = {shard: breaker.status() for shard, breaker in shard_breakers.items()}
+        result["transfer_sagas"] = {shard: backlog_monitors[shard].status("transfer_sagas") for shard in shard_map.urls}
+    return result
+
 @app.get("/")
 def health_check():
-    """Health check endpoint for Docker"""
-    logger.info("Health check requested")
-    
-    # Check database connectivity
-    db_status = "unknown"
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            cursor.fetchone()
-            db_status = "connected"
-            logger.info("Health check: Database connection successful")
-    except Exception as e:
-        db_status = "disconnected"
-        logger.error(f"Health check: Database connection failed: {e}")
+    """Health check endpoint; the database status comes from the cached readiness checks (see /readyz)"""
+    if shard_map:
+        database = {shard: "connected" if checker.status()[0] else "disconnected" for shard, checker in readiness_checkers.items()}
+    else:
+        database = "connected" if readiness_checkers[None].status()[0] else "disconnected"
     
     return {
         "status": "healthy", 
         "message": "BlueBank API is running",
-        "database": db_status,
+        "database": database,
+        "database_circuit": db_breaker.status(),
         "timestamp": datetime.now().isoformat()
     }
 
 
-
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting BlueBank Backend Server...")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean
 from sqlalchemy.orm import relationship, declarative_base
 import datetime
 
@@ -22,7 +22,7 @@ class Account(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     account_type = Column(String, default='checking')  # checking, savings, etc.
-    balance = Column(Float, default=0.0)
+    balance_cents = Column(BigInteger, default=0)  # integer minor units
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     owner = relationship('User', back_populates='accounts')
     transactions = relationship('Transaction', back_populates='account')
@@ -32,8 +32,8 @@ class Transaction(Base):
     id = Column(Integer, primary_key=True, index=True)
     account_id = Column(Integer, ForeignKey('accounts.id'))
     type = Column(String)  # deposit, withdraw, transfer
-    amount = Column(Float)
+    amount_cents = Column(BigInteger)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     description = Column(String, default='')
-    balance_after = Column(Float)
+    balance_after_cents = Column(BigInteger)
     account = relationship('Account', back_populates='transactions') 
\ No newline at end of file
@@ -0,0 +1,56 @@
+from decimal import Decimal
+from typing import Annotated
+
+from pydantic import BeforeValidator
+
+# Largest value a PostgreSQL BIGINT cents column can hold
+MAX_CENTS = 2 ** 63 - 1
+
+
+def parse_cents(value) -> int:
+    """Parse a decimal amount such as "12.34", 12.34 or 12 into integer cents"""
+    if isinstance(value, bool):
+        raise ValueError("Invalid amount")
+    if isinstance(value, int):
+        cents = value * 100
+    else:
+        if isinstance(value, float):
+            text = repr(value)  # shortest round-trip form, e.g. 0.1 -> "0.1"
+        elif isinstance(value, Decimal):
+            text = format(value, "f")
+        elif isinstance(value, str):
+            text = value.strip()
+        else:
+            raise ValueError("Invalid amount")
+
+        negative = text.startswith("-")
+        if text[:1] in ("-", "+"):
+            text = text[1:]
+        whole, _, frac = text.partition(".")
+        if not (whole or frac) or not all(part == "" or (part.isascii() and part.isdigit()) for part in (whole, frac)):
+            raise ValueError("Invalid amount")
+        frac = frac.rstrip("0")
+        if len(frac) > 2:
+            raise ValueError("Amount cannot have more than 2 decimal places")
+        cents = int(whole or "0") * 100 + int(frac.ljust(2, "0"))
+        if negative:
+            cents = -cents
+
+    if abs(cents) > MAX_CENTS:
+        raise ValueError("Amount is too large")
+    return cents
+
+
+def format_cents(cents: int) -> str:
+    """Format integer cents as a fixed two-decimal string, e.g. 1234 -> "12.34" """
+    units, rem = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}{units}.{rem:02d}"
+
+
+def cents_to_decimal(cents: int) -> Decimal:
+    """Convert integer cents to a two-decimal Decimal"""
+    return Decimal(cents).scaleb(-2)
+
+
+# Request field type: accepts the usual decimal inputs and validates to integer cents
+MoneyAmount = Annotated[int, BeforeValidator(parse_cents)]
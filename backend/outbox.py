@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS outbox_events (
+        id BIGSERIAL PRIMARY KEY,
+        event_type VARCHAR(50) NOT NULL,
+        payload JSONB NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# One event per new ledger row, e.g. "transaction.transfer_out"
+OUTBOX_INSERT_SQL = '''
+    INSERT INTO outbox_events (event_type, payload)
+    SELECT 'transaction.' || lower(replace(type, ' ', '_')),
+           json_build_object(
+               'ledger_id', id, 'username', username, 'type', type, 'amount_cents', amount_cents,
+               'old_balance_cents', old_balance_cents, 'new_balance_cents', new_balance_cents,
+               'timestamp', timestamp, 'description', description, 'other_user', other_user
+           )
+    FROM transactions WHERE id = ANY(%s)
+    ORDER BY id
+'''
+
+# Advisory lock key held by the relay that is currently draining (one at a time keeps events in order)
+RELAY_LOCK_KEY = 4301
+
+
+def create_tables(cursor):
+    cursor.execute(OUTBOX_TABLE_SQL)
+
+
+def record_events(cursor, ids):
+    """Queue events for freshly inserted ledger rows (same transaction as the insert)"""
+    if ids:
+        cursor.execute(OUTBOX_INSERT_SQL, (list(ids),))
+
+
+class FileSink:
+    """Append events as JSON lines to a local file, fsynced before the batch counts as delivered"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def publish(self, events):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class QueueSink:
+    """Hand events to in-process consumers; a full queue fails the batch so it is retried later"""
+
+    def __init__(self, maxsize=10000, put_timeout=1.0):
+        self.queue = queue.Queue(maxsize)
+        self.put_timeout = put_timeout
+
+    def publish(self, events):
+        for event in events:
+            self.queue.put(event, timeout=self.put_timeout)
+
+
+class WebhookSink:
+    """POST each batch as a JSON array; anything but a 2xx response fails the batch"""
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def publish(self, events):
+        response = requests.post(
+            self.url,
+            data=json.dumps(events, default=str),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+
+def make_sink(spec):
+    """Sink from a spec string: "file:<path>", "queue" or "webhook:<url>" """
+    kind, _, target = spec.partition(":")
+    if kind == "file" and target:
+        return FileSink(target)
+    if kind == "queue":
+        return QueueSink(int(target) if target else 10000)
+    if kind == "webhook" and target:
+        return WebhookSink(target)
+    raise ValueError(f"Unknown outbox sink: {spec!r} (use file:<path>, queue or webhook:<url>)")
+
+
+class OutboxRelay:
+    """Drains outbox_events to a sink in batches with at-least-once delivery.
+
+    A batch is read, published, and only then deleted in the same
+    transaction, so a crash or sink failure between the two leaves the rows
+    in place to be published again; consumers dedupe on the event id. Only
+    one relay drains at a time (an advisory lock), which keeps events in
+    id order across app instances.
+    """
+
+    def __init__(self, connect, sink, batch_size=500):
+        self.connect = connect
+        self.sink = sink
+        self.batch_size = batch_size
+        self.events_published = 0
+        self.batches_published = 0
+        self.failures = 0
+        self.last_lag_seconds = None
+        self.last_published_at = None
+        self._lock = threading.Lock()
+
+    def _relay_batch(self, conn):
+        """Publish one batch; returns the number of events, or None if another relay holds the lock"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (RELAY_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return None
+        cursor.execute(
+            '''SELECT id, event_type, payload, created_at, EXTRACT(EPOCH FROM LOCALTIMESTAMP - created_at)::FLOAT
+               FROM outbox_events ORDER BY id LIMIT %s''',
+            (self.batch_size,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+        events = [
+            {"event_id": id_, "event_type": event_type, "created_at": created_at.isoformat(), **payload}
+            for id_, event_type, payload, created_at, _ in rows
+        ]
+        self.sink.publish(events)
+        cursor.execute("DELETE FROM outbox_events WHERE id = ANY(%s)", ([row[0] for row in rows],))
+        conn.commit()
+        with self._lock:
+            self.events_published += len(rows)
+            self.batches_published += 1
+            # Age of the oldest event in the batch when it went out
+            self.last_lag_seconds = max(row[4] for row in rows)
+            self.last_published_at = time.time()
+        return len(rows)
+
+    def drain(self):
+        """Publish batches until the outbox is empty; returns the number of events published"""
+        published = 0
+        with self.connect() as conn:
+            while True:
+                try:
+                    count = self._relay_batch(conn)
+                except Exception:
+                    conn.rollback()
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                if not count:
+                    break
+                published += count
+                if count < self.batch_size:
+                    break
+        if published:
+            logger.info(f"Outbox relay published events: count={published}, lag_seconds={self.last_lag_seconds:.2f}")
+        return published
+
+    def backlog(self, cursor):
+        """Size and age of the oldest pending event"""
+        cursor.execute("SELECT COUNT(*), EXTRACT(EPOCH FROM LOCALTIMESTAMP - MIN(created_at))::FLOAT FROM outbox_events")
+        pending, oldest_age = cursor.fetchone()
+        return {"pending_events": pending, "oldest_pending_age_seconds": oldest_age}
+
+    def metrics(self):
+        """Relay counters (in memory; the backlog comes from backlog())"""
+        with self._lock:
+            return {
+                "events_published": self.events_published,
+                "batches_published": self.batches_published,
+                "publish_failures": self.failures,
+                "last_publish_lag_seconds": self.last_lag_seconds,
+                "last_published_at": self.last_published_at,
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Drain the transaction outbox once")
+    parser.add_argument("sink", help="file:<path>, queue or webhook:<url>")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    OutboxRelay(get_db_connection, make_sink(args.sink), args.batch_size).drain()
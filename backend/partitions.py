@@ -0,0 +1,259 @@
+import logging
+import re
+from datetime import date
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TRANSACTIONS_SQL = '''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id BIGINT NOT NULL DEFAULT nextval('transactions_id_seq'),
+        username VARCHAR(255) NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        amount_cents BIGINT NOT NULL,
+        old_balance_cents BIGINT NOT NULL,
+        new_balance_cents BIGINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        description TEXT,
+        other_user VARCHAR(255),
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+'''
+
+PARTITION_NAME_RE = re.compile(r"^transactions_y(\d{4})m(\d{2})$")
+
+# Catch-all for rows outside every month partition, so a missed maintenance run never stops ledger writes
+DEFAULT_PARTITION = "transactions_default"
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(cursor) -> bool:
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('transactions')")
+    row = cursor.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def create_transactions_table(cursor):
+    """Create the month-partitioned transactions table on fresh databases"""
+    cursor.execute("SELECT to_regclass('transactions')")
+    if cursor.fetchone()[0] is not None:
+        return
+    cursor.execute("CREATE SEQUENCE IF NOT EXISTS transactions_id_seq AS BIGINT")
+    cursor.execute(PARTITIONED_TRANSACTIONS_SQL)
+    cursor.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+
+
+def create_indexes(cursor):
+    # Newest-first history reads per user; created on every partition
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_username_ts ON transactions (username, timestamp DESC, id DESC)")
+    # Filtered history searches (see history.filter_sql): by type, by amount range, by counterparty
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_username_type_ts ON transactions (username, type, timestamp DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_username_amount ON transactions (username, amount_cents)")
+    cursor.execute(
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_username_other_user_ts
+           ON transactions (username, other_user, timestamp DESC, id DESC) WHERE other_user IS NOT NULL'''
+    )
+    # Substring search on descriptions; pg_trgm is a contrib extension and may not be installable
+    cursor.execute("SAVEPOINT description_trgm")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_description_trgm ON transactions USING gin (description gin_trgm_ops)")
+        cursor.execute("RELEASE SAVEPOINT description_trgm")
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT description_trgm")
+        logger.warning(f"pg_trgm unavailable, description search will not be indexed: {e}")
+
+
+def list_partitions(cursor):
+    """Monthly partitions as sorted [(month_start, name)]"""
+    cursor.execute(
+        '''SELECT c.relname FROM pg_inherits i
+           JOIN pg_class c ON c.oid = i.inhrelid
+           WHERE i.inhparent = to_regclass('transactions')'''
+    )
+    months = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            months.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(months)
+
+
+def create_default_partition(cursor):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF transactions DEFAULT")
+
+
+def default_partition_months(cursor):
+    """Months with rows stranded in the default partition (normally none)"""
+    cursor.execute("SELECT to_regclass(%s)", (DEFAULT_PARTITION,))
+    if cursor.fetchone()[0] is None:
+        return []
+    cursor.execute(f"SELECT DISTINCT date_trunc('month', timestamp)::date FROM {DEFAULT_PARTITION}")
+    return sorted(month for month, in cursor.fetchall())
+
+
+def hot_months(cursor):
+    """Months whose rows are in the database: the month partitions plus any stranded in the default partition"""
+    return sorted({month for month, _ in list_partitions(cursor)} | set(default_partition_months(cursor)))
+
+
+def create_partition(cursor, month: date):
+    name, bounds = partition_name(month), (month, add_months(month, 1))
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return
+    if month not in default_partition_months(cursor):
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES FROM (%s) TO (%s)", bounds)
+        return
+    # The month was written before its partition existed: move its rows out of the default partition, then attach
+    cursor.execute(f"CREATE TABLE {name} (LIKE transactions INCLUDING DEFAULTS)")
+    cursor.execute(
+        f'''WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved''',
+        bounds
+    )
+    moved = cursor.rowcount
+    cursor.execute(f"ALTER TABLE transactions ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    logger.warning(f"Moved {moved} rows from {DEFAULT_PARTITION} into new partition {name}")
+
+
+def ensure_partitions(cursor, months_ahead=3):
+    """Create this month's partition, the next months_ahead ones and any whose rows landed in the default partition"""
+    if not is_partitioned(cursor):
+        return 0
+    create_default_partition(cursor)
+    existing = {name for _, name in list_partitions(cursor)}
+    current = month_start(date.today())
+    months = [add_months(current, offset) for offset in range(months_ahead + 1)]
+    created = 0
+    for month in sorted(set(months) | set(default_partition_months(cursor))):
+        if partition_name(month) not in existing:
+            create_partition(cursor, month)
+            created += 1
+            logger.info(f"Created transactions partition: {partition_name(month)}")
+    return created
+
+
+def maintain_partitions(connect, months_ahead=3):
+    """Background/cron entry point for ensure_partitions"""
+    with connect() as conn:
+        cursor = conn.cursor()
+        # Creating a partition locks the parent table; give up quickly rather than
+        # queueing every ledger write behind a long-running read. Partitions are
+        # made months ahead, so the next run simply retries.
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        created = ensure_partitions(cursor, months_ahead)
+        conn.commit()
+    return created
+
+
+def migrate_to_partitioned(connect, batch_size=50000, months_ahead=3):
+    """Move a plain transactions table into a month-partitioned one.
+
+    The swap itself is one short transaction: the old table is renamed to
+    transactions_legacy (its indexes and sequence kept aside) and the new
+    partitioned table takes over, so new writes go straight to partitions.
+    Old rows are then copied in id order, deleting each batch from
+    transactions_legacy in the same transaction, so the copy can be
+    interrupted and resumed. Run it in a maintenance window: history reads
+    miss rows that have not been copied yet.
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('transactions_legacy')")
+        legacy_exists = cursor.fetchone()[0] is not None
+
+        if not legacy_exists:
+            if is_partitioned(cursor):
+                logger.info("Transactions table is already partitioned")
+                return
+            logger.info("Swapping transactions table for a partitioned one...")
+            cursor.execute("LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(
+                "SELECT MIN(COALESCE(timestamp, TIMESTAMP '1970-01-01'))::date, MAX(timestamp)::date FROM transactions"
+            )
+            first_day, last_day = cursor.fetchone()
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'transactions' AND schemaname = current_schema()"
+            )
+            legacy_indexes = cursor.fetchall()
+            cursor.execute("ALTER TABLE transactions RENAME TO transactions_legacy")
+            for index_name, _ in legacy_indexes:
+                cursor.execute(f"ALTER INDEX {index_name} RENAME TO {index_name}_legacy")
+            # Keep the existing id sequence so ids stay unique across old and new rows
+            cursor.execute("ALTER SEQUENCE transactions_id_seq AS BIGINT")
+            cursor.execute(PARTITIONED_TRANSACTIONS_SQL)
+            cursor.execute("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+            cursor.execute("ALTER TABLE transactions_legacy ALTER COLUMN id DROP DEFAULT")
+
+            today = date.today()
+            month = month_start(first_day or today)
+            end = add_months(month_start(max(last_day or today, today)), months_ahead)
+            while month <= end:
+                create_partition(cursor, month)
+                month = add_months(month, 1)
+            create_default_partition(cursor)
+            create_indexes(cursor)
+            # Recreate the plain indexes the old table had (the primary key is replaced above)
+            for _, definition in legacy_indexes:
+                if definition.startswith("CREATE INDEX "):
+                    cursor.execute(definition.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1))
+            conn.commit()
+            logger.info("Partitioned transactions table is live; copying legacy rows...")
+
+        copied = 0
+        while True:
+            cursor.execute(
+                '''WITH moved AS (
+                       DELETE FROM transactions_legacy
+                       WHERE id IN (SELECT id FROM transactions_legacy ORDER BY id LIMIT %s)
+                       RETURNING id, username, type, amount_cents, old_balance_cents, new_balance_cents,
+                                 COALESCE(timestamp, TIMESTAMP '1970-01-01') AS timestamp, description, other_user
+                   )
+                   INSERT INTO transactions (id, username, type, amount_cents, old_balance_cents, new_balance_cents,
+                                             timestamp, description, other_user)
+                   SELECT * FROM moved''',
+                (batch_size,)
+            )
+            batch = cursor.rowcount
+            conn.commit()
+            if batch == 0:
+                break
+            copied += batch
+            logger.info(f"Copied {copied} legacy transaction rows into partitions")
+
+        cursor.execute("DROP TABLE transactions_legacy")
+        conn.commit()
+        logger.info(f"Transactions partition migration complete: rows={copied}")
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Manage month partitions of the transactions table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="convert a plain transactions table to a partitioned one")
+    migrate.add_argument("--batch-size", type=int, default=50000)
+    ensure = sub.add_parser("ensure", help="create missing upcoming partitions")
+    ensure.add_argument("--months-ahead", type=int, default=3)
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate_to_partitioned(get_db_connection, args.batch_size)
+    else:
+        maintain_partitions(get_db_connection, args.months_ahead)
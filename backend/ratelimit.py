@@ -0,0 +1,217 @@
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Request bodies larger than this are streamed through without looking for an account
+MAX_INSPECTED_BODY_BYTES = 65536
+
+# Body fields naming the account a request authenticates as
+ACCOUNT_FIELDS = ("email", "from_email")
+
+
+class MemoryTokenBucketStore:
+    """Token buckets in process memory, LRU-bounded by max_keys.
+
+    take() is a coroutine, like RedisTokenBucketStore's, though it never waits
+    """
+
+    def __init__(self, max_keys=200000):
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key, capacity, rate, now):
+        """Take one token; returns 0 if allowed, else seconds until a token is available"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+
+# Atomic refill-and-take for RedisTokenBucketStore; returns the seconds to wait (0 if allowed)
+TAKE_SCRIPT = '''
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+'''
+
+
+class RedisTokenBucketStore:
+    """MemoryTokenBucketStore's interface on Redis, so all app instances share the buckets.
+
+    Uses the asyncio client: the middleware runs on the event loop, where a
+    blocking round trip would stall every other request.
+    """
+
+    def __init__(self, url):
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND is a Redis URL but the redis package is not installed (pip install 'redis>=4.2')")
+        self.client = redis.asyncio.Redis.from_url(url)
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    async def take(self, key, capacity, rate, now):
+        return float(await self._take(keys=[f"ratelimit:{key}"], args=[capacity, rate, now]))
+
+
+def make_store(spec):
+    """"memory" or a redis:// URL"""
+    if spec == "memory":
+        return MemoryTokenBucketStore()
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisTokenBucketStore(spec)
+    raise ValueError(f"Unknown rate limit backend: {spec!r} (use memory or a redis:// URL)")
+
+
+class RateLimiter:
+    """Per-IP and per-account token bucket settings and rejection counters"""
+
+    def __init__(self, store, ip_capacity, ip_rate, account_capacity, account_rate):
+        self.store = store
+        self.ip_capacity = ip_capacity
+        self.ip_rate = ip_rate
+        self.account_capacity = account_capacity
+        self.account_rate = account_rate
+        self.rejected = {"ip": 0, "account": 0}
+
+    async def take_ip(self, ip, now):
+        return await self.store.take(f"ip:{ip}", self.ip_capacity, self.ip_rate, now)
+
+    async def take_account(self, account, now):
+        return await self.store.take(f"account:{account}", self.account_capacity, self.account_rate, now)
+
+
+class RateLimitMiddleware:
+    """Applies a RateLimiter in front of the password-checking routes.
+
+    Pure ASGI so a rejected request costs a dict lookup and a small JSON
+    write: the 429 goes out before routing, body validation, bcrypt or any
+    database work. The account is taken from the email/from_email field of
+    a JSON body (the first MAX_INSPECTED_BODY_BYTES are buffered and
+    replayed to the app; a longer body streams through uninspected) or, for
+    GET routes with a password query parameter, the last path segment.
+
+    The client IP is the socket peer; ip_header (e.g. X-Real-IP, set by
+    nginx) is only believed when the peer is one of trusted_proxies.
+    """
+
+    def __init__(self, app, limiter, exempt_paths=(), ip_header="x-real-ip", trusted_proxies=("127.0.0.1", "::1")):
+        self.app = app
+        self.limiter = limiter
+        self.exempt_paths = set(exempt_paths)
+        self.ip_header = ip_header.lower().encode()
+        self.trusted_proxies = set(trusted_proxies)
+
+    def _client_ip(self, scope):
+        peer = scope["client"][0] if scope.get("client") else "unknown"
+        if peer in self.trusted_proxies and self.ip_header:
+            for name, value in scope["headers"]:
+                if name == self.ip_header:
+                    return value.decode("latin-1").strip()
+        return peer
+
+    @staticmethod
+    def _account(scope, body):
+        if body:
+            if len(body) > MAX_INSPECTED_BODY_BYTES:
+                return None
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return None
+            if isinstance(data, dict):
+                for field in ACCOUNT_FIELDS:
+                    if isinstance(data.get(field), str):
+                        return data[field].strip().lower()
+            return None
+        if "password" in parse_qs(scope.get("query_string", b"").decode("latin-1")):
+            return scope["path"].rstrip("/").rsplit("/", 1)[-1].lower()
+        return None
+
+    async def _reject(self, send, kind, key, retry_after):
+        self.limiter.rejected[kind] += 1
+        logger.warning(f"Rate limited ({kind}): key={key}, retry_after={retry_after:.1f}s")
+        body = json.dumps({"detail": "Too many requests, please retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        now = time.time()
+        ip = self._client_ip(scope)
+        retry_after = await self.limiter.take_ip(ip, now)
+        if retry_after:
+            await self._reject(send, "ip", ip, retry_after)
+            return
+
+        # Buffer a small body so the account can be read from it; stop past the cap and pass the rest through
+        chunks, size = [], 0
+        more_body = scope["method"] in ("POST", "PUT", "PATCH")
+        while more_body and size <= MAX_INSPECTED_BODY_BYTES:
+            message = await receive()
+            if message["type"] != "http.request":
+                await self.app(scope, lambda: _return(message), send)
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        account = None if more_body else self._account(scope, body)
+        if account:
+            retry_after = await self.limiter.take_account(account, now)
+            if retry_after:
+                await self._reject(send, "account", account, retry_after)
+                return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": more_body}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+
+async def _return(message):
+    return message
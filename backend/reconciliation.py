@@ -0,0 +1,189 @@
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import balance_shards
+from ledger import signed_amount_sql
+
+logger = logging.getLogger(__name__)
+
+RUNS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS reconciliation_runs (
+        id BIGSERIAL PRIMARY KEY,
+        started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        accounts_checked BIGINT NOT NULL DEFAULT 0,
+        mismatches INTEGER NOT NULL DEFAULT 0,
+        repaired INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+MISMATCHES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS reconciliation_mismatches (
+        run_id BIGINT NOT NULL REFERENCES reconciliation_runs (id),
+        username VARCHAR(255) NOT NULL,
+        balance_cents BIGINT NOT NULL,
+        ledger_balance_cents BIGINT NOT NULL,
+        last_txn_id BIGINT,
+        repaired BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (run_id, username)
+    )
+'''
+
+# Accounts whose balance (main row plus shards) differs from the ledger.
+# The ledger balance is the last row's new_balance; sharded accounts and
+# accounts whose rows were all archived use the net of their daily rollups
+# instead (concurrent shard credits make per-row new_balance approximate).
+# Filtered by {where} on the users table alias u.
+MISMATCH_SQL = '''
+    WITH accounts AS (
+        SELECT u.username, u.balance_shard_count,
+               (u.balance_cents + COALESCE((SELECT SUM(s.balance_cents) FROM balance_shards s WHERE s.username = u.username), 0))::BIGINT AS balance_cents
+        FROM users u
+        WHERE {where}
+    ), checked AS (
+        SELECT a.username, a.balance_cents, l.id AS last_txn_id,
+               CASE WHEN a.balance_shard_count > 0 OR l.id IS NULL THEN COALESCE(r.net_cents, 0)
+                    ELSE l.new_balance_cents END AS ledger_balance_cents
+        FROM accounts a
+        LEFT JOIN LATERAL (
+            SELECT t.id, t.new_balance_cents FROM transactions t
+            WHERE t.username = a.username ORDER BY t.id DESC LIMIT 1
+        ) l ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT SUM({signed_total})::BIGINT AS net_cents FROM daily_account_rollups d
+            WHERE d.username = a.username
+        ) r ON a.balance_shard_count > 0 OR l.id IS NULL
+    )
+    SELECT username, balance_cents, ledger_balance_cents, last_txn_id
+    FROM checked
+    WHERE balance_cents <> ledger_balance_cents
+'''
+
+
+def create_tables(cursor):
+    cursor.execute(RUNS_TABLE_SQL)
+    cursor.execute(MISMATCHES_TABLE_SQL)
+
+
+def mismatch_sql(where):
+    return MISMATCH_SQL.format(where=where, signed_total=signed_amount_sql("d.total_cents"))
+
+
+def _check_ranges(connect, ranges):
+    """Worker: check user id ranges from the queue on one connection; returns (mismatches, accounts checked)"""
+    mismatches, checked = [], 0
+    with connect() as conn:
+        cursor = conn.cursor()
+        while True:
+            try:
+                low, high = ranges.get_nowait()
+            except queue.Empty:
+                return mismatches, checked
+            cursor.execute(mismatch_sql("u.id > %s AND u.id <= %s"), (low, high))
+            mismatches.extend(cursor.fetchall())
+            cursor.execute("SELECT COUNT(*) FROM users WHERE id > %s AND id <= %s", (low, high))
+            checked += cursor.fetchone()[0]
+            conn.rollback()
+
+
+def _repair(cursor, username):
+    """Set the balance to the ledger's under the account locks; returns True if changed"""
+    if balance_shards._lock_and_fold(cursor, username) is None:
+        return False
+    cursor.execute(mismatch_sql("u.username = %s"), (username,))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    _, balance, ledger_balance, _ = row
+    # Shards were just folded, so the whole balance sits in users.balance_cents
+    cursor.execute("UPDATE users SET balance_cents = %s WHERE username = %s", (ledger_balance, username))
+    logger.warning(f"Reconciliation repaired balance: username={username}, balance={balance}, ledger={ledger_balance}")
+    return True
+
+
+def reconcile(connect, workers=8, chunk_size=10000, repair=False, recheck_delay_seconds=2.0):
+    """Compare every account's balance with its ledger; returns the run summary.
+
+    Users are split into id ranges of chunk_size and checked concurrently,
+    one set-based query per range. Balance updates and their ledger rows are
+    committed separately, so a mismatch is only reported if it is still
+    there, unchanged, after recheck_delay_seconds.
+    """
+    started = time.monotonic()
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO reconciliation_runs DEFAULT VALUES RETURNING id")
+        run_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MIN(id), 1) - 1, COALESCE(MAX(id), 0) FROM users")
+        low, high = cursor.fetchone()
+        conn.commit()
+
+    ranges = queue.Queue()
+    for start in range(low, high, chunk_size):
+        ranges.put((start, min(start + chunk_size, high)))
+    logger.info(f"Reconciliation run {run_id} started: ranges={ranges.qsize()}, workers={workers}")
+
+    candidates, checked = [], 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reconcile") as pool:
+        for rows, count in pool.map(lambda _: _check_ranges(connect, ranges), range(workers)):
+            candidates.extend(rows)
+            checked += count
+
+    mismatches = []
+    repaired = 0
+    with connect() as conn:
+        cursor = conn.cursor()
+        if candidates:
+            time.sleep(recheck_delay_seconds)
+            cursor.execute(mismatch_sql("u.username = ANY(%s)"), ([row[0] for row in candidates],))
+            still = {row[0]: row for row in cursor.fetchall()}
+            conn.rollback()
+            mismatches = [row for row in candidates if still.get(row[0]) == row]
+
+        for username, balance, ledger_balance, last_txn_id in mismatches:
+            fixed = repair and _repair(cursor, username)
+            repaired += fixed
+            cursor.execute(
+                '''INSERT INTO reconciliation_mismatches (run_id, username, balance_cents, ledger_balance_cents, last_txn_id, repaired)
+                   VALUES (%s, %s, %s, %s, %s, %s)''',
+                (run_id, username, balance, ledger_balance, last_txn_id, fixed)
+            )
+            conn.commit()
+            logger.warning(f"Reconciliation mismatch: username={username}, balance={balance}, ledger={ledger_balance}, repaired={fixed}")
+
+        cursor.execute(
+            '''UPDATE reconciliation_runs SET finished_at = CURRENT_TIMESTAMP,
+                   accounts_checked = %s, mismatches = %s, repaired = %s
+               WHERE id = %s''',
+            (checked, len(mismatches), repaired, run_id)
+        )
+        conn.commit()
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Reconciliation run {run_id} finished: checked={checked}, mismatches={len(mismatches)}, repaired={repaired}, seconds={elapsed:.1f}")
+    return {
+        "run_id": run_id,
+        "accounts_checked": checked,
+        "mismatches": [
+            {"username": username, "balance_cents": balance, "ledger_balance_cents": ledger_balance, "last_txn_id": last_txn_id}
+            for username, balance, ledger_balance, last_txn_id in mismatches
+        ],
+        "repaired": repaired,
+        "seconds": round(elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Check every account balance against its ledger")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=10000, help="users per range query")
+    parser.add_argument("--repair", action="store_true", help="set mismatched balances to the ledger balance")
+    args = parser.parse_args()
+    summary = reconcile(get_db_connection, args.workers, args.chunk_size, args.repair)
+    print(json.dumps(summary, indent=2))
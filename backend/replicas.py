@@ -0,0 +1,192 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Replication delay in seconds, or NULL if it can't be measured. A replica that has replayed up to the
+# primary's current WAL position is current (an idle primary sends nothing, so the last replay timestamp
+# alone would look stale). Without that position, having replayed everything received only counts while
+# the WAL receiver is streaming: a disconnected replica receives nothing and would otherwise look current.
+REPLICA_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_replay_lsn() >= %(primary_lsn)s::pg_lsn THEN 0
+        WHEN %(primary_lsn)s IS NULL AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+             AND (SELECT status FROM pg_stat_wal_receiver) = 'streaming' THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END::FLOAT
+'''
+
+
+class MemoryPinStore:
+    """Read-your-writes pins in process memory, LRU-bounded by max_pins.
+
+    Only the instance that handled the write knows about it, so this is
+    for single-instance deployments; use RedisPinStore behind a load balancer.
+    """
+
+    def __init__(self, max_pins=100000):
+        self.max_pins = max_pins
+        # account -> pinned until (monotonic), oldest first
+        self._pins = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pin(self, account, seconds):
+        with self._lock:
+            self._pins.pop(account, None)
+            self._pins[account] = time.monotonic() + seconds
+            while len(self._pins) > self.max_pins:
+                self._pins.popitem(last=False)
+
+    def is_pinned(self, account):
+        now = time.monotonic()
+        with self._lock:
+            # Pins expire in insertion order, so drop the expired ones from the front
+            while self._pins:
+                until = next(iter(self._pins.values()))
+                if until > now:
+                    break
+                self._pins.popitem(last=False)
+            return account in self._pins
+
+    def count(self):
+        with self._lock:
+            return len(self._pins)
+
+
+class RedisPinStore:
+    """MemoryPinStore's interface on Redis, so a write through one app instance pins reads on all of them"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("REPLICA_PIN_BACKEND is a Redis URL but the redis package is not installed (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def pin(self, account, seconds):
+        self.client.set(f"replica-pin:{account}", 1, px=max(1, int(seconds * 1000)))
+
+    def is_pinned(self, account):
+        return bool(self.client.exists(f"replica-pin:{account}"))
+
+    def count(self):
+        # Not tracked; Redis expires the keys on its own
+        return None
+
+
+def make_pin_store(spec):
+    """"memory" or a redis:// URL"""
+    if spec == "memory":
+        return MemoryPinStore()
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisPinStore(spec)
+    raise ValueError(f"Unknown replica pin backend: {spec!r} (use memory or a redis:// URL)")
+
+
+class ReplicaRouter:
+    """Picks a read replica for read-only queries, or None to use the primary.
+
+    Replicas are used round-robin, skipping any whose last lag check
+    failed or showed more than max_lag_seconds of delay. Accounts that
+    wrote recently are pinned to the primary for pin_seconds in pin_store,
+    so a user always reads their own writes even on a lagging replica.
+    If the pin store can't be reached, reads go to the primary.
+    """
+
+    def __init__(self, urls, max_lag_seconds=2.0, pin_seconds=5.0, pin_store=None):
+        self.urls = list(urls)
+        self.max_lag_seconds = max_lag_seconds
+        self.pin_seconds = pin_seconds
+        self.pin_store = pin_store or MemoryPinStore()
+        # url -> {"lag_seconds", "healthy", "error", "checked_at"}; unchecked replicas aren't used
+        self._status = {url: {"lag_seconds": None, "healthy": False, "error": "not checked yet", "checked_at": None} for url in self.urls}
+        self._round_robin = itertools.cycle(self.urls)
+        self._lock = threading.Lock()
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def pin(self, account):
+        """Send account's reads to the primary for the next pin_seconds"""
+        try:
+            self.pin_store.pin(account, self.pin_seconds)
+        except Exception as e:
+            # The write itself succeeded; only its read-your-writes guarantee is at risk
+            logger.error(f"Replica pin failed: account={account}, error={e}")
+
+    def _is_pinned(self, account):
+        if account is None:
+            return False
+        try:
+            return self.pin_store.is_pinned(account)
+        except Exception as e:
+            logger.warning(f"Replica pin lookup failed, reading from the primary: account={account}, error={e}")
+            return True
+
+    def choose(self, account=None):
+        """A replica URL for this read, or None for the primary"""
+        pinned = self._is_pinned(account)
+        with self._lock:
+            if not pinned:
+                for _ in range(len(self.urls)):
+                    url = next(self._round_robin)
+                    if self._status[url]["healthy"]:
+                        self.replica_reads += 1
+                        return url
+            self.primary_reads += 1
+            return None
+
+    def mark_failed(self, url, error):
+        """Take a replica out of rotation until its next successful lag check"""
+        with self._lock:
+            self._status[url].update(healthy=False, error=str(error))
+
+    def check_lag(self, connect, connect_primary=None):
+        """Measure every replica's lag; connect(url) and connect_primary() are connection context managers"""
+        primary_lsn = None
+        if connect_primary:
+            # Read before the replicas, so a replica that has replayed this far is current
+            try:
+                with connect_primary() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT pg_current_wal_lsn()::TEXT")
+                    primary_lsn = cursor.fetchone()[0]
+            except Exception as e:
+                logger.warning(f"Primary WAL position unavailable for the replica lag check: {e}")
+        for url in self.urls:
+            try:
+                with connect(url) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(REPLICA_LAG_SQL, {"primary_lsn": primary_lsn})
+                    lag = cursor.fetchone()[0]
+                if lag is None:
+                    status = {"lag_seconds": None, "healthy": False, "error": "Behind the primary with no replayed transaction to measure lag from"}
+                    logger.warning(f"Replica lag unknown, reads go elsewhere: replica={redact(url)}")
+                else:
+                    status = {"lag_seconds": round(lag, 3), "healthy": lag <= self.max_lag_seconds, "error": None}
+                if lag is not None and lag > self.max_lag_seconds:
+                    logger.warning(f"Replica lagging, reads go elsewhere: replica={redact(url)}, lag_seconds={lag:.1f}")
+            except Exception as e:
+                status = {"lag_seconds": None, "healthy": False, "error": str(e)}
+                logger.warning(f"Replica lag check failed: replica={redact(url)}, error={e}")
+            status["checked_at"] = time.time()
+            with self._lock:
+                self._status[url] = status
+
+    def status(self):
+        with self._lock:
+            return {
+                "replicas": {redact(url): dict(status) for url, status in self._status.items()},
+                "replica_reads": self.replica_reads,
+                "primary_reads": self.primary_reads,
+                "pinned_accounts": self.pin_store.count(),
+            }
+
+
+def redact(url):
+    """URL without credentials, for logs and status output"""
+    scheme, sep, rest = url.partition("://")
+    return f"{scheme}{sep}{rest.rsplit('@', 1)[-1]}" if sep else url.rsplit("@", 1)[-1]
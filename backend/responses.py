@@ -0,0 +1,80 @@
+from json.encoder import encode_basestring
+
+from fastapi.responses import Response, StreamingResponse
+
+from money import format_cents
+
+
+def _encode_text(value):
+    return "null" if value is None else encode_basestring(value)
+
+
+def _encode_cents(value):
+    # Integer cents are written as a bare two-decimal JSON number, e.g. 1050 -> 10.50
+    return "null" if value is None else format_cents(value)
+
+
+def _encode_timestamp(value):
+    return "null" if value is None else f'"{value.isoformat()}"'
+
+
+def _encode_raw(value):
+    return "null" if value is None else str(value)
+
+
+COLUMN_ENCODERS = {
+    "text": _encode_text,
+    "cents": _encode_cents,
+    "timestamp": _encode_timestamp,
+    "int": _encode_raw,
+}
+
+
+def row_encoder(columns):
+    """Function rendering one row tuple as a JSON object for (key, kind) columns"""
+    prefixes = [f"{encode_basestring(key)}:" for key, _ in columns]
+    encoders = [COLUMN_ENCODERS[kind] for _, kind in columns]
+    pairs = list(zip(prefixes, encoders))
+    return lambda row: "{" + ",".join([prefix + encode(value) for (prefix, encode), value in zip(pairs, row)]) + "}"
+
+
+class RowsJSONResponse(Response):
+    """JSON array response rendered directly from cursor row tuples.
+
+    columns is a sequence of (key, kind) pairs matching the tuple layout,
+    where kind is one of COLUMN_ENCODERS. Rows are written without building
+    intermediate dicts or running jsonable_encoder over Decimal/datetime
+    values, which keeps large transaction histories cheap to serialize.
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, rows, columns, status_code=200, headers=None):
+        self.rows = rows
+        self.columns = columns
+        super().__init__(content=None, status_code=status_code, headers=headers)
+
+    def render(self, content) -> bytes:
+        encode = row_encoder(self.columns)
+        body = ",".join(encode(row) for row in self.rows)
+        return f"[{body}]".encode("utf-8")
+
+
+class RowsStreamingResponse(StreamingResponse):
+    """RowsJSONResponse for rows produced lazily, e.g. from a server-side cursor.
+
+    batches yields lists of row tuples; each batch is sent as soon as it is
+    encoded, so neither the rows nor the body are held in memory at once.
+    """
+
+    def __init__(self, batches, columns, status_code=200, headers=None):
+        super().__init__(self._chunks(batches, row_encoder(columns)), status_code=status_code, headers=headers, media_type="application/json")
+
+    @staticmethod
+    def _chunks(batches, encode):
+        separator = "["
+        for rows in batches:
+            if rows:
+                yield (separator + ",".join(encode(row) for row in rows)).encode("utf-8")
+                separator = ","
+        yield b"[]" if separator == "[" else b"]"
@@ -0,0 +1,167 @@
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+COMPLETED = "completed"
+COMPENSATED = "compensated"
+
+# On the sender's shard, written in the same transaction as the debit
+TRANSFER_SAGAS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS transfer_sagas (
+        id UUID PRIMARY KEY,
+        from_email VARCHAR(255) NOT NULL,
+        from_username VARCHAR(255) NOT NULL,
+        to_email VARCHAR(255) NOT NULL,
+        to_username VARCHAR(255) NOT NULL,
+        amount_cents BIGINT NOT NULL CHECK (amount_cents > 0),
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# On the recipient's shard, written in the same transaction as the credit: a saga is credited at most once
+SAGA_CREDITS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS saga_credits (
+        saga_id UUID PRIMARY KEY,
+        to_email VARCHAR(255) NOT NULL,
+        amount_cents BIGINT NOT NULL,
+        credited_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+SAGA_COLUMNS = ("id", "from_email", "from_username", "to_email", "to_username", "amount_cents", "status")
+
+
+class RecipientMissing(Exception):
+    """The recipient no longer exists; the transfer is refunded"""
+
+
+def create_tables(cursor):
+    cursor.execute(TRANSFER_SAGAS_TABLE_SQL)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transfer_sagas_pending ON transfer_sagas (updated_at) WHERE status = 'pending'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transfer_sagas_from_email ON transfer_sagas (from_email)")
+    cursor.execute(SAGA_CREDITS_TABLE_SQL)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_saga_credits_to_email ON saga_credits (to_email)")
+
+
+def begin(cursor, from_email, from_username, to_email, to_username, amount):
+    """Record a cross-shard transfer inside the sender's debit transaction; returns the saga id"""
+    saga_id = str(uuid.uuid4())
+    cursor.execute(
+        '''INSERT INTO transfer_sagas (id, from_email, from_username, to_email, to_username, amount_cents)
+           VALUES (%s, %s, %s, %s, %s, %s)''',
+        (saga_id, from_email, from_username, to_email, to_username, amount)
+    )
+    return saga_id
+
+
+class TransferSagas:
+    """Transfers between accounts on different database shards, as a saga of local transactions.
+
+    1. Sender's shard: debit, Transfer Out ledger row and a pending
+       transfer_sagas row, in one transaction (begin()).
+    2. Recipient's shard: a saga_credits row, the credit and the Transfer In
+       ledger row, in one transaction (credit(cursor, saga)). The
+       saga_credits key turns a repeat into a no-op, so this step is simply
+       retried until it gets through.
+    3. Sender's shard: the saga is marked completed.
+
+    If step 2 finds the recipient gone, refund(cursor, saga) compensates
+    the sender instead. Sagas left pending (recipient shard down, crash
+    between steps) are picked up again by recover(). connect(shard) opens a
+    shard; shard_for(email) finds an account's shard.
+    """
+
+    def __init__(self, connect, shard_for, credit, refund, retry_seconds=30, batch_size=100):
+        self.connect = connect
+        self.shard_for = shard_for
+        self.credit = credit
+        self.refund = refund
+        self.retry_seconds = retry_seconds
+        self.batch_size = batch_size
+
+    def settle(self, shard, saga_id):
+        """Run steps 2 and 3 for a saga recorded on shard; returns its status"""
+        with self.connect(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(SAGA_COLUMNS)} FROM transfer_sagas WHERE id = %s", (saga_id,))
+            row = cursor.fetchone()
+        if row is None:
+            raise LookupError(f"No transfer saga {saga_id} on shard {shard}")
+        saga = dict(zip(SAGA_COLUMNS, row))
+        if saga["status"] != PENDING:
+            return saga["status"]
+
+        try:
+            with self.connect(self.shard_for(saga["to_email"])) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO saga_credits (saga_id, to_email, amount_cents) VALUES (%s, %s, %s) ON CONFLICT (saga_id) DO NOTHING RETURNING saga_id",
+                    (saga_id, saga["to_email"], saga["amount_cents"])
+                )
+                if cursor.fetchone():
+                    self.credit(cursor, saga)
+                conn.commit()
+            outcome = COMPLETED
+        except RecipientMissing:
+            logger.warning(f"Transfer saga {saga_id}: recipient {saga['to_email']} is gone, refunding {saga['from_email']}")
+            outcome = COMPENSATED
+        except Exception as e:
+            logger.warning(f"Transfer saga {saga_id}: crediting {saga['to_email']} failed, will retry: {e}")
+            with self.connect(shard) as conn:
+                conn.cursor().execute(
+                    "UPDATE transfer_sagas SET attempts = attempts + 1, last_error = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (str(e), saga_id)
+                )
+                conn.commit()
+            return PENDING
+
+        with self.connect(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status FROM transfer_sagas WHERE id = %s FOR UPDATE", (saga_id,))
+            status = cursor.fetchone()[0]
+            if status != PENDING:
+                # Another settler got here first
+                conn.rollback()
+                return status
+            if outcome == COMPENSATED:
+                self.refund(cursor, saga)
+            cursor.execute(
+                "UPDATE transfer_sagas SET status = %s, attempts = attempts + 1, last_error = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (outcome, saga_id)
+            )
+            conn.commit()
+        logger.info(f"Transfer saga {saga_id} {outcome}: {saga['from_email']} -> {saga['to_email']}, amount={saga['amount_cents']}")
+        return outcome
+
+    def recover(self, shard):
+        """Retry sagas on shard left pending for more than retry_seconds; returns counts per status"""
+        with self.connect(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT id FROM transfer_sagas
+                   WHERE status = 'pending' AND updated_at < NOW() - make_interval(secs => %s)
+                   ORDER BY updated_at LIMIT %s''',
+                (self.retry_seconds, self.batch_size)
+            )
+            saga_ids = [saga_id for saga_id, in cursor.fetchall()]
+        counts = {}
+        for saga_id in saga_ids:
+            status = self.settle(shard, saga_id)
+            counts[status] = counts.get(status, 0) + 1
+        if counts:
+            logger.info(f"Transfer sagas recovered on shard {shard}: {counts}")
+        return counts
+
+    def metrics(self, cursor):
+        cursor.execute(
+            '''SELECT COUNT(*), EXTRACT(EPOCH FROM NOW() - MIN(created_at))
+               FROM transfer_sagas WHERE status = 'pending' '''
+        )
+        pending, oldest_age = cursor.fetchone()
+        return {"pending": pending, "oldest_pending_seconds": round(oldest_age, 1) if oldest_age is not None else None}
@@ -0,0 +1,303 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+
+from money import format_cents
+
+logger = logging.getLogger(__name__)
+
+# How far apart occurrences of a recurring transfer are; "once" runs a single time
+FREQUENCIES = {"once": None, "daily": "1 day", "weekly": "7 days", "monthly": "1 month"}
+
+SCHEDULED_TRANSFERS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS scheduled_transfers (
+        id BIGSERIAL PRIMARY KEY,
+        from_email VARCHAR(255) NOT NULL,
+        to_email VARCHAR(255) NOT NULL,
+        amount_cents BIGINT NOT NULL CHECK (amount_cents > 0),
+        frequency VARCHAR(10) NOT NULL,
+        start_at TIMESTAMP NOT NULL,
+        next_run_at TIMESTAMP NOT NULL,
+        run_count INTEGER NOT NULL DEFAULT 0,
+        occurrence_seq INTEGER NOT NULL DEFAULT 0,
+        status VARCHAR(20) NOT NULL DEFAULT 'active',
+        last_run_at TIMESTAMP,
+        last_error TEXT,
+        claimed_until TIMESTAMP,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# One row per occurrence (keyed by occurrence_seq, which unlike run_count never restarts); a 'started' row left behind means a runner died mid-transfer
+SCHEDULED_TRANSFER_RUNS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS scheduled_transfer_runs (
+        scheduled_id BIGINT NOT NULL REFERENCES scheduled_transfers (id),
+        occurrence INTEGER NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        error TEXT,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (scheduled_id, occurrence)
+    )
+'''
+
+SCHEDULED_TRANSFER_COLUMNS = "id, from_email, to_email, amount_cents, frequency, start_at, next_run_at, run_count, status, last_run_at, last_error"
+
+
+class InsufficientFunds(Exception):
+    """The sender could not cover the transfer; nothing was moved, retry later"""
+
+
+class TransferRejected(Exception):
+    """The transfer can never succeed as scheduled (e.g. recipient gone); nothing was moved"""
+
+
+class RetryLater(Exception):
+    """The transfer can't run right now (e.g. the account is being moved between shards); nothing was moved"""
+
+
+def create_tables(cursor):
+    cursor.execute(SCHEDULED_TRANSFERS_TABLE_SQL)
+    cursor.execute(SCHEDULED_TRANSFER_RUNS_TABLE_SQL)
+    cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = 'scheduled_transfers' AND column_name = 'occurrence_seq'")
+    if not cursor.fetchone():
+        # Older tables keyed runs by run_count, which a reschedule resets: continue after the highest settled occurrence
+        cursor.execute("ALTER TABLE scheduled_transfers ADD COLUMN occurrence_seq INTEGER")
+        cursor.execute(
+            '''UPDATE scheduled_transfers s SET occurrence_seq = GREATEST(s.run_count, (
+                   SELECT COALESCE(MAX(r.occurrence), -1) + 1 FROM scheduled_transfer_runs r
+                   WHERE r.scheduled_id = s.id AND r.status <> 'retrying'))'''
+        )
+        cursor.execute("ALTER TABLE scheduled_transfers ALTER COLUMN occurrence_seq SET DEFAULT 0, ALTER COLUMN occurrence_seq SET NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_transfers_due ON scheduled_transfers (next_run_at) WHERE status = 'active'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_transfers_from_email ON scheduled_transfers (from_email)")
+
+
+def serialize(row):
+    """API representation of a SCHEDULED_TRANSFER_COLUMNS row"""
+    id_, from_email, to_email, amount, frequency, start_at, next_run_at, run_count, status, last_run_at, last_error = row
+    return {
+        "id": id_,
+        "from_email": from_email,
+        "to_email": to_email,
+        "amount": format_cents(amount),
+        "frequency": frequency,
+        "start_at": start_at.isoformat(),
+        "next_run_at": next_run_at.isoformat(),
+        "run_count": run_count,
+        "status": status,
+        "last_run_at": last_run_at.isoformat() if last_run_at else None,
+        "last_error": last_error,
+    }
+
+
+def _next_run_sql(frequency):
+    """SQL for the next occurrence, anchored on start_at so monthly dates don't drift (31st -> 28th -> 31st)"""
+    return f"start_at + (run_count + 1) * INTERVAL '{FREQUENCIES[frequency]}'"
+
+
+def _advance_sql(frequency):
+    """SET clause that closes the current occurrence: schedule the next one, or complete a one-time transfer"""
+    if FREQUENCIES[frequency] is None:
+        return "status = 'completed', run_count = run_count + 1, occurrence_seq = occurrence_seq + 1, last_run_at = CURRENT_TIMESTAMP"
+    return f"next_run_at = {_next_run_sql(frequency)}, run_count = run_count + 1, occurrence_seq = occurrence_seq + 1, last_run_at = CURRENT_TIMESTAMP"
+
+
+def restart_schedule(cursor, id_):
+    """After start_at/frequency change: later occurrences are new ones, and a pending retry is dropped"""
+    cursor.execute(
+        '''UPDATE scheduled_transfer_runs SET status = 'superseded', updated_at = CURRENT_TIMESTAMP
+           WHERE status = 'retrying' AND scheduled_id = %s''',
+        (id_,)
+    )
+    cursor.execute("UPDATE scheduled_transfers SET run_count = 0, occurrence_seq = occurrence_seq + 1 WHERE id = %s", (id_,))
+
+
+def reopen_occurrence(cursor, id_):
+    """Let the scheduler attempt the current occurrence again (a failed schedule being re-activated)"""
+    cursor.execute(
+        '''UPDATE scheduled_transfer_runs r SET status = 'retrying', attempts = 0, updated_at = CURRENT_TIMESTAMP
+           FROM scheduled_transfers s
+           WHERE s.id = %s AND r.scheduled_id = s.id AND r.status = 'failed' AND r.occurrence = s.occurrence_seq''',
+        (id_,)
+    )
+
+
+def resolve_review(cursor, id_, paid):
+    """Settle a schedule in 'review' once the ledger has been checked; returns False if it isn't in review.
+
+    paid=True records the interrupted occurrence as executed and moves on;
+    paid=False lets the scheduler attempt it again.
+    """
+    cursor.execute("SELECT frequency FROM scheduled_transfers WHERE id = %s AND status = 'review' FOR UPDATE", (id_,))
+    row = cursor.fetchone()
+    if not row:
+        return False
+    cursor.execute(
+        '''UPDATE scheduled_transfer_runs r SET status = %s, error = NULL, updated_at = CURRENT_TIMESTAMP
+           FROM scheduled_transfers s
+           WHERE s.id = %s AND r.scheduled_id = s.id AND r.occurrence = s.occurrence_seq''',
+        ("succeeded" if paid else "retrying", id_)
+    )
+    if paid:
+        cursor.execute(
+            f"UPDATE scheduled_transfers SET {_advance_sql(row[0])}, last_error = NULL, claimed_until = NULL WHERE id = %s",
+            (id_,)
+        )
+        cursor.execute("UPDATE scheduled_transfers SET status = 'active' WHERE id = %s AND status = 'review'", (id_,))
+    else:
+        cursor.execute("UPDATE scheduled_transfers SET status = 'active', last_error = NULL, claimed_until = NULL WHERE id = %s", (id_,))
+    return True
+
+
+class ScheduledTransferRunner:
+    """Executes due scheduled transfers in batches.
+
+    A batch of due rows is claimed with FOR UPDATE SKIP LOCKED and leased
+    for lease_seconds, so several app instances can run the scheduler at
+    once without picking the same rows. Each claimed occurrence gets a
+    'started' run row before any money moves; if a runner dies mid-way the
+    schedule is put into 'review' instead of being executed again, until
+    an admin checks the ledger and calls resolve_review.
+
+    execute(from_email, to_email, amount_cents) performs the transfer with
+    the normal transfer logic and raises InsufficientFunds, RetryLater or
+    TransferRejected when nothing was moved. Transfers from the same sender
+    run one after another; different senders run on a pool of worker
+    threads, which bounds how much database capacity the scheduler takes
+    from interactive traffic on busy days.
+    """
+
+    def __init__(self, connect, execute, batch_size=200, workers=4, max_attempts=3, retry_delay_seconds=3600, lease_seconds=300):
+        self.connect = connect
+        self.execute = execute
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.lease_seconds = lease_seconds
+
+    def claim(self):
+        """Claim a batch of due transfers; returns [(id, from_email, to_email, amount, frequency, occurrence, attempt)]"""
+        now = datetime.now()
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT id, from_email, to_email, amount_cents, frequency, occurrence_seq FROM scheduled_transfers
+                   WHERE status = 'active' AND next_run_at <= %s AND (claimed_until IS NULL OR claimed_until < %s)
+                   ORDER BY next_run_at LIMIT %s
+                   FOR UPDATE SKIP LOCKED''',
+                (now, now, self.batch_size)
+            )
+            due = cursor.fetchall()
+            if not due:
+                conn.rollback()
+                return []
+
+            # Start (or restart, after a funds retry) each occurrence's run row
+            started = execute_values(
+                cursor,
+                '''INSERT INTO scheduled_transfer_runs (scheduled_id, occurrence, status) VALUES %s
+                   ON CONFLICT (scheduled_id, occurrence) DO UPDATE
+                   SET status = 'started', attempts = scheduled_transfer_runs.attempts + 1, error = NULL, updated_at = CURRENT_TIMESTAMP
+                   WHERE scheduled_transfer_runs.status = 'retrying'
+                   RETURNING scheduled_id, attempts''',
+                [(row[0], row[5], "started") for row in due],
+                fetch=True
+            )
+            attempts = dict(started)
+            interrupted = [row[0] for row in due if row[0] not in attempts]
+            if interrupted:
+                cursor.execute(
+                    '''UPDATE scheduled_transfers SET status = 'review', last_error = 'Interrupted while executing; check the ledger before resuming'
+                       WHERE id = ANY(%s)''',
+                    (interrupted,)
+                )
+                logger.error(f"Scheduled transfers interrupted mid-execution, needs review: ids={interrupted}")
+            cursor.execute(
+                "UPDATE scheduled_transfers SET claimed_until = %s WHERE id = ANY(%s)",
+                (now + timedelta(seconds=self.lease_seconds), list(attempts))
+            )
+            conn.commit()
+        return [row + (attempts[row[0]],) for row in due if row[0] in attempts]
+
+    def _finish(self, item, outcome, error=None):
+        id_, from_email, to_email, amount, frequency, occurrence, attempt = item
+        recurring = FREQUENCIES[frequency] is not None
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            if outcome == "retry" and attempt < self.max_attempts:
+                run_status = "retrying"
+                cursor.execute(
+                    '''UPDATE scheduled_transfers SET next_run_at = %s, last_error = %s, claimed_until = NULL WHERE id = %s''',
+                    (datetime.now() + timedelta(seconds=self.retry_delay_seconds * attempt), error, id_)
+                )
+            elif outcome == "succeeded" or (outcome == "retry" and recurring):
+                # Done with this occurrence (paid, or out of retries on a standing order): move to the next one
+                run_status = "succeeded" if outcome == "succeeded" else "failed"
+                cursor.execute(
+                    f"UPDATE scheduled_transfers SET {_advance_sql(frequency)}, last_error = %s, claimed_until = NULL WHERE id = %s",
+                    (error if recurring else None, id_)
+                )
+            elif outcome == "unknown":
+                # The transfer failed part-way; money may have moved, so don't retry automatically
+                run_status = "started"
+                cursor.execute(
+                    "UPDATE scheduled_transfers SET status = 'review', last_error = %s, claimed_until = NULL WHERE id = %s",
+                    (error, id_)
+                )
+            else:
+                run_status = "failed"
+                cursor.execute(
+                    "UPDATE scheduled_transfers SET status = 'failed', last_error = %s, claimed_until = NULL WHERE id = %s",
+                    (error, id_)
+                )
+            cursor.execute(
+                '''UPDATE scheduled_transfer_runs SET status = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+                   WHERE scheduled_id = %s AND occurrence = %s''',
+                (run_status, error, id_, occurrence)
+            )
+            conn.commit()
+        return run_status
+
+    def _run_sender(self, items):
+        """Run one sender's claimed transfers in order; returns their final run statuses"""
+        results = []
+        for item in items:
+            id_, from_email, to_email, amount = item[:4]
+            try:
+                self.execute(from_email, to_email, amount)
+                outcome, error = "succeeded", None
+            except InsufficientFunds:
+                outcome, error = "retry", "Insufficient funds"
+            except RetryLater as e:
+                outcome, error = "retry", str(e)
+            except TransferRejected as e:
+                outcome, error = "rejected", str(e)
+            except Exception as e:
+                outcome, error = "unknown", f"Transfer failed: {e}"
+                logger.error(f"Scheduled transfer {id_} failed part-way: {e}")
+            results.append(self._finish(item, outcome, error))
+        return results
+
+    def run_due(self):
+        """Execute due transfers batch by batch until none are left; returns counts per run status"""
+        counts = {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduled-transfers") as pool:
+            while True:
+                batch = self.claim()
+                if not batch:
+                    break
+                by_sender = {}
+                for item in batch:
+                    by_sender.setdefault(item[1], []).append(item)
+                for results in pool.map(self._run_sender, by_sender.values()):
+                    for status in results:
+                        counts[status] = counts.get(status, 0) + 1
+        if counts:
+            logger.info(f"Scheduled transfers executed: {counts}, seconds={time.monotonic() - started:.1f}")
+        return counts
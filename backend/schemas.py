@@ -24,14 +24,14 @@ class AccountCreate(AccountBase):
 
 class AccountOut(AccountBase):
     id: int
-    balance: float
+    balance_cents: int
     created_at: datetime.datetime
     class Config:
         orm_mode = True
 
 class TransactionBase(BaseModel):
     type: str
-    amount: float
+    amount_cents: int
     description: Optional[str] = ""
 
 class TransactionCreate(TransactionBase):
@@ -40,7 +40,7 @@ class TransactionCreate(TransactionBase):
 class TransactionOut(TransactionBase):
     id: int
     timestamp: datetime.datetime
-    balance_after: float
+    balance_after_cents: int
     class Config:
         orm_mode = True
 
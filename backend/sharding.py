@@ -0,0 +1,491 @@
+# Hash-sharded account storage across several PostgreSQL databases.
+#
+# (Not to be confused with balance_shards, which splits one hot account's
+# balance across rows of a single database.)
+#
+# Every account lives, with all of its rows (users, ledger, rollups,
+# snapshots, scheduled transfers, ...), on exactly one database shard.
+# Accounts hash by email into a fixed number of buckets; the directory
+# database (DATABASE_URL) maps each bucket to a named shard. Buckets, not
+# accounts, are the unit of placement, so resharding means moving buckets
+# (move_buckets) and rewriting one directory row each. Usernames, unique
+# across all shards, are claimed in the directory before an account is
+# created (claim_username).
+import contextvars
+import hashlib
+import logging
+import time
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values
+
+import partitions
+
+logger = logging.getLogger(__name__)
+
+# Shards hand out ledger, scheduled transfer and outbox event ids that are ≡ shard_index (mod ID_STRIDE),
+# so rows keep their ids when their account moves; this is also the maximum number of shards
+ID_STRIDE = 1024
+
+# Tables whose ids must be unique across shards, and the sequences feeding them
+# (outbox event ids are what consumers dedupe on)
+GLOBAL_SEQUENCES = {
+    "transactions": "transactions_id_seq",
+    "scheduled_transfers": "scheduled_transfers_id_seq",
+    "outbox_events": "outbox_events_id_seq",
+}
+
+DATABASE_SHARDS_TABLE_SQL = f'''
+    CREATE TABLE IF NOT EXISTS database_shards (
+        name VARCHAR(64) PRIMARY KEY,
+        shard_index INTEGER NOT NULL UNIQUE CHECK (shard_index >= 0 AND shard_index < {ID_STRIDE})
+    )
+'''
+
+SHARD_BUCKETS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS shard_buckets (
+        bucket INTEGER PRIMARY KEY,
+        shard VARCHAR(64) NOT NULL REFERENCES database_shards (name),
+        moving BOOLEAN NOT NULL DEFAULT FALSE,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Which account holds each username; the primary key is what keeps usernames unique across shards
+ACCOUNT_USERNAMES_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS account_usernames (
+        username VARCHAR(255) PRIMARY KEY,
+        email VARCHAR(255) NOT NULL,
+        claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Per-account tables moved with a bucket: (table, account column, which keys it holds, columns the target assigns afresh)
+ACCOUNT_TABLES = (
+    ("users", "email", "emails", ("id",)),
+    ("balance_shards", "username", "usernames", ()),
+    ("transactions", "username", "usernames", ()),
+    ("daily_account_rollups", "username", "usernames", ()),
+    ("balance_snapshots", "username", "usernames", ()),
+    ("idempotency_keys", "email", "emails", ("id",)),
+    ("recovery_codes", "email", "emails", ("id",)),
+    ("scheduled_transfers", "from_email", "emails", ()),
+    ("scheduled_transfer_runs", "scheduled_id", "scheduled_ids", ()),
+    ("transfer_sagas", "from_email", "emails", ()),
+    ("saga_credits", "to_email", "emails", ()),
+)
+
+COPY_BATCH_SIZE = 5000
+
+
+class ShardMoving(Exception):
+    """The account's bucket is being moved to another shard; retry shortly"""
+
+    def __init__(self, bucket, retry_after):
+        super().__init__(f"Bucket {bucket} is being moved between shards")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def parse_shard_urls(spec):
+    """"name=url,name=url" -> {name: url}, in the given order"""
+    urls = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, sep, url = entry.strip().partition("=")
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f"Shard entries look like name=postgresql://...: {entry.strip()!r}")
+        if name.strip() in urls:
+            raise ValueError(f"Shard {name.strip()!r} is listed twice")
+        urls[name.strip()] = url.strip()
+    return urls
+
+
+def bucket_for(email, bucket_count):
+    """Bucket of an account; md5 so SQL can compute the same value (see bucket_sql)"""
+    return int(hashlib.md5(email.lower().encode()).hexdigest()[:8], 16) % bucket_count
+
+
+def bucket_sql(column, bucket_count):
+    """SQL expression for bucket_for() of a column"""
+    # mod() rather than %, which psycopg2 would take for a placeholder
+    return f"mod(('x' || substr(md5(lower({column})), 1, 8))::bit(32)::bigint, {int(bucket_count)})"
+
+
+def next_id(after, shard_index):
+    """Smallest id above after that belongs to shard_index"""
+    candidate = after - after % ID_STRIDE + shard_index
+    return candidate if candidate > after else candidate + ID_STRIDE
+
+
+# The shard that get_db_connection() uses in this context (None: DATABASE_URL)
+_current_shard = contextvars.ContextVar("current_shard", default=None)
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextmanager
+def use_shard(name):
+    token = _current_shard.set(name)
+    try:
+        yield name
+    finally:
+        _current_shard.reset(token)
+
+
+class ShardMap:
+    """Which database shard holds each account.
+
+    urls names the configured shards. load() reads the bucket map from the
+    directory database, registering new shards (each gets a permanent
+    shard_index) and, the first time, placing every bucket on the first
+    shard, which is where a previously unsharded database's accounts
+    already are. shard_for() answers from memory; a bucket flagged as
+    moving raises ShardMoving so nobody writes to it mid-move.
+    """
+
+    def __init__(self, urls, bucket_count=1024, moving_retry_after=5):
+        if not urls:
+            raise ValueError("At least one shard is required")
+        if len(urls) > ID_STRIDE:
+            raise ValueError(f"At most {ID_STRIDE} shards are supported")
+        self.urls = dict(urls)
+        self.bucket_count = bucket_count
+        self.moving_retry_after = moving_retry_after
+        self.indexes = {}
+        # (bucket -> shard name, buckets being moved), replaced as a whole on reload
+        self._state = (None, frozenset())
+        self.loaded_at = None
+
+    def load(self, connect):
+        with connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(DATABASE_SHARDS_TABLE_SQL)
+            cursor.execute(SHARD_BUCKETS_TABLE_SQL)
+            cursor.execute(ACCOUNT_USERNAMES_TABLE_SQL)
+            # Set once a shard's pre-existing usernames have been claimed (claim_existing_usernames)
+            cursor.execute("ALTER TABLE database_shards ADD COLUMN IF NOT EXISTS usernames_claimed BOOLEAN NOT NULL DEFAULT FALSE")
+            # Instances starting together must agree on indexes and the initial placement
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('shard_directory'))")
+            cursor.execute("SELECT name, shard_index FROM database_shards")
+            indexes = dict(cursor.fetchall())
+            for name in self.urls:
+                if name not in indexes:
+                    indexes[name] = min(set(range(ID_STRIDE)) - set(indexes.values()))
+                    cursor.execute("INSERT INTO database_shards (name, shard_index) VALUES (%s, %s)", (name, indexes[name]))
+                    logger.info(f"Registered database shard: name={name}, index={indexes[name]}")
+            cursor.execute(
+                '''INSERT INTO shard_buckets (bucket, shard)
+                   SELECT bucket, %s FROM generate_series(0, %s - 1) AS bucket
+                   WHERE NOT EXISTS (SELECT 1 FROM shard_buckets)''',
+                (next(iter(self.urls)), self.bucket_count)
+            )
+            cursor.execute("SELECT bucket, shard, moving FROM shard_buckets ORDER BY bucket")
+            rows = cursor.fetchall()
+            conn.commit()
+
+        if len(rows) != self.bucket_count:
+            raise RuntimeError(f"The directory has {len(rows)} buckets but SHARD_BUCKETS is {self.bucket_count}")
+        owners = [shard for _, shard, _ in rows]
+        unknown = set(owners) - set(self.urls)
+        if unknown:
+            raise RuntimeError(f"Buckets are placed on shards missing from DATABASE_SHARD_URLS: {', '.join(sorted(unknown))}")
+        moving = frozenset(bucket for bucket, _, is_moving in rows if is_moving)
+        if moving != self._state[1]:
+            logger.info(f"Shard buckets being moved: {sorted(moving) or 'none'}")
+        self.indexes = {name: indexes[name] for name in self.urls}
+        self._state = (owners, moving)
+        self.loaded_at = time.time()
+
+    def shard_for(self, email):
+        owners, moving = self._state
+        if owners is None:
+            raise RuntimeError("Shard map has not been loaded from the directory database")
+        bucket = bucket_for(email, self.bucket_count)
+        if bucket in moving:
+            raise ShardMoving(bucket, self.moving_retry_after)
+        return owners[bucket]
+
+    def owners(self):
+        return list(self._state[0] or [])
+
+    def status(self):
+        owners, moving = self._state
+        return {
+            "bucket_count": self.bucket_count,
+            "shards": {
+                name: {"index": self.indexes.get(name), "buckets": sum(1 for owner in owners or [] if owner == name)}
+                for name in self.urls
+            },
+            "moving_buckets": sorted(moving),
+            "loaded_at": self.loaded_at,
+        }
+
+
+def align_sequences(cursor, shard_index):
+    """Make this shard's GLOBAL_SEQUENCES hand out ids ≡ shard_index (mod ID_STRIDE), above every existing id"""
+    for table, sequence in GLOBAL_SEQUENCES.items():
+        cursor.execute(
+            "SELECT increment_by, last_value FROM pg_sequences WHERE schemaname = current_schema() AND sequencename = %s",
+            (sequence,)
+        )
+        increment, last_value = cursor.fetchone()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        max_id = cursor.fetchone()[0]
+        if increment == ID_STRIDE and last_value is not None and last_value % ID_STRIDE == shard_index and last_value >= max_id:
+            continue
+        start = next_id(max(last_value or 0, max_id), shard_index)
+        cursor.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {ID_STRIDE} RESTART WITH {start}")
+        logger.info(f"Aligned {sequence} to shard index {shard_index}: next id {start}")
+
+
+def claim_username(connect, username, email):
+    """Reserve username for email in the directory; False if another account holds it.
+
+    connect() opens the directory. A claim left by a failed signup can be
+    taken again by the same email.
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''INSERT INTO account_usernames (username, email) VALUES (%s, %s)
+               ON CONFLICT (username) DO UPDATE SET claimed_at = CURRENT_TIMESTAMP
+               WHERE account_usernames.email = EXCLUDED.email
+               RETURNING username''',
+            (username, email)
+        )
+        claimed = cursor.fetchone() is not None
+        conn.commit()
+    return claimed
+
+
+def release_username(connect, username, email):
+    """Drop email's claim on username (its account was never created)"""
+    with connect() as conn:
+        conn.cursor().execute("DELETE FROM account_usernames WHERE username = %s AND email = %s", (username, email))
+        conn.commit()
+
+
+def claim_existing_usernames(connect, shard):
+    """Claim the usernames of accounts created on shard before claims existed; runs once per shard.
+
+    connect(shard=None) opens the directory (None) or a shard.
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT usernames_claimed FROM database_shards WHERE name = %s FOR UPDATE", (shard,))
+        if cursor.fetchone()[0]:
+            conn.rollback()
+            return
+        claimed = 0
+        with connect(shard) as source, source.cursor(name="claim_usernames") as users:
+            users.itersize = COPY_BATCH_SIZE
+            users.execute("SELECT username, email FROM users")
+            while True:
+                rows = users.fetchmany(COPY_BATCH_SIZE)
+                if not rows:
+                    break
+                execute_values(cursor, "INSERT INTO account_usernames (username, email) VALUES %s ON CONFLICT (username) DO NOTHING", rows, page_size=COPY_BATCH_SIZE)
+                claimed += cursor.rowcount
+        cursor.execute("UPDATE database_shards SET usernames_claimed = TRUE WHERE name = %s", (shard,))
+        conn.commit()
+    logger.info(f"Claimed existing usernames: shard={shard}, claimed={claimed}")
+
+
+def _check_movable(source, target, usernames):
+    cursor = source.cursor()
+    cursor.execute("SELECT COUNT(DISTINCT username) FROM transaction_archive_users WHERE username = ANY(%s)", (usernames,))
+    archived = cursor.fetchone()[0]
+    if archived:
+        raise RuntimeError(f"{archived} accounts in this bucket have archived ledger months; archived history can't be moved between shards")
+    # A moved account must neither be paid twice nor skipped for a month's interest
+    runs = []
+    for conn in (source, target):
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(period) FILTER (WHERE completed_at IS NOT NULL), COUNT(*) FILTER (WHERE completed_at IS NULL) FROM interest_runs")
+        runs.append(cursor.fetchone())
+    if runs[0][1] or runs[1][1] or runs[0][0] != runs[1][0]:
+        raise RuntimeError(f"Interest runs differ between the shards (last completed {runs[0][0]} vs {runs[1][0]}); move after both have finished the period")
+
+
+def _delete_accounts(cursor, keys):
+    for table, column, key, _ in reversed(ACCOUNT_TABLES):
+        cursor.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s)", (keys[key],))
+
+
+def _copy_rows(source, target_cursor, table, column, keys, skipped):
+    """Stream one table's rows for keys from source into target_cursor; returns the row count"""
+    copied = 0
+    with source.cursor(name=f"move_{table}") as cursor:
+        cursor.itersize = COPY_BATCH_SIZE
+        cursor.execute(f"SELECT * FROM {table} WHERE {column} = ANY(%s)", (keys,))
+        while True:
+            rows = cursor.fetchmany(COPY_BATCH_SIZE)
+            if not rows:
+                break
+            kept = [i for i, col in enumerate(cursor.description) if col.name not in skipped]
+            columns = ", ".join(cursor.description[i].name for i in kept)
+            execute_values(target_cursor, f"INSERT INTO {table} ({columns}) VALUES %s", [tuple(row[i] for i in kept) for row in rows], page_size=COPY_BATCH_SIZE)
+            copied += len(rows)
+    return copied
+
+
+def _move_flagged(shard_map, connect, bucket, source, target):
+    """Copy a flagged bucket's accounts to target, flip it in the directory, delete them from source"""
+    copied = flipped = False
+    try:
+        with connect(source) as source_conn, connect(target) as target_conn:
+            cursor = source_conn.cursor()
+            cursor.execute(
+                f"SELECT email, username FROM users WHERE {bucket_sql('email', shard_map.bucket_count)} = %s ORDER BY email FOR UPDATE",
+                (bucket,)
+            )
+            accounts = cursor.fetchall()
+            keys = {"emails": [email for email, _ in accounts], "usernames": [username for _, username in accounts]}
+            if accounts:
+                _check_movable(source_conn, target_conn, keys["usernames"])
+                cursor.execute("SELECT id FROM scheduled_transfers WHERE from_email = ANY(%s)", (keys["emails"],))
+                keys["scheduled_ids"] = [id_ for id_, in cursor.fetchall()]
+
+                target_cursor = target_conn.cursor()
+                # Leftovers of an earlier run of this move that failed before the directory flip
+                _delete_accounts(target_cursor, keys)
+                cursor.execute("SELECT DISTINCT date_trunc('month', timestamp)::DATE FROM transactions WHERE username = ANY(%s)", (keys["usernames"],))
+                for (month,) in cursor.fetchall():
+                    partitions.create_partition(target_cursor, month)
+                for table, column, key, skipped in ACCOUNT_TABLES:
+                    count = _copy_rows(source_conn, target_cursor, table, column, keys[key], skipped)
+                    logger.info(f"Bucket {bucket}: copied {count} {table} rows")
+                # New ledger rows on the target must sort after the moved ones
+                align_sequences(target_cursor, shard_map.indexes[target])
+                target_conn.commit()
+            copied = True
+
+            with connect() as conn:
+                conn.cursor().execute(
+                    "UPDATE shard_buckets SET shard = %s, moving = FALSE, updated_at = CURRENT_TIMESTAMP WHERE bucket = %s",
+                    (target, bucket)
+                )
+                conn.commit()
+            flipped = True
+            if accounts:
+                _delete_accounts(cursor, keys)
+            source_conn.commit()
+    except Exception:
+        if flipped:
+            logger.error(f"Bucket {bucket} now lives on {target} but its rows could not be deleted from {source}; delete them by hand")
+        elif copied:
+            logger.error(f"Bucket {bucket} was copied to {target} but the directory was not updated; run the move again")
+        raise
+    logger.info(f"Moved bucket {bucket}: {source} -> {target}, accounts={len(accounts)}")
+    return len(accounts)
+
+
+def move_buckets(shard_map, connect, moves, grace_seconds=30.0):
+    """Move buckets to other shards; moves is [(bucket, target)]. Returns the number of accounts moved.
+
+    connect(shard=None) opens the directory (None) or a shard. The buckets
+    are flagged as moving and the tool waits grace_seconds, longer than app
+    instances take to reload the map and finish requests already routed,
+    so nothing writes to those accounts any more. Then, bucket by bucket,
+    the users rows are locked on the source, every per-account table is
+    copied to the target in one transaction, the directory flips the bucket
+    to the target and the source rows are deleted. A bucket whose move
+    fails after the copy stays flagged; moving it again finishes the job.
+    """
+    for _, target in moves:
+        if target not in shard_map.urls:
+            raise ValueError(f"Unknown shard: {target}")
+    pending = []
+    with connect() as conn:
+        cursor = conn.cursor()
+        for bucket, target in moves:
+            cursor.execute("SELECT shard FROM shard_buckets WHERE bucket = %s FOR UPDATE", (bucket,))
+            row = cursor.fetchone()
+            if row is None:
+                raise ValueError(f"No such bucket: {bucket}")
+            # Re-flagging clears a flag left behind on a bucket that is already where it should be
+            cursor.execute("UPDATE shard_buckets SET moving = %s, updated_at = CURRENT_TIMESTAMP WHERE bucket = %s", (row[0] != target, bucket))
+            if row[0] != target:
+                pending.append((bucket, row[0], target))
+        conn.commit()
+    if not pending:
+        return 0
+    logger.info(f"Moving {len(pending)} buckets, waiting {grace_seconds}s for app instances to stop using them")
+    time.sleep(grace_seconds)
+
+    moved = 0
+    for i, (bucket, source, target) in enumerate(pending):
+        try:
+            moved += _move_flagged(shard_map, connect, bucket, source, target)
+        except Exception:
+            # Buckets not started yet go back into service where they are
+            with connect() as conn:
+                conn.cursor().execute(
+                    "UPDATE shard_buckets SET moving = FALSE, updated_at = CURRENT_TIMESTAMP WHERE bucket = ANY(%s)",
+                    ([b for b, _, _ in pending[i + 1:]],)
+                )
+                conn.commit()
+            raise
+    return moved
+
+
+def plan_rebalance(owners, shards):
+    """Moves [(bucket, source, target)] that spread the buckets evenly over shards (others are drained)"""
+    quota = {shard: len(owners) // len(shards) + (1 if i < len(owners) % len(shards) else 0) for i, shard in enumerate(shards)}
+    held = {shard: [] for shard in shards}
+    for bucket, shard in enumerate(owners):
+        held.setdefault(shard, []).append(bucket)
+    spare = []
+    for shard, buckets in held.items():
+        extra = len(buckets) - quota.get(shard, 0)
+        if extra > 0:
+            spare.extend((bucket, shard) for bucket in buckets[-extra:])
+    moves = []
+    for shard in shards:
+        for _ in range(quota[shard] - len(held[shard])):
+            bucket, source = spare.pop()
+            moves.append((bucket, source, shard))
+    return sorted(moves)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+    from main import get_db_connection, shard_map
+
+    parser = argparse.ArgumentParser(description="Inspect and reshard the database shard map")
+    parser.add_argument("--grace-seconds", type=float, default=30.0, help="wait after flagging a bucket, before copying it")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="buckets per shard")
+    move = commands.add_parser("move", help="move one bucket to a shard")
+    move.add_argument("bucket", type=int)
+    move.add_argument("target")
+    rebalance = commands.add_parser("rebalance", help="spread buckets evenly over the configured shards")
+    rebalance.add_argument("--drain", action="append", default=[], help="move every bucket off this shard (repeatable)")
+    rebalance.add_argument("--group-size", type=int, default=16, help="buckets flagged and moved per grace wait")
+    rebalance.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if shard_map is None:
+        sys.exit("DATABASE_SHARD_URLS is not set")
+    shard_map.load(get_db_connection)
+    if args.command == "status":
+        print(json.dumps(shard_map.status(), indent=2))
+    elif args.command == "move":
+        print(f"Moved {move_buckets(shard_map, get_db_connection, [(args.bucket, args.target)], args.grace_seconds)} accounts")
+    else:
+        moves = plan_rebalance(shard_map.owners(), [name for name in shard_map.urls if name not in args.drain])
+        print(f"{len(moves)} bucket moves planned")
+        for bucket, source, target in moves:
+            print(f"bucket {bucket}: {source} -> {target}")
+        if not args.dry_run:
+            # A group's accounts are unavailable from its grace wait until their own bucket has moved
+            for i in range(0, len(moves), args.group_size):
+                group = moves[i:i + args.group_size]
+                moved = move_buckets(shard_map, get_db_connection, [(bucket, target) for bucket, _, target in group], args.grace_seconds)
+                print(f"Moved buckets {group[0][0]}..{group[-1][0]}: {moved} accounts")
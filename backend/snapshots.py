@@ -0,0 +1,124 @@
+import logging
+from datetime import date, datetime, time, timedelta
+
+from history import archived_rows
+from ledger import CREDIT_TYPES, SIGNED_AMOUNT_SQL
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        username VARCHAR(255) NOT NULL,
+        day DATE NOT NULL,
+        balance_cents BIGINT NOT NULL,
+        last_txn_id BIGINT NOT NULL,
+        PRIMARY KEY (username, day)
+    )
+'''
+
+SNAPSHOT_RUNS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS balance_snapshot_runs (
+        day DATE PRIMARY KEY,
+        accounts INTEGER NOT NULL,
+        completed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def create_tables(cursor):
+    cursor.execute(SNAPSHOTS_TABLE_SQL)
+    cursor.execute(SNAPSHOT_RUNS_TABLE_SQL)
+    # Delta scans after a snapshot and per-day snapshot scans
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_username_id ON transactions (username, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)")
+
+
+def snapshot_day(cursor, day):
+    """Record the closing balance of every account that had activity on day"""
+    start = datetime.combine(day, time.min)
+    cursor.execute(
+        '''INSERT INTO balance_snapshots (username, day, balance_cents, last_txn_id)
+           SELECT DISTINCT ON (username) username, %s, new_balance_cents, id
+           FROM transactions
+           WHERE timestamp >= %s AND timestamp < %s
+           ORDER BY username, id DESC
+           ON CONFLICT (username, day) DO UPDATE
+           SET balance_cents = EXCLUDED.balance_cents, last_txn_id = EXCLUDED.last_txn_id''',
+        (day, start, start + timedelta(days=1))
+    )
+    accounts = cursor.rowcount
+    cursor.execute(
+        '''INSERT INTO balance_snapshot_runs (day, accounts) VALUES (%s, %s)
+           ON CONFLICT (day) DO UPDATE SET accounts = EXCLUDED.accounts, completed_at = CURRENT_TIMESTAMP''',
+        (day, accounts)
+    )
+    return accounts
+
+
+def run_snapshots(connect, until=None):
+    """Snapshot every completed day not yet covered, oldest first (one transaction per day)"""
+    until = until or date.today() - timedelta(days=1)
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(day) FROM balance_snapshot_runs")
+        last_day = cursor.fetchone()[0]
+        if last_day is None:
+            cursor.execute("SELECT MIN(timestamp)::date FROM transactions")
+            day = cursor.fetchone()[0]
+        else:
+            day = last_day + timedelta(days=1)
+        conn.rollback()
+
+        while day is not None and day <= until:
+            accounts = snapshot_day(cursor, day)
+            conn.commit()
+            logger.info(f"Balance snapshot taken: day={day}, accounts={accounts}")
+            day += timedelta(days=1)
+
+
+def balance_at(cursor, username, at, archive=None):
+    """Balance at a point in time: nearest earlier snapshot plus the deltas after it.
+
+    Deltas in months moved to cold storage are read from archive; without
+    one, history.ArchiveUnavailable is raised rather than a wrong balance.
+    """
+    cursor.execute(
+        '''SELECT day, balance_cents, last_txn_id FROM balance_snapshots
+           WHERE username = %s AND day < %s
+           ORDER BY day DESC LIMIT 1''',
+        (username, at.date())
+    )
+    snapshot = cursor.fetchone()
+    if snapshot:
+        snapshot_day_, balance, last_txn_id = snapshot
+        since = datetime.combine(snapshot_day_, time.min)
+    else:
+        snapshot_day_, balance, last_txn_id, since = None, 0, 0, datetime.min
+
+    # With daily snapshots this only touches rows from the day containing `at`
+    cursor.execute(
+        f'''SELECT COALESCE(SUM({SIGNED_AMOUNT_SQL}), 0)::BIGINT, COUNT(*)
+            FROM transactions
+            WHERE username = %s AND id > %s AND timestamp >= %s AND timestamp <= %s''',
+        (username, last_txn_id, since, at)
+    )
+    delta, applied = cursor.fetchone()
+    for type_, amount, _, _, _, _, _, id_ in archived_rows(cursor, archive, username, since, at):
+        if id_ > last_txn_id:
+            delta += amount if type_ in CREDIT_TYPES else -amount
+            applied += 1
+    return {
+        "balance_cents": balance + delta,
+        "snapshot_day": snapshot_day_.isoformat() if snapshot_day_ else None,
+        "applied_transactions": applied,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Take daily balance snapshots for all days not yet covered")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="last day to snapshot (default: yesterday)")
+    args = parser.parse_args()
+    run_snapshots(get_db_connection, args.until)
@@ -0,0 +1,149 @@
+import logging
+from datetime import date
+
+from ledger import CREDIT_TYPES, DEBIT_TYPES
+from money import format_cents
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS daily_account_rollups (
+        username VARCHAR(255) NOT NULL,
+        day DATE NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        total_cents BIGINT NOT NULL DEFAULT 0,
+        txn_count INTEGER NOT NULL DEFAULT 0,
+        first_txn_id BIGINT NOT NULL,
+        opening_balance_cents BIGINT NOT NULL,
+        last_txn_id BIGINT NOT NULL,
+        closing_balance_cents BIGINT NOT NULL,
+        PRIMARY KEY (username, day, type)
+    )
+'''
+
+# Aggregates ledger rows matching {where} and adds them to the rollups
+ROLLUP_UPSERT_SQL = '''
+    INSERT INTO daily_account_rollups (username, day, type, total_cents, txn_count,
+                                       first_txn_id, opening_balance_cents, last_txn_id, closing_balance_cents)
+    SELECT username, timestamp::date, type, SUM(amount_cents), COUNT(*),
+           MIN(id), (ARRAY_AGG(old_balance_cents ORDER BY id))[1],
+           MAX(id), (ARRAY_AGG(new_balance_cents ORDER BY id DESC))[1]
+    FROM transactions
+    WHERE {where}
+    GROUP BY username, timestamp::date, type
+    ORDER BY username, timestamp::date, type
+    ON CONFLICT (username, day, type) DO UPDATE SET
+        total_cents = daily_account_rollups.total_cents + EXCLUDED.total_cents,
+        txn_count = daily_account_rollups.txn_count + EXCLUDED.txn_count,
+        opening_balance_cents = CASE WHEN EXCLUDED.first_txn_id < daily_account_rollups.first_txn_id
+                                     THEN EXCLUDED.opening_balance_cents ELSE daily_account_rollups.opening_balance_cents END,
+        first_txn_id = LEAST(daily_account_rollups.first_txn_id, EXCLUDED.first_txn_id),
+        closing_balance_cents = CASE WHEN EXCLUDED.last_txn_id > daily_account_rollups.last_txn_id
+                                     THEN EXCLUDED.closing_balance_cents ELSE daily_account_rollups.closing_balance_cents END,
+        last_txn_id = GREATEST(daily_account_rollups.last_txn_id, EXCLUDED.last_txn_id)
+'''
+
+
+def create_tables(cursor):
+    cursor.execute(ROLLUPS_TABLE_SQL)
+
+
+def apply_rollups(cursor, ids):
+    """Add freshly inserted ledger rows to the daily rollups (same transaction as the insert)"""
+    if ids:
+        cursor.execute(ROLLUP_UPSERT_SQL.format(where="id = ANY(%s)"), (list(ids),))
+
+
+def backfill_rollups(connect, chunk_size=50000):
+    """Rebuild the rollups from the full ledger in id-range chunks, in one transaction.
+
+    The EXCLUSIVE lock is held until the rebuild commits, so ledger writes
+    wait rather than roll themselves up in between. Otherwise a
+    writer whose ledger id is already below the cut-over could add its
+    rows live, and then a chunk would count them a second time. Run it
+    when a pause in money movement is acceptable.
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute("LOCK TABLE daily_account_rollups IN EXCLUSIVE MODE")
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM transactions")
+        max_id = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM daily_account_rollups")
+        logger.info(f"Rollup backfill started: max_id={max_id}, chunk_size={chunk_size}")
+
+        # Ledger rows still uncommitted are invisible here and roll themselves up once we commit
+        start = 0
+        while start < max_id:
+            end = min(start + chunk_size, max_id)
+            cursor.execute(ROLLUP_UPSERT_SQL.format(where="id > %s AND id <= %s"), (start, end))
+            logger.info(f"Rollup backfill progress: {end}/{max_id}")
+            start = end
+        conn.commit()
+    logger.info("Rollup backfill complete")
+
+
+def parse_period(period: str):
+    """Parse a YYYY-MM period into [start, end) dates"""
+    year, month = (int(part) for part in period.split("-"))
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def build_statement(cursor, username, start, end):
+    """Monthly statement from rollups: O(days * types) rows instead of O(transactions)"""
+    cursor.execute(
+        '''SELECT type, SUM(total_cents)::BIGINT, SUM(txn_count)::BIGINT
+           FROM daily_account_rollups
+           WHERE username = %s AND day >= %s AND day < %s
+           GROUP BY type ORDER BY type''',
+        (username, start, end)
+    )
+    totals = cursor.fetchall()
+
+    cursor.execute(
+        '''SELECT opening_balance_cents FROM daily_account_rollups
+           WHERE username = %s AND day >= %s AND day < %s
+           ORDER BY first_txn_id LIMIT 1''',
+        (username, start, end)
+    )
+    opening = cursor.fetchone()
+    cursor.execute(
+        '''SELECT closing_balance_cents FROM daily_account_rollups
+           WHERE username = %s
+             AND day = (SELECT MAX(day) FROM daily_account_rollups WHERE username = %s AND day < %s)
+           ORDER BY last_txn_id DESC LIMIT 1''',
+        (username, username, end)
+    )
+    closing = cursor.fetchone()
+    closing_balance = closing[0] if closing else 0
+    if opening:
+        opening_balance = opening[0]
+    else:
+        # No activity in the period: the balance carried over unchanged
+        opening_balance = closing_balance
+
+    credits = sum(total for type_, total, _ in totals if type_ in CREDIT_TYPES)
+    debits = sum(total for type_, total, _ in totals if type_ in DEBIT_TYPES)
+    return {
+        "period": start.strftime("%Y-%m"),
+        "opening_balance": format_cents(opening_balance),
+        "closing_balance": format_cents(closing_balance),
+        "total_credits": format_cents(credits),
+        "total_debits": format_cents(debits),
+        "transaction_count": sum(count for _, _, count in totals),
+        "totals_by_type": {
+            type_: {"amount": format_cents(total), "count": count}
+            for type_, total, count in totals
+        },
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import get_db_connection
+
+    parser = argparse.ArgumentParser(description="Rebuild daily_account_rollups from the transactions ledger")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+    backfill_rollups(get_db_connection, args.chunk_size)
@@ -0,0 +1,42 @@
+# Run from backend/: python -m pytest tests
+# Tests that need PostgreSQL use TEST_DATABASE_URL (a scratch database; each test works in its own schemas)
+# and are skipped when it is not set.
+import os
+import sys
+import uuid
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+
+@pytest.fixture
+def schemas():
+    """connect(name) opens the scratch database with name as its only schema; schemas are dropped afterwards"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    prefix = f"test_{uuid.uuid4().hex[:8]}"
+    created = []
+
+    def connect(name):
+        schema = f"{prefix}_{name}"
+        if schema not in created:
+            _execute(f"CREATE SCHEMA {schema}")
+            created.append(schema)
+        return psycopg2.connect(TEST_DATABASE_URL, options=f"-c search_path={schema}")
+
+    yield connect
+    for schema in created:
+        _execute(f"DROP SCHEMA {schema} CASCADE")
+
+
+def _execute(sql):
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with conn:
+            conn.cursor().execute(sql)
+    finally:
+        conn.close()
@@ -0,0 +1,82 @@
+from datetime import date, datetime
+
+import pytest
+
+import archive
+import partitions
+import snapshots
+from analytics import compute_account_analytics
+from history import ArchiveUnavailable
+
+# alice's ledger: January 2024 gets archived, March 2024 stays in its partition
+LEDGER = [
+    ("Deposit", 10000, 0, 10000, datetime(2024, 1, 5, 9)),
+    ("Withdraw", 2500, 10000, 7500, datetime(2024, 1, 20, 9)),
+    ("Deposit", 1000, 7500, 8500, datetime(2024, 3, 2, 9)),
+]
+
+
+@pytest.fixture
+def ledger(schemas, tmp_path):
+    conn = schemas("ledger")
+    cursor = conn.cursor()
+    partitions.create_transactions_table(cursor)
+    for month in (date(2024, 1, 1), date(2024, 3, 1)):
+        partitions.create_partition(cursor, month)
+    archive.create_tables(cursor)
+    snapshots.create_tables(cursor)
+    for type_, amount, old_balance, new_balance, timestamp in LEDGER:
+        cursor.execute(
+            '''INSERT INTO transactions (username, type, amount_cents, old_balance_cents, new_balance_cents, timestamp)
+               VALUES ('alice', %s, %s, %s, %s, %s)''',
+            (type_, amount, old_balance, new_balance, timestamp)
+        )
+    conn.commit()
+    transaction_archive = archive.TransactionArchive(str(tmp_path / "archive"))
+    transaction_archive.archive_month(conn, date(2024, 1, 1))
+    yield conn, transaction_archive
+    conn.close()
+
+
+def test_balance_at_reads_archived_months(ledger):
+    conn, transaction_archive = ledger
+    cursor = conn.cursor()
+    assert snapshots.balance_at(cursor, "alice", datetime(2024, 1, 10), transaction_archive)["balance_cents"] == 10000
+    assert snapshots.balance_at(cursor, "alice", datetime(2024, 2, 1), transaction_archive)["balance_cents"] == 7500
+    result = snapshots.balance_at(cursor, "alice", datetime(2024, 3, 31), transaction_archive)
+    assert (result["balance_cents"], result["applied_transactions"]) == (8500, 3)
+
+
+def _archived_ids(cursor):
+    cursor.execute("SELECT min_id, max_id FROM transaction_archives")
+    return cursor.fetchone()
+
+
+def test_balance_at_applies_archived_deltas_after_the_snapshot(ledger):
+    conn, transaction_archive = ledger
+    cursor = conn.cursor()
+    # The snapshot already counts the first deposit
+    cursor.execute("INSERT INTO balance_snapshots VALUES ('alice', '2024-01-05', 10000, %s)", (_archived_ids(cursor)[0],))
+    result = snapshots.balance_at(cursor, "alice", datetime(2024, 2, 1), transaction_archive)
+    assert (result["balance_cents"], result["snapshot_day"], result["applied_transactions"]) == (7500, "2024-01-05", 1)
+
+
+def test_archived_months_without_archive_are_rejected(ledger):
+    conn, _ = ledger
+    cursor = conn.cursor()
+    with pytest.raises(ArchiveUnavailable, match="2024-01"):
+        snapshots.balance_at(cursor, "alice", datetime(2024, 2, 1))
+    with pytest.raises(ArchiveUnavailable, match="2024-01"):
+        compute_account_analytics(conn, "alice")
+    conn.rollback()
+    # A snapshot after the archived month means it is not needed
+    cursor.execute("INSERT INTO balance_snapshots VALUES ('alice', '2024-02-15', 7500, %s)", (_archived_ids(cursor)[1],))
+    result = snapshots.balance_at(cursor, "alice", datetime(2024, 3, 31))
+    assert (result["balance_cents"], result["applied_transactions"]) == (8500, 1)
+
+
+def test_analytics_include_archived_months(ledger):
+    conn, transaction_archive = ledger
+    result = compute_account_analytics(conn, "alice", chunk_size=2, archive=transaction_archive)
+    assert result["transaction_count"] == 3
+    assert [day["closing_balance"] for day in result["daily"]] == ["100.00", "75.00", "85.00"]
@@ -0,0 +1,62 @@
+import importlib
+
+import pytest
+
+# users and transactions as created before money moved to integer cents
+LEGACY_SCHEMA_SQL = '''
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(255) UNIQUE NOT NULL,
+        email VARCHAR(255) UNIQUE NOT NULL,
+        display_name VARCHAR(255),
+        password VARCHAR(255) NOT NULL,
+        balance DECIMAL(10,2) DEFAULT 0.00,
+        dob_month VARCHAR(10),
+        dob_day VARCHAR(10),
+        dob_year VARCHAR(10),
+        phone VARCHAR(20)
+    );
+    CREATE TABLE transactions (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(255) NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        amount DECIMAL(10,2) NOT NULL,
+        old_balance DECIMAL(10,2) NOT NULL,
+        new_balance DECIMAL(10,2) NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        description TEXT,
+        other_user VARCHAR(255)
+    );
+    INSERT INTO users (username, email, password, balance) VALUES ('alice', 'alice@example.com', 'x', 12.34);
+    INSERT INTO transactions (username, type, amount, old_balance, new_balance)
+    VALUES ('alice', 'Deposit', 12.34, 0.00, 12.34);
+'''
+
+
+@pytest.fixture
+def main(schemas, tmp_path, monkeypatch):
+    # main logs to app.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("main")
+    monkeypatch.setattr(module, "get_db_connection", lambda shard=None: schemas("legacy"))
+    return module
+
+
+def test_create_db_migrates_pre_cents_schema(main, schemas):
+    with schemas("legacy") as conn:
+        conn.cursor().execute(LEGACY_SCHEMA_SQL)
+    conn.close()
+
+    main.create_db()
+    # A second start finds nothing left to migrate
+    main.create_db()
+
+    with schemas("legacy") as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT balance_cents FROM users WHERE username = 'alice'")
+        assert cursor.fetchone()[0] == 1234
+        cursor.execute("SELECT amount_cents, old_balance_cents, new_balance_cents FROM transactions WHERE username = 'alice'")
+        assert cursor.fetchone() == (1234, 0, 1234)
+        cursor.execute("SELECT to_regclass('idx_transactions_username_amount')")
+        assert cursor.fetchone()[0] is not None
+    conn.close()
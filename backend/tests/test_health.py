@@ -0,0 +1,30 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # main logs to app.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("main")
+
+    def no_connections(shard=None):
+        raise AssertionError("health probes must not open database connections")
+
+    monkeypatch.setattr(module, "get_db_connection", no_connections)
+    return module
+
+
+def test_root_health_check_reads_cached_readiness(main, monkeypatch):
+    checker = main.readiness_checkers[None]
+    monkeypatch.setattr(checker, "status", lambda: (True, {"ok": True}))
+    assert main.health_check()["database"] == "connected"
+    monkeypatch.setattr(checker, "status", lambda: (False, {"ok": False, "error": "down"}))
+    body = main.health_check()
+    assert body["status"] == "healthy"
+    assert body["database"] == "disconnected"
+
+
+def test_livez_does_no_io(main):
+    assert main.livez() == {"status": "alive"}
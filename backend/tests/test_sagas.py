@@ -0,0 +1,135 @@
+import pytest
+
+import sagas
+from sagas import COMPENSATED, COMPLETED, PENDING, RecipientMissing, TransferSagas
+
+
+class Bank:
+    """Two shards with a bare accounts table, and the credit/refund callbacks main.py would pass"""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.homes = {"alice@example.com": "a", "bob@example.com": "b"}
+        self.fail_credits = 0
+        for shard in ("a", "b"):
+            with connect(shard) as conn:
+                cursor = conn.cursor()
+                cursor.execute("CREATE TABLE accounts (email VARCHAR(255) PRIMARY KEY, balance_cents BIGINT NOT NULL)")
+                sagas.create_tables(cursor)
+            conn.close()
+        self.set_balance("alice@example.com", 10000)
+        self.set_balance("bob@example.com", 0)
+        self.sagas = TransferSagas(self.connect, self.homes.get, self.credit, self.refund, retry_seconds=0)
+
+    def set_balance(self, email, cents):
+        with self.connect(self.homes[email]) as conn:
+            conn.cursor().execute(
+                "INSERT INTO accounts VALUES (%s, %s) ON CONFLICT (email) DO UPDATE SET balance_cents = EXCLUDED.balance_cents",
+                (email, cents)
+            )
+        conn.close()
+
+    def balance(self, email):
+        with self.connect(self.homes[email]) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT balance_cents FROM accounts WHERE email = %s", (email,))
+            row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def credit(self, cursor, saga):
+        if self.fail_credits:
+            self.fail_credits -= 1
+            raise RuntimeError("recipient shard unavailable")
+        cursor.execute("UPDATE accounts SET balance_cents = balance_cents + %s WHERE email = %s", (saga["amount_cents"], saga["to_email"]))
+        if cursor.rowcount == 0:
+            raise RecipientMissing(saga["to_email"])
+
+    def refund(self, cursor, saga):
+        cursor.execute("UPDATE accounts SET balance_cents = balance_cents + %s WHERE email = %s", (saga["amount_cents"], saga["from_email"]))
+
+    def begin(self, amount):
+        """Step 1: debit alice and record the saga on her shard"""
+        with self.connect("a") as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE accounts SET balance_cents = balance_cents - %s WHERE email = 'alice@example.com'", (amount,))
+            saga_id = sagas.begin(cursor, "alice@example.com", "alice", "bob@example.com", "bob", amount)
+        conn.close()
+        return saga_id
+
+    def saga(self, saga_id):
+        with self.connect("a") as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, attempts, last_error FROM transfer_sagas WHERE id = %s", (saga_id,))
+            row = cursor.fetchone()
+        conn.close()
+        return row
+
+
+@pytest.fixture
+def bank(schemas):
+    return Bank(schemas)
+
+
+def test_settle_credits_recipient_once(bank):
+    saga_id = bank.begin(2500)
+    assert bank.sagas.settle("a", saga_id) == COMPLETED
+    assert bank.sagas.settle("a", saga_id) == COMPLETED
+    assert bank.balance("alice@example.com") == 7500
+    assert bank.balance("bob@example.com") == 2500
+    assert bank.saga(saga_id)[0] == COMPLETED
+
+
+def test_settle_after_crash_between_credit_and_completion_does_not_credit_again(bank):
+    saga_id = bank.begin(1000)
+    # Step 2 committed, then the settler died before step 3
+    with bank.connect("b") as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO saga_credits (saga_id, to_email, amount_cents) VALUES (%s, 'bob@example.com', 1000)", (saga_id,))
+        cursor.execute("UPDATE accounts SET balance_cents = balance_cents + 1000 WHERE email = 'bob@example.com'")
+    conn.close()
+    assert bank.sagas.settle("a", saga_id) == COMPLETED
+    assert bank.balance("bob@example.com") == 1000
+
+
+def test_failed_credit_stays_pending_and_recovers(bank):
+    saga_id = bank.begin(500)
+    bank.fail_credits = 1
+    assert bank.sagas.settle("a", saga_id) == PENDING
+    status, attempts, last_error = bank.saga(saga_id)
+    assert (status, attempts) == (PENDING, 1)
+    assert "unavailable" in last_error
+    assert bank.balance("bob@example.com") == 0
+
+    assert bank.sagas.recover("a") == {COMPLETED: 1}
+    assert bank.saga(saga_id) == (COMPLETED, 2, None)
+    assert bank.balance("bob@example.com") == 500
+    assert bank.sagas.recover("a") == {}
+
+
+def test_missing_recipient_compensates_sender(bank):
+    saga_id = bank.begin(4000)
+    with bank.connect("b") as conn:
+        conn.cursor().execute("DELETE FROM accounts WHERE email = 'bob@example.com'")
+    conn.close()
+    assert bank.sagas.settle("a", saga_id) == COMPENSATED
+    assert bank.balance("alice@example.com") == 10000
+    # The rolled-back credit left no saga_credits row behind
+    with bank.connect("b") as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM saga_credits")
+        assert cursor.fetchone()[0] == 0
+    conn.close()
+    # Compensation is final
+    assert bank.sagas.settle("a", saga_id) == COMPENSATED
+    assert bank.balance("alice@example.com") == 10000
+
+
+def test_metrics_report_pending_sagas(bank):
+    bank.fail_credits = 1
+    bank.sagas.settle("a", bank.begin(100))
+    with bank.connect("a") as conn:
+        metrics = bank.sagas.metrics(conn.cursor())
+    conn.close()
+    assert metrics["pending"] == 1
+    assert metrics["oldest_pending_seconds"] is not None
@@ -0,0 +1,115 @@
+from collections import Counter
+
+import pytest
+
+import sharding
+from sharding import ID_STRIDE, align_sequences, bucket_for, bucket_sql, next_id, plan_rebalance
+
+EMAILS = [f"user{i}@example.com" for i in range(500)] + ["Mixed.Case@Example.COM", "ünïcode@example.com", "a@b.c"]
+
+
+def test_bucket_for_is_in_range_and_case_insensitive():
+    for email in EMAILS:
+        assert 0 <= bucket_for(email, 1024) < 1024
+        assert bucket_for(email, 1024) == bucket_for(email.upper(), 1024)
+
+
+def test_bucket_sql_matches_bucket_for(schemas):
+    with schemas("directory") as conn:
+        cursor = conn.cursor()
+        for bucket_count in (1, 7, 1024):
+            cursor.execute(f"SELECT email, {bucket_sql('email', bucket_count)} FROM unnest(%s::text[]) AS t(email)", (EMAILS,))
+            for email, bucket in cursor.fetchall():
+                assert bucket == bucket_for(email, bucket_count), email
+    conn.close()
+
+
+def test_next_id_belongs_to_shard_and_is_the_smallest_above():
+    for shard_index in (0, 1, 5, ID_STRIDE - 1):
+        for after in (0, 1, shard_index, shard_index + 1, ID_STRIDE - 1, ID_STRIDE, 5 * ID_STRIDE + 3, 10 ** 12):
+            candidate = next_id(after, shard_index)
+            assert candidate > after
+            assert candidate % ID_STRIDE == shard_index
+            assert candidate - ID_STRIDE <= after
+
+
+def _apply(owners, moves):
+    owners = list(owners)
+    for bucket, source, target in moves:
+        assert owners[bucket] == source
+        owners[bucket] = target
+    return owners
+
+
+def test_plan_rebalance_spreads_one_shard_evenly():
+    owners = ["a"] * 10
+    moves = plan_rebalance(owners, ["a", "b", "c"])
+    assert Counter(_apply(owners, moves)) == {"a": 4, "b": 3, "c": 3}
+    # Only the surplus moves
+    assert len(moves) == 6
+    assert all(source == "a" for _, source, _ in moves)
+
+
+def test_plan_rebalance_drains_shards_left_out():
+    owners = ["a", "b", "c", "a", "b", "c"]
+    moves = plan_rebalance(owners, ["a", "b"])
+    assert Counter(_apply(owners, moves)) == {"a": 3, "b": 3}
+    assert sorted(bucket for bucket, _, _ in moves) == [2, 5]
+
+
+def test_plan_rebalance_leaves_balanced_map_alone():
+    assert plan_rebalance(["a", "b", "a", "b"], ["a", "b"]) == []
+
+
+@pytest.mark.parametrize("bucket_count", [1, 2, 3, 1024])
+def test_plan_rebalance_moves_cover_quota(bucket_count):
+    owners = ["a"] * bucket_count
+    shards = ["a", "b", "c", "d"]
+    counts = Counter(_apply(owners, plan_rebalance(owners, shards)))
+    assert sum(counts.values()) == bucket_count
+    assert max(counts.values()) - min(counts.get(shard, 0) for shard in shards) <= 1
+
+
+def _create_id_tables(cursor):
+    for table in sharding.GLOBAL_SEQUENCES:
+        cursor.execute(f"CREATE TABLE {table} (id BIGSERIAL PRIMARY KEY)")
+
+
+def _next_ids(cursor, count=3):
+    ids = {}
+    for table in sharding.GLOBAL_SEQUENCES:
+        cursor.execute(f"INSERT INTO {table} SELECT FROM generate_series(1, %s) RETURNING id", (count,))
+        ids[table] = sorted(id_ for id_, in cursor.fetchall())
+    return ids
+
+
+def test_align_sequences_gives_shards_disjoint_ids_above_existing_rows(schemas):
+    seen = {table: set() for table in sharding.GLOBAL_SEQUENCES}
+    for shard_index, name in enumerate(("a", "b")):
+        with schemas(name) as conn:
+            cursor = conn.cursor()
+            _create_id_tables(cursor)
+            existing = _next_ids(cursor, 5 + shard_index)
+            align_sequences(cursor, shard_index)
+            for table, ids in _next_ids(cursor).items():
+                assert min(ids) > max(existing[table])
+                assert all(id_ % ID_STRIDE == shard_index for id_ in ids)
+                assert not seen[table] & set(ids)
+                seen[table].update(ids)
+            conn.commit()
+        conn.close()
+
+
+def test_align_sequences_is_idempotent(schemas):
+    with schemas("a") as conn:
+        cursor = conn.cursor()
+        _create_id_tables(cursor)
+        align_sequences(cursor, 3)
+        first = _next_ids(cursor)
+        align_sequences(cursor, 3)
+        second = _next_ids(cursor)
+        for table in sharding.GLOBAL_SEQUENCES:
+            # A second run does not restart the sequences
+            assert min(second[table]) == max(first[table]) + ID_STRIDE
+    conn.close()
+
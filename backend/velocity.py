@@ -0,0 +1,199 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Each window is tracked as this many buckets, so it slides in steps of window/BUCKETS_PER_WINDOW
+BUCKETS_PER_WINDOW = 60
+
+METRICS = ("count", "amount", "recipient_count")
+ACTIONS = ("withdraw", "transfer")
+
+
+class VelocityLimitExceeded(Exception):
+    def __init__(self, rule):
+        super().__init__(f"Velocity limit exceeded: {rule['name']}")
+        self.rule = rule
+
+
+def parse_rules(text):
+    """Velocity rules from a JSON list.
+
+    Each rule is {"name", "metric", "window_seconds", "limit", "actions"}:
+    metric "count" limits operations per account, "amount" limits the
+    total amount in integer cents, and "recipient_count" limits transfers
+    from one account to the same recipient. actions defaults to both
+    withdraw and transfer.
+    """
+    rules = []
+    for rule in json.loads(text):
+        rule = {"actions": list(ACTIONS), **rule}
+        if rule.get("metric") not in METRICS:
+            raise ValueError(f"Velocity rule {rule.get('name')!r}: metric must be one of {METRICS}")
+        if not set(rule["actions"]) <= set(ACTIONS):
+            raise ValueError(f"Velocity rule {rule.get('name')!r}: actions must be among {ACTIONS}")
+        if not rule.get("name") or rule.get("window_seconds", 0) <= 0 or rule.get("limit", -1) < 0:
+            raise ValueError(f"Velocity rule {rule!r} needs a name, a positive window_seconds and a limit")
+        rules.append(rule)
+    return rules
+
+
+class MemoryVelocityStore:
+    """Sliding-window (count, amount) totals per key, in process memory.
+
+    A window is a deque of BUCKETS_PER_WINDOW time buckets plus running
+    totals, so adding and reading is O(1) amortized: expired buckets are
+    dropped from the left as time moves on. Bounded by max_keys, evicting
+    the least recently used keys.
+    """
+
+    def __init__(self, max_keys=200000):
+        self.max_keys = max_keys
+        # key -> [deque([[bucket, count, amount]]), count, amount]
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, window_seconds, count, amount, at):
+        """Add to the bucket holding time `at` and return the window's (count, amount) totals"""
+        bucket = int(at // (window_seconds / BUCKETS_PER_WINDOW))
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                state = self._windows[key] = [deque(), 0, 0]
+                while len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(key)
+            buckets = state[0]
+            newest = max(bucket, buckets[-1][0]) if buckets else bucket
+            while buckets and buckets[0][0] <= newest - BUCKETS_PER_WINDOW:
+                _, expired_count, expired_amount = buckets.popleft()
+                state[1] -= expired_count
+                state[2] -= expired_amount
+            if count > 0 and (not buckets or bucket > buckets[-1][0]):
+                buckets.append([bucket, 0, 0])
+            # Usually the last bucket; a release targets the bucket it was counted in, if still there
+            entry = next((entry for entry in reversed(buckets) if entry[0] == bucket), None)
+            if entry is not None:
+                entry[1] += count
+                entry[2] += amount
+                state[1] += count
+                state[2] += amount
+            return state[1], state[2]
+
+
+class RedisVelocityStore:
+    """MemoryVelocityStore's interface on Redis, for limits shared by all app instances.
+
+    Each window is a hash of per-bucket counters; a read sums the buckets
+    still inside the window (at most BUCKETS_PER_WINDOW of them).
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("VELOCITY_BACKEND is a Redis URL but the redis package is not installed (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def add(self, key, window_seconds, count, amount, at):
+        bucket = int(at // (window_seconds / BUCKETS_PER_WINDOW))
+        redis_key = f"velocity:{key}:{window_seconds}"
+        pipe = self.client.pipeline()
+        pipe.hincrby(redis_key, f"c{bucket}", count)
+        pipe.hincrby(redis_key, f"a{bucket}", amount)
+        pipe.expire(redis_key, int(window_seconds * 2) + 1)
+        pipe.hgetall(redis_key)
+        fields = pipe.execute()[-1]
+        total_count = total_amount = 0
+        stale = []
+        for field, value in fields.items():
+            field = field.decode()
+            if int(field[1:]) <= bucket - BUCKETS_PER_WINDOW:
+                stale.append(field)
+            elif field[0] == "c":
+                total_count += int(value)
+            else:
+                total_amount += int(value)
+        if stale:
+            self.client.hdel(redis_key, *stale)
+        return total_count, total_amount
+
+
+def make_store(spec):
+    """"memory" or a redis:// URL"""
+    if spec == "memory":
+        return MemoryVelocityStore()
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisVelocityStore(spec)
+    raise ValueError(f"Unknown velocity backend: {spec!r} (use memory or a redis:// URL)")
+
+
+class VelocityChecker:
+    """Evaluates velocity rules against a counter store on the money-moving path.
+
+    reserve() counts the operation against every matching rule and raises
+    VelocityLimitExceeded (with nothing counted) if any limit would be
+    passed; release() takes a reservation back when the operation then
+    fails. Reserving up front keeps concurrent requests from slipping past
+    a limit together. Every rule evaluation is timed.
+    """
+
+    def __init__(self, store, rules):
+        self.store = store
+        self.rules = rules
+        self._stats = {rule["name"]: {"evaluations": 0, "rejections": 0, "seconds": 0.0, "max_seconds": 0.0} for rule in rules}
+        self._lock = threading.Lock()
+
+    def _key(self, rule, account, recipient):
+        if rule["metric"] == "recipient_count":
+            return f"{rule['name']}:{account}>{recipient}"
+        return f"{rule['name']}:{account}"
+
+    def _timed(self, rule, started, rejected):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[rule["name"]]
+            stats["evaluations"] += 1
+            stats["rejections"] += rejected
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def reserve(self, action, account, amount, recipient=None):
+        """Count an operation against the rules; returns a reservation for release()"""
+        at = time.time()
+        reserved = []
+        for rule in self.rules:
+            if action not in rule["actions"] or (rule["metric"] == "recipient_count" and recipient is None):
+                continue
+            started = time.perf_counter()
+            key = self._key(rule, account, recipient)
+            count, total = self.store.add(key, rule["window_seconds"], 1, amount, at)
+            reserved.append((key, rule["window_seconds"], amount))
+            exceeded = (total if rule["metric"] == "amount" else count) > rule["limit"]
+            self._timed(rule, started, exceeded)
+            if exceeded:
+                self.release((at, reserved))
+                logger.warning(f"Velocity rule {rule['name']} rejected {action}: account={account}, count={count}, amount={total}")
+                raise VelocityLimitExceeded(rule)
+        return at, reserved
+
+    def release(self, reservation):
+        at, reserved = reservation
+        for key, window_seconds, amount in reserved:
+            self.store.add(key, window_seconds, -1, -amount, at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "evaluations": s["evaluations"],
+                    "rejections": s["rejections"],
+                    "avg_ms": round(s["seconds"] / s["evaluations"] * 1000, 3) if s["evaluations"] else None,
+                    "max_ms": round(s["max_seconds"] * 1000, 3),
+                }
+                for name, s in self._stats.items()
+            }
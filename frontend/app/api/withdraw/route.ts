@@ -3,12 +3,14 @@ import { NextRequest, NextResponse } from 'next/server';
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json();
+    const idempotencyKey = request.headers.get('idempotency-key');
     
     const apiBase = process.env.BACKEND_URL || 'http://localhost:8000';
     const response = await fetch(`${apiBase}/withdraw`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...(idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}),
       },
       body: JSON.stringify(body),
     });